@@ -0,0 +1,580 @@
+import argparse, json, logging, os, re, socket, tempfile, threading, time, paramiko
+
+import fixtures
+
+# Offline stand-in for a RouterOS device: interactive shell, exec requests and SFTP on top of paramiko's
+# server interfaces, replaying the outputs generated in fixtures.py with configurable latency and bandwidth
+
+logging.getLogger("fake_routeros").addHandler(logging.NullHandler())
+logging.getLogger("fake_routeros").propagate = False
+
+ERROR_PREFIXES = ("failure:", "syntax error", "expected ", "bad command name", "input does not match")
+
+CONDITION = re.compile(r'([a-zA-Z.][\w.-]*)=("(?:[^"\\]|\\.)*"|[^\s)]+)')
+
+# Text tables the getters print, regenerated from the filtered records when a 'where' is appended
+TABLES = {
+    "/interface print detail without-paging": ("/interface", fixtures.interfaces_detail),
+    "/ip addr print without-paging": ("/ip address", fixtures.ip_addresses_table),
+    "/ip service print without-paging": ("/ip service", fixtures.services_table),
+    "/user print": ("/user", fixtures.users_table),
+}
+
+def conditions(where):
+    # 'key=value' conditions joined with 'and'; yes/no compare equal to the true/false records hold
+    pairs = {}
+
+    for key, value in CONDITION.findall(where):
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"').replace('\\$', '$').replace('\\\\', '\\')
+
+        pairs[key] = {"yes": "true", "no": "false"}.get(value, value)
+
+    return pairs
+
+
+def matches(record, pairs):
+    return all(str(record.get(key, "")) == value for key, value in pairs.items())
+
+
+class FakeRouter:
+    def __init__(self, root, routes=1000, interfaces=8, export_lines=200, latency=0.0, bandwidth=None):
+        self.root = root
+        self.route_count = routes
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.errors = {}
+        self.commands = 0
+        self.records = {
+            "/interface": fixtures.interfaces(interfaces),
+            "/ip address": fixtures.ip_addresses(),
+            "/ip service": fixtures.services(),
+            "/user": fixtures.users(),
+            "/ip firewall address-list": [],
+            "/ip dhcp-server network": [{".id": "*1", "address": "172.16.0.0/24", "gateway": "172.16.0.1"}],
+        }
+        self.responses = {
+            "/system identity print": f"  name: {fixtures.IDENTITY}",
+            "/interface print detail without-paging": fixtures.interfaces_detail(self.records['/interface']),
+            "/ip addr print without-paging": fixtures.ip_addresses_table(self.records['/ip address']),
+            "/system resource print": fixtures.resources(),
+            "/ip service print without-paging": fixtures.services_table(self.records['/ip service']),
+            "/user print": fixtures.users_table(self.records['/user']),
+            "/export terse": fixtures.export(export_lines),
+            "/ip dhcp-server network print": " #   ADDRESS            GATEWAY         DNS-SERVER      WINS-SERVER     DOMAIN\n 0   172.16.0.0/24      172.16.0.1",
+            "/system package update print": "          channel: long-term\n installed-version: 6.49.10\n   latest-version: 6.49.10\n           status: System is already up to date",
+            "/interface wireless print detail": ' 0 X  name="wlan1" mtu=1500 mac-address=AA:BB:CC:FF:00:01 frequency=2412 band=2ghz-b/g/n\n'
+                                                ' 1 X  name="wlan2" mtu=1500 mac-address=AA:BB:CC:FF:00:02 frequency=5180 band=5ghz-a/n',
+            "/system license get nlevel": "4",
+            "/system package update get latest-version": "6.49.10",
+            "/system package update get status": "System is already up to date",
+            "/system package update get installed-version": "6.49.10",
+            "/system resource get version": "6.49.10 (long-term)",
+            "/ip cloud get dns-name": "abcd1234.sn.mynetname.net",
+            "/system resource get uptime": "1w2d03:04:05",
+        }
+        self.started = time.monotonic()
+
+    def throttle(self, size):
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def respond(self, command):
+        # An empty line only reprints the prompt, which the device does right away
+        if self.latency and command.strip() != "":
+            time.sleep(self.latency)
+
+        outputs = []
+
+        # Statements joined with ';' run as one script that stops at the first error, like RouterOS does
+        for statement in self.split_statements(command):
+            output = self.run(statement)
+            outputs.append(output)
+
+            if output.startswith(ERROR_PREFIXES):
+                break
+
+        return "\n".join(output for output in outputs if output != "")
+
+    def run(self, statement):
+        statement = statement.strip()
+        self.commands += 1
+
+        if statement == "":
+            return ""
+
+        for prefix, error in self.errors.items():
+            if statement.startswith(prefix):
+                return error
+
+        concat = re.match(r':put \((.*)\)$', statement)
+
+        if concat:
+            # Quoted strings and '[:len [<path> find where ...]]' counts joined with '.'
+            parts = re.findall(r'"([^"]*)"|\[:len \[(.+?) find(?: where)?(.*?)\]\]', concat.group(1))
+
+            return "".join(text if path == "" else str(sum(1 for record in self.records.get(path, []) if matches(record, conditions(where))))
+                           for text, path, where in parts)
+
+        literal = re.match(r':put "([^"]*)"$', statement)
+
+        if literal:
+            return literal.group(1)
+
+        serialize = re.match(r':put \[:serialize to=json \[(.*)\]\]$', statement)
+
+        if serialize:
+            return json.dumps(self.as_value(serialize.group(1)))
+
+        foreach = re.match(r':foreach item in=\[(.*?)\] do=', statement)
+
+        if foreach:
+            lines = []
+
+            for record in self.as_value(foreach.group(1)):
+                lines.extend(f"{key}={value}" for key, value in record.items())
+                lines.append(".")
+
+            return "\n".join(lines)
+
+        value = re.match(r':put \[(.*)\]$', statement)
+
+        if value:
+            return self.responses.get(value.group(1).strip(), "")
+
+        to_file = re.search(r" file=(\S+)", statement)
+
+        if to_file:
+            self.write_file(to_file.group(1), statement[:to_file.start()] + statement[to_file.end():])
+            return ""
+
+        if statement.startswith("/file remove "):
+            path = os.path.join(self.root, statement.split(" ", 2)[2].strip('"'))
+
+            if os.path.exists(path):
+                os.remove(path)
+                return ""
+
+            return "no such item"
+
+        if statement.startswith("/import file-name="):
+            return "Script file loaded and executed successfully"
+
+        if statement.startswith("/system backup save "):
+            name = re.search(r"name=(\S+)", statement).group(1)
+
+            with open(os.path.join(self.root, name), "wb") as backup:
+                backup.write(os.urandom(65536))
+
+            return "Configuration backup saved"
+
+        # Packages are downloaded at once; checking again reports the installed version as the latest
+        if statement == "/system package update download":
+            self.responses["/system package update get status"] = "Downloaded, please reboot router to upgrade it"
+            return ""
+
+        if statement == "/system package update check-for-updates once":
+            self.responses["/system package update get status"] = "System is already up to date"
+            return ""
+
+        if statement == "/ip route print count-only":
+            return str(self.route_count)
+
+        table, _, where = statement.partition(" where ")
+
+        if where and table in TABLES:
+            path, formatter = TABLES[table]
+
+            return formatter([record for record in self.records[path] if matches(record, conditions(where))])
+
+        if statement in self.responses:
+            return self.responses[statement]
+
+        # Anything else is a change that succeeds silently
+        return ""
+
+    def stream(self, command):
+        # Samples of monitor commands and '/log print follow', printed until the client closes the channel.
+        # None for any other command
+        interval = re.search(r" interval=([\d.]+)", command)
+        interval = float(interval.group(1)) if interval else 1.0
+
+        if command.startswith("/interface monitor-traffic "):
+            names = re.search(r'interface="?([^"\s]+)', command).group(1).split(",")
+            sample = lambda number: fixtures.traffic(names, number)
+
+        elif command.startswith("/system resource monitor"):
+            sample = fixtures.resource_sample
+
+        elif command.startswith("/log print follow"):
+            interval = 0.1
+            sample = fixtures.log_line
+
+        else:
+            return None
+
+        self.commands += 1
+
+        return self.samples(sample, interval)
+
+    def samples(self, sample, interval):
+        number = 0
+
+        while True:
+            yield sample(number) + "\n"
+            number += 1
+            time.sleep(interval)
+
+    def count_traffic(self):
+        # Interface counters grow by a fixed rate per interface: ether1 receives 1 Mbit/s, ether2 2 Mbit/s...
+        elapsed = time.monotonic() - self.started
+
+        for number, record in enumerate(self.records['/interface']):
+            record['rx-byte'] = str(int(elapsed * 125000 * (number + 1)))
+            record['tx-byte'] = str(int(elapsed * 12500 * (number + 1)))
+            record['rx-packet'] = str(int(elapsed * 100 * (number + 1)))
+            record['tx-packet'] = str(int(elapsed * 10 * (number + 1)))
+
+    def as_value(self, query):
+        path, _, arguments = query.partition(" print")
+
+        if path.strip() == "/interface":
+            self.count_traffic()
+
+        arguments, _, where = arguments.partition(" where ")
+        proplist = re.search(r"proplist=(\S+)", arguments)
+        records = [record for record in self.records.get(path.strip(), []) if matches(record, conditions(where))]
+
+        if proplist is None:
+            return records
+
+        fields = proplist.group(1).split(",")
+
+        return [{key: value for key, value in record.items() if key in fields} for record in records]
+
+    def write_file(self, name, statement):
+        with open(os.path.join(self.root, name), "w") as target:
+            if statement.startswith("/ip route print"):
+                target.writelines(self.routes(statement))
+            else:
+                target.write(self.run(statement).replace("\n", "\r\n"))
+
+    def routes(self, statement):
+        arguments, _, where = statement.partition(" where ")
+        proplist = re.search(r"proplist=(\S+)", arguments)
+
+        if where == "" and proplist is None:
+            yield from fixtures.routes(self.route_count)
+            return
+
+        pairs = conditions(where)
+        fields = None if proplist is None else proplist.group(1).split(",")
+
+        for line in fixtures.routes(self.route_count):
+            record = dict(CONDITION.findall(line))
+
+            if matches(record, pairs):
+                if fields is not None:
+                    line = " ".join(line.split()[:2] + [f"{key}={value}" for key, value in record.items() if key in fields]) + "\n"
+
+                yield line
+
+    def split_statements(self, command):
+        statements = []
+        depth = 0
+        quoted = False
+        start = 0
+
+        for position, character in enumerate(command):
+            if character == '"' and command[position - 1:position] != "\\":
+                quoted = not quoted
+
+            elif not quoted and character in "[{(":
+                depth += 1
+
+            elif not quoted and character in "]})":
+                depth -= 1
+
+            elif not quoted and depth == 0 and character == ";":
+                statements.append(command[start:position])
+                start = position + 1
+
+        statements.append(command[start:])
+
+        return statements
+
+
+class Session(paramiko.ServerInterface):
+    def __init__(self, server):
+        self.server = server
+
+    def check_auth_password(self, username, password):
+        # Login options such as '+ct511w4098h' are not part of the user name
+        if username.split("+", 1)[0] == self.server.username and password == self.server.password:
+            return paramiko.AUTH_SUCCESSFUL
+
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=self.server.shell, args=(channel,), daemon=True).start()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.server.execute, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class RootSFTPHandle(paramiko.SFTPHandle):
+    def __init__(self, flags, router):
+        super().__init__(flags)
+        self.router = router
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def read(self, offset, length):
+        data = super().read(offset, length)
+
+        if isinstance(data, bytes):
+            self.router.throttle(len(data))
+
+        return data
+
+    def write(self, offset, data):
+        self.router.throttle(len(data))
+
+        return super().write(offset, data)
+
+
+class RootSFTPServer(paramiko.SFTPServerInterface):
+    def __init__(self, server, *args, router=None, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.router = router
+
+    def local_path(self, path):
+        return os.path.join(self.router.root, path.lstrip("/"))
+
+    def list_folder(self, path):
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.local_path(path), name)), name) for name in os.listdir(self.local_path(path))]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            descriptor = os.open(self.local_path(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+
+        handle = RootSFTPHandle(flags, self.router)
+        handle.filename = self.local_path(path)
+        handle.readfile = handle.writefile = os.fdopen(descriptor, mode)
+
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.local_path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self.local_path(oldpath), self.local_path(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        return paramiko.SFTP_OK
+
+
+class FakeRouterOSServer:
+    def __init__(self, host="127.0.0.1", port=0, username="admin", password="admin", root=None, **router_options):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.root = root or tempfile.mkdtemp(prefix="fake_routeros_")
+        self.router = FakeRouter(self.root, **router_options)
+        self.key = paramiko.RSAKey.generate(2048)
+        self.socket = None
+        self.transports = []
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(128)
+        self.port = self.socket.getsockname()[1]
+
+        threading.Thread(target=self.accept, daemon=True).start()
+
+        return self.host, self.port
+
+    def stop(self):
+        self.socket.close()
+
+        for transport in self.transports:
+            transport.close()
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.socket.accept()
+            except OSError:
+                return
+
+            # Small writes (exit status, EOF, prompt) must not wait for delayed ACKs or latency numbers are skewed
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def handle(self, client):
+        transport = paramiko.Transport(client)
+        # Clients dropping the connection are expected here, not worth a "Socket exception" on stderr
+        transport.set_log_channel("fake_routeros")
+        transport.add_server_key(self.key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, RootSFTPServer, router=self.router)
+        self.transports.append(transport)
+
+        try:
+            transport.start_server(server=Session(self))
+        except (paramiko.SSHException, EOFError):
+            return
+
+        # Channels are served from the Session callbacks. Accepted channels must stay referenced,
+        # paramiko closes a channel as soon as it is garbage collected
+        channels = []
+
+        while transport.is_active():
+            channel = transport.accept(1)
+
+            if channel is not None:
+                channels = [channel for channel in channels if not channel.closed] + [channel]
+
+    def send(self, channel, output):
+        data = output.encode()
+
+        for start in range(0, len(data), 32768):
+            self.router.throttle(len(data[start:start + 32768]))
+            channel.sendall(data[start:start + 32768])
+
+    def shell(self, channel):
+        pending = ""
+
+        try:
+            channel.sendall(("\r\n" + fixtures.PROMPT).encode())
+
+            while True:
+                data = channel.recv(65536)
+
+                if not data:
+                    break
+
+                pending += data.decode(errors="replace")
+
+                while True:
+                    # A lone trailing "\r" may be the first half of "\r\n" split across packets
+                    line = re.match(r"(.*?)(\r\n|\n|\r(?=.))", pending, re.S)
+
+                    if line is None:
+                        break
+
+                    pending = pending[line.end():]
+                    command = line.group(1)
+
+                    if command.strip() == "quit":
+                        channel.close()
+                        return
+
+                    output = self.router.respond(command)
+
+                    if output != "":
+                        output = output.replace("\n", "\r\n") + "\r\n"
+
+                    # Echo, output and prompt go out in one write: Netmiko polls the channel with short sleeps and a
+                    # prompt delayed by Nagle's algorithm would be read as the output of the next command
+                    self.send(channel, command + "\r\n" + output + "\r\n" + fixtures.PROMPT)
+
+        except (OSError, EOFError):
+            pass
+
+    def execute(self, channel, command):
+        # This thread starts inside check_channel_exec_request(). Yield to the transport thread first so the reply
+        # to the exec request goes out before our close, otherwise the client only sees a closed channel
+        time.sleep(0.001)
+
+        try:
+            samples = self.router.stream(command)
+
+            if samples is not None:
+                for output in samples:
+                    if channel.closed:
+                        break
+
+                    self.send(channel, output.replace("\n", "\r\n"))
+
+                return
+
+            output = self.router.respond(command)
+
+            if output != "":
+                self.send(channel, output.replace("\n", "\r\n") + "\r\n")
+
+            channel.send_exit_status(1 if output.startswith(ERROR_PREFIXES) else 0)
+
+        except (OSError, EOFError):
+            pass
+
+        finally:
+            channel.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an offline fake RouterOS SSH/SFTP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--routes", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every command")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second for outputs and SFTP transfers")
+    arguments = parser.parse_args()
+
+    server = FakeRouterOSServer(arguments.host, arguments.port, arguments.username, arguments.password,
+                                routes=arguments.routes, latency=arguments.latency, bandwidth=arguments.bandwidth)
+    print("Fake RouterOS listening on {}:{} (root {})".format(*server.start(), server.root))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,153 @@
+# Synthetic RouterOS outputs in the same format the device prints them, so any table size can be replayed
+
+IDENTITY = "MikroTik"
+PROMPT = f"[admin@{IDENTITY}] > "
+
+
+def mac_address(number):
+    return "AA:BB:CC:{:02X}:{:02X}:{:02X}".format((number >> 16) & 255, (number >> 8) & 255, number & 255)
+
+
+def ip_address(number, base=10):
+    return f"{base}.{(number >> 16) & 255}.{(number >> 8) & 255}.{number & 255}"
+
+
+def interfaces(count=8):
+    records = []
+
+    for number in range(count):
+        records.append({
+            ".id": f"*{number + 1:X}",
+            "name": f"ether{number + 1}",
+            "default-name": f"ether{number + 1}",
+            "type": "ether",
+            "mtu": "1500",
+            "actual-mtu": "1500",
+            "l2mtu": "1598",
+            "mac-address": mac_address(number),
+            "running": "true" if number % 3 != 2 else "false",
+            "disabled": "true" if number % 3 == 2 else "false",
+            "slave": "false",
+            "dynamic": "false",
+            "rx-byte": "0", "tx-byte": "0", "rx-packet": "0", "tx-packet": "0",
+            "rx-error": "0", "tx-error": "0", "rx-drop": "0", "tx-drop": "0",
+        })
+
+    return records
+
+
+def interfaces_detail(records):
+    lines = ["Flags: D - dynamic, X - disabled, R - running, S - slave "]
+
+    for number, record in enumerate(records):
+        flags = "X" if record['disabled'] == "true" else "R" if record['running'] == "true" else " "
+        lines.append(f' {number:<2} {flags}  name="{record["name"]}" default-name="{record["default-name"]}" type="{record["type"]}" mtu={record["mtu"]} '
+                     f'actual-mtu={record["actual-mtu"]} l2mtu={record["l2mtu"]} max-l2mtu=2028 mac-address={record["mac-address"]} last-link-up-time=jun/01/2021 10:00:00 link-downs=0')
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def ip_addresses(count=4):
+    return [{".id": f"*{number + 1:X}", "address": f"172.16.{number}.1/24", "network": f"172.16.{number}.0",
+             "interface": f"ether{number + 1}", "disabled": "false", "dynamic": "false", "invalid": "false"} for number in range(count)]
+
+
+def ip_addresses_table(records):
+    lines = ["Flags: X - disabled, I - invalid, D - dynamic ", " #   ADDRESS            NETWORK         INTERFACE"]
+
+    for number, record in enumerate(records):
+        lines.append(f" {number:<3} {record['address']:<18} {record['network']:<15} {record['interface']}")
+
+    return "\n".join(lines)
+
+
+def services():
+    return [{".id": f"*{number + 1:X}", "name": name, "port": str(port), "address": "", "disabled": "true" if name in ("telnet", "ftp") else "false"}
+            for number, (name, port) in enumerate((("telnet", 23), ("ftp", 21), ("www", 80), ("ssh", 22), ("www-ssl", 443), ("api", 8728), ("winbox", 8291), ("api-ssl", 8729)))]
+
+
+def services_table(records):
+    lines = ["Flags: X - disabled, I - invalid ", " #   NAME                                PORT ADDRESS                                       CERTIFICATE  "]
+
+    for number, record in enumerate(records):
+        flag = "X" if record['disabled'] == "true" else " "
+        lines.append(f" {number:<2} {flag} {record['name']:<35} {record['port']:<4}")
+
+    return "\n".join(lines)
+
+
+def users(count=3):
+    return [{".id": f"*{number + 1:X}", "name": "admin" if number == 0 else f"user{number}", "group": "full" if number == 0 else "read"} for number in range(count)]
+
+
+def users_table(records):
+    lines = ["Flags: X - disabled ", "  #   NAME                                                   GROUP                                                  ADDRESS            LAST-LOGGED-IN      "]
+
+    for number, record in enumerate(records):
+        lines.append(f"  {number:<3} {record['name']:<54} {record['group']}")
+
+    return "\n".join(lines)
+
+
+def resources():
+    return "\n".join([
+        "                   uptime: 1w2d3h4m5s",
+        "                  version: 6.49.10 (long-term)",
+        "               build-time: Sep/06/2023 10:00:00",
+        "         factory-software: 6.44.6",
+        "              free-memory: 98.5MiB",
+        "             total-memory: 128.0MiB",
+        "                      cpu: ARMv7",
+        "                cpu-count: 4",
+        "            cpu-frequency: 716MHz",
+        "                 cpu-load: 3%",
+        "           free-hdd-space: 2136.0KiB",
+        "          total-hdd-space: 16.0MiB",
+        "        architecture-name: arm",
+        "               board-name: hAP ac^2",
+        "                 platform: MikroTik",
+    ])
+
+
+def traffic(names, sample):
+    # One '/interface monitor-traffic ... without-paging' sample, one column per interface
+    rows = [("name", names),
+            ("rx-packets-per-second", [str(10 + sample + number) for number in range(len(names))]),
+            ("rx-bits-per-second", [f"{8 + sample}.2kbps" for number in range(len(names))]),
+            ("tx-packets-per-second", [str(3 + number) for number in range(len(names))]),
+            ("tx-bits-per-second", ["1200bps" for number in range(len(names))])]
+
+    return "\n".join(f"{key:>25}: " + " ".join(f"{value:<10}" for value in values).rstrip() for key, values in rows) + "\n"
+
+
+def resource_sample(sample):
+    return "\n".join([
+        f"          cpu-used: {sample % 100}%",
+        f"  cpu-used-per-cpu: {sample % 100}%,1%,0%,0%",
+        f"       free-memory: {98 + sample % 10}.5MiB",
+    ]) + "\n"
+
+
+def log_line(sample):
+    return f" 10:22:{sample % 60:02} system,info,account user admin logged in from 10.0.0.{sample % 254 + 1} via ssh"
+
+
+def routes(count):
+    # Yields terse lines one by one so a million routes never live in memory at once
+    for number in range(count):
+        gateway = ip_address(number % 254 + 1, 192)
+        yield (f" {number} ADS  dst-address={ip_address(number << 8, 10)}/24 gateway={gateway} gateway-status={gateway} reachable via  ether1 "
+               f"distance={number % 20 + 1} scope=30 target-scope=10 vrf-interface=ether1\n")
+
+
+def export(count=200):
+    lines = ["# jun/01/2021 19:04:03 by RouterOS 6.49.10", "# software id = XXXX-XXXX", "#", "# model = RouterBOARD", "# serial number = FFFFFFFFFFF",
+             "/interface bridge add name=lo0"]
+
+    for number in range(count):
+        lines.append(f"/ip firewall filter add action=accept chain=input comment=\"rule {number}\" dst-port={1000 + number} protocol=tcp")
+
+    lines.append(f"/system identity set name={IDENTITY}")
+
+    return "\n".join(lines)
@@ -0,0 +1,445 @@
+import argparse, contextlib, io, itertools, json, multiprocessing, os, re, resource, statistics, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtures
+from fake_routeros import FakeRouterOSServer
+from netmiko import Netmiko
+from routeros_ssh_connector import MikrotikDevice
+
+# Measures connect time, command round trips against the old delay_factor path, per-method latency (wall and CPU),
+# parse throughput, route streaming and SFTP transfer rate.
+# By default everything runs against a local FakeRouterOSServer, so results only depend on this code and this box
+
+BASELINE_ROUTES = "routes_baseline.txt"
+
+
+def legacy_parse_routes(lines):
+    # Route parser shipped before parse_terse_line(), kept here as the baseline for the parse benchmarks
+    routes = []
+
+    for line in lines:
+        parsed = re.sub(" +", " ", line).strip()
+
+        if re.search("^([0-9]|[1-9][0-9]{1,5}|[1-7][0-9]{6}|8000000)", parsed):
+            route = {}
+            route_line = parsed.split(" ")
+
+            route['flags'] = route_line[1]
+            route["destination"] = re.search(r'dst-address=(.*?) [a-z]', parsed).group(1)
+
+            if "gateway" in parsed:
+                route["gateway"] = re.search(r'gateway=(.*?) [a-z]', parsed).group(1)
+            else:
+                route["gateway"] = ""
+
+            route["distance"] = re.search(r'distance=(.*?) [a-z]', parsed).group(1)
+
+            routes.append(route)
+
+    return routes
+
+
+def legacy_route_delay(connection):
+    # delay_factor get_routes() picked from the size of the table before prompt-driven reads
+    total_routes = int(connection.send_command("/ip route print count-only"))
+
+    return 4 if total_routes <= 500 else 8 if total_routes <= 1500 else 16 if total_routes <= 2500 else 32
+
+
+def legacy_enable_cloud_dns(connection):
+    connection.send_command("/ip cloud set ddns-enabled=yes")
+    time.sleep(2)
+
+    return connection.send_command(":put [/ip cloud get dns-name]")
+
+
+def measure(function, repeat):
+    # Median wall and CPU time in milliseconds; a failing call is reported instead of aborting the run
+    walls = []
+    cpus = []
+
+    for _ in range(repeat):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = function()
+
+                # Generators are drained so streaming methods are timed to the last line
+                if hasattr(result, "__next__"):
+                    for _ in result:
+                        pass
+
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+        walls.append((time.perf_counter() - wall) * 1000)
+        cpus.append((time.process_time() - cpu) * 1000)
+
+    return {"wall_ms": round(statistics.median(walls), 3), "cpu_ms": round(statistics.median(cpus), 3)}
+
+
+def max_rss():
+    # Peak resident set size of this process in MiB (ru_maxrss is in KiB on Linux and in bytes on macOS)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1048576 if sys.platform == "darwin" else 1024)
+
+
+def in_child(setup, function):
+    # Runs function(setup()) in a forked process, so the peak RSS belongs to that run alone. The child starts with
+    # the RSS of this process, so the growth during function() is reported as well
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+
+    def run():
+        try:
+            data = setup()
+            start = max_rss()
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = function(data)
+
+            result.update(max_rss_mib=round(max_rss(), 2), rss_growth_mib=round(max_rss() - start, 2))
+
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+
+        sender.send(result)
+
+    process = context.Process(target=run)
+    process.start()
+    sender.close()
+
+    try:
+        return receiver.recv()
+    except EOFError:
+        return {"error": f"benchmark process exited with code {process.exitcode}"}
+    finally:
+        process.join()
+
+
+def method_calls(device, workdir):
+    # One representative call for every public MikrotikDevice method, grouped like the README table
+    return {
+        "GET": {
+            "get_config_snapshot": lambda: device.get_config_snapshot(),
+            "get_export_configuration": lambda: device.get_export_configuration(),
+            "get_identity": lambda: device.get_identity(),
+            "get_interface_stats": lambda: device.get_interface_stats(),
+            "get_interfaces": lambda: device.get_interfaces(),
+            "get_inventory": lambda: device.get_inventory(),
+            "get_ip_addresses": lambda: device.get_ip_addresses(),
+            "get_resources": lambda: device.get_resources(),
+            "get_routes": lambda: device.get_routes(),
+            "get_services": lambda: device.get_services(),
+            "get_users": lambda: device.get_users(),
+            "iter_routes": lambda: device.iter_routes(),
+            "print_as_value": lambda: device.print_as_value("/interface"),
+            "stream_export": lambda: device.stream_export(),
+        },
+        "UPDATE": {
+            "update_address_pool": lambda: device.update_address_pool("pool1", addresses="10.0.0.10-10.0.0.20"),
+            "update_dhcp_client": lambda: device.update_dhcp_client("ether1", "no", "yes", 1, "yes", "yes"),
+            "update_dhcp_server_network": lambda: device.update_dhcp_server_network("172.16.0.0/24", gateway="172.16.0.254"),
+            "update_dhcp_server_server": lambda: device.update_dhcp_server_server("ether1", lease_time="01:00:00"),
+            "update_identity": lambda: device.update_identity(fixtures.IDENTITY),
+            "update_ip_address": lambda: device.update_ip_address("ether1", "172.16.0.1/24"),
+            "update_services": lambda: device.update_services("telnet", "yes"),
+            "update_user": lambda: device.update_user("user1", "secret", "read"),
+        },
+        "CREATE": {
+            "create_address_pool": lambda: device.create_address_pool("pool1", "10.0.0.10-10.0.0.20"),
+            "create_dhcp_client": lambda: device.create_dhcp_client("ether2"),
+            "create_dhcp_server": lambda: device.create_dhcp_server("ether1"),
+            "create_ip_address": lambda: device.create_ip_address("172.16.10.1/24", "ether5"),
+            "create_route": lambda: device.create_route("10.0.0.0/8", "192.0.0.1", 1),
+            "create_user": lambda: device.create_user("user9", "secret", "read"),
+        },
+        "TOOLS": {
+            "batch": lambda: device.batch().create_route("10.0.0.0/8", "192.0.0.1", 1).update_identity(fixtures.IDENTITY).execute(),
+            "check_for_updates": lambda: device.check_for_updates(),
+            "configure_wlan": lambda: device.configure_wlan("benchmark", "secret123", "both"),
+            "create_routes": lambda: device.create_routes({"dst_address": fixtures.ip_address(number << 8) + "/24", "gateway": "192.0.0.1"} for number in range(1000)),
+            "download_backup": lambda: device.download_backup(workdir),
+            "download_export": lambda: device.download_export(workdir),
+            "download_update": lambda: device.download_update(),
+            "enable_cloud_dns": lambda: device.enable_cloud_dns(),
+            "load_address_list": lambda: device.load_address_list("benchmark", (fixtures.ip_address(number) for number in range(1000))),
+            "make_backup": lambda: device.make_backup(),
+            "reboot_device": lambda: device.reboot_device(),
+            "run_batch": lambda: device.run_batch(["/system identity print", "/user print"]),
+            "run_commands": lambda: device.run_commands(["/system identity print", "/user print"]),
+            "send_command": lambda: device.send_command("/system identity print"),
+            "stream_command": lambda: device.stream_command("/user print"),
+            "update_system": lambda: device.update_system(),
+            "upload_file": lambda: device.upload_file(workdir, "upload.bin"),
+        },
+        "MONITOR": {
+            "follow_log": lambda: first_events(device.follow_log(history=True)),
+            "monitor_resources": lambda: first_events(device.monitor_resources()),
+            "monitor_traffic": lambda: first_events(device.monitor_traffic(["ether1", "ether2"], interval=0.1)),
+        },
+    }
+
+
+def first_events(subscription, count=2):
+    # Subscriptions never end on their own, so they are timed from opening to their first events
+    with subscription:
+        return list(itertools.islice(subscription, count))
+
+
+def connect(target, backend):
+    device = MikrotikDevice(command_timeout=target['timeout'])
+    device.connect(target['host'], target['username'], target['password'], target['port'], backend=backend, exit_on_error=False)
+
+    return device
+
+
+def baseline_calls():
+    # The same commands sent the way they were before prompt-driven reads (netmiko with global_delay_factor=2 and
+    # per-command delay factors) and the way they are sent now, for each backend
+    route_print = f"/ip route print detail terse without-paging file={BASELINE_ROUTES}"
+
+    before = {
+        "get_identity": lambda connection: connection.send_command("/system identity print"),
+        "get_interfaces": lambda connection: connection.send_command("/interface print detail without-paging"),
+        "get_export_configuration": lambda connection: connection.send_command("/export terse", delay_factor=8),
+        "route_print_file": lambda connection: connection.send_command(route_print, delay_factor=legacy_route_delay(connection)),
+        "send_command": lambda connection: connection.send_command("/user print", delay_factor=8),
+        "enable_cloud_dns": legacy_enable_cloud_dns,
+    }
+    after = {
+        "get_identity": lambda device: device.run_command("/system identity print"),
+        "get_interfaces": lambda device: device.run_command("/interface print detail without-paging"),
+        "get_export_configuration": lambda device: device.run_command("/export terse"),
+        "route_print_file": lambda device: device.run_command(route_print, sentinel=True),
+        "send_command": lambda device: device.send_command("/user print"),
+        "enable_cloud_dns": lambda device: device.enable_cloud_dns(),
+    }
+
+    return before, after
+
+
+def bench_baseline(target, backends, repeat):
+    # Median round trip per command before and after, on the baseline connection and on every backend
+    before, after = baseline_calls()
+    results = {}
+
+    connection = Netmiko(host=target['host'], port=target['port'], username=target['username'], password=target['password'],
+                         device_type="mikrotik_routeros", global_cmd_verify=False, global_delay_factor=2, conn_timeout=5)
+
+    try:
+        results['delay_factor'] = {name: measure(lambda: call(connection), repeat) for name, call in before.items()}
+    finally:
+        connection.send_command(f"/file remove {BASELINE_ROUTES}")
+        connection.disconnect()
+
+    for backend in backends:
+        device = connect(target, backend)
+
+        try:
+            results[backend] = {name: measure(lambda: call(device), repeat) for name, call in after.items()}
+        finally:
+            device.run_command(f"/file remove {BASELINE_ROUTES}")
+            device.disconnect()
+
+    return results
+
+
+def bench_connect(target, backends, repeat):
+    results = {}
+
+    for backend in backends:
+        results[backend] = measure(lambda: connect(target, backend).disconnect(), repeat)
+
+    return results
+
+
+def bench_methods(target, backends, repeat, workdir):
+    with open(os.path.join(workdir, "upload.bin"), "wb") as upload:
+        upload.write(os.urandom(65536))
+
+    results = {}
+
+    for backend in backends:
+        device = connect(target, backend)
+        results[backend] = {}
+
+        try:
+            for section, calls in method_calls(device, workdir).items():
+                results[backend][section] = {name: measure(call, repeat) for name, call in calls.items()}
+
+        finally:
+            device.disconnect()
+
+    return results
+
+
+def bench_parsers(sizes):
+    # Throughput and memory of the route parsers, each size and parser in its own process. get_routes() hands
+    # the raw lines to parse_routes(); the legacy parser kept a dictionary per route
+    device = MikrotikDevice()
+    interfaces = fixtures.interfaces(1000)
+    results = {}
+
+    def timed(parser):
+        def run(lines):
+            start = time.perf_counter()
+            routes = parser(lines)
+            elapsed = time.perf_counter() - start
+
+            return {"routes": len(routes), "routes_per_second": round(len(lines) / elapsed)}
+
+        return run
+
+    for size in sizes:
+        for name, parser in (("legacy_parse_routes", legacy_parse_routes), ("parse_routes", device.parse_routes)):
+            results[f"{name}[{size}]"] = in_child(lambda: list(fixtures.routes(size)), timed(parser))
+
+    # Same 1000 interfaces as the text table the getters scrape and as the key=value lines print_as_value() reads
+    text = fixtures.interfaces_detail(interfaces)
+    as_value = "\n".join("\n".join(f"{key}={value}" for key, value in record.items()) + "\n." for record in interfaces)
+
+    for name, parser in (("parse_interfaces", lambda: device.parse_interfaces(text)),
+                         ("parse_interface_records", lambda: device.parse_interface_records(device.parse_as_value(as_value)))):
+        start = time.perf_counter()
+        parser()
+        results[f"{name}[1000]"] = {"records_per_second": round(1000 / (time.perf_counter() - start))}
+
+    return results
+
+
+def bench_iter_routes(target, server, backend, sizes):
+    # Routes per second and peak RSS while streaming the table without keeping it, one process per size
+    results = {}
+
+    def run(device, size):
+        try:
+            start = time.perf_counter()
+            count = sum(1 for _ in device.iter_routes(timeout=max(target['timeout'], size / 5000)))
+            elapsed = time.perf_counter() - start
+
+        finally:
+            device.disconnect()
+
+        return {"routes": count, "seconds": round(elapsed, 3), "routes_per_second": round(count / elapsed)}
+
+    for size in sizes:
+        server.router.route_count = size
+        results[size] = in_child(lambda: connect(target, backend), lambda device: run(device, size))
+
+    return results
+
+
+def bench_sftp(target, backends, size, workdir):
+    filename = "transfer.bin"
+
+    with open(os.path.join(workdir, filename), "wb") as transfer:
+        transfer.write(os.urandom(size))
+
+    results = {}
+
+    for backend in backends:
+        device = connect(target, backend)
+
+        try:
+            start = time.perf_counter()
+            device.upload_file(workdir, filename)
+            upload = time.perf_counter() - start
+
+            download_dir = tempfile.mkdtemp(dir=workdir)
+            start = time.perf_counter()
+            device.download_file(filename, download_dir)
+            download = time.perf_counter() - start
+
+        finally:
+            device.disconnect()
+
+        results[backend] = {"upload_mib_s": round(size / upload / 1048576, 2), "download_mib_s": round(size / download / 1048576, 2)}
+
+    return results
+
+
+def print_results(title, results, indent=0):
+    print(" " * indent + title)
+
+    for key, value in results.items():
+        if isinstance(value, dict) and not ({"wall_ms", "error", "routes", "records_per_second", "upload_mib_s"} & set(value)):
+            print_results(str(key), value, indent + 2)
+        else:
+            print(" " * (indent + 2) + f"{key:<30} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark routeros_ssh_connector against a local fake RouterOS server or a real device")
+    parser.add_argument("--host", default=None, help="benchmark an external device instead of the bundled fake server")
+    parser.add_argument("--port", type=int, default=22)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--backends", default="netmiko,exec")
+    parser.add_argument("--repeat", type=int, default=5, help="calls per method, the median is reported")
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--routes", default="1000,100000,1000000", help="route table sizes for iter_routes")
+    parser.add_argument("--parse-routes", default="1000,100000,1000000", help="route table sizes for the parse benchmarks")
+    parser.add_argument("--transfer-mib", type=int, default=16, help="file size for the SFTP transfer benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake server: seconds added to every command")
+    parser.add_argument("--bandwidth", type=float, default=None, help="fake server: bytes per second for outputs and SFTP")
+    parser.add_argument("--only", default="connect,baseline,methods,parsers,iter_routes,sftp")
+    parser.add_argument("--json", default=None, help="also write the results to this file, to compare runs")
+    arguments = parser.parse_args()
+
+    backends = arguments.backends.split(",")
+    only = arguments.only.split(",")
+    workdir = tempfile.mkdtemp(prefix="routeros_benchmarks_")
+    server = None
+
+    if arguments.host is None:
+        server = FakeRouterOSServer(latency=arguments.latency, bandwidth=arguments.bandwidth)
+        host, port = server.start()
+        target = {"host": host, "port": port, "username": server.username, "password": server.password, "timeout": arguments.timeout}
+    else:
+        target = {"host": arguments.host, "port": arguments.port, "username": arguments.username, "password": arguments.password, "timeout": arguments.timeout}
+
+    results = {}
+
+    try:
+        if "connect" in only:
+            results['connect'] = bench_connect(target, backends, arguments.repeat)
+
+        if "baseline" in only:
+            if server is not None:
+                server.router.route_count = 1000
+
+            results['baseline'] = bench_baseline(target, backends, arguments.repeat)
+
+        if "methods" in only:
+            if server is not None:
+                server.router.route_count = 1000
+
+            results['methods'] = bench_methods(target, backends, arguments.repeat, workdir)
+
+        if "parsers" in only:
+            results['parsers'] = bench_parsers([int(size) for size in arguments.parse_routes.split(",")])
+
+        # Route table sizes can only be chosen on the fake server
+        if "iter_routes" in only and server is not None:
+            results['iter_routes'] = {backend: bench_iter_routes(target, server, backend, [int(size) for size in arguments.routes.split(",")]) for backend in backends}
+
+        if "sftp" in only:
+            results['sftp'] = bench_sftp(target, backends, arguments.transfer_mib * 1048576, workdir)
+
+    finally:
+        if server is not None:
+            server.stop()
+
+    for title, section in results.items():
+        print_results(title, section)
+
+    if arguments.json:
+        with open(arguments.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
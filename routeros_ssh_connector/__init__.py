@@ -1 +1,17 @@
-from routeros_ssh_connector.connector import *
\ No newline at end of file
+from routeros_ssh_connector.exceptions import *
+from routeros_ssh_connector.transports import *
+from routeros_ssh_connector.connector import *
+from routeros_ssh_connector.fleet import *
+from routeros_ssh_connector.async_connector import *
+from routeros_ssh_connector.batch import *
+from routeros_ssh_connector.instrumentation import *
+from routeros_ssh_connector.routes import *
+from routeros_ssh_connector.archive import *
+from routeros_ssh_connector.snapshots import *
+from routeros_ssh_connector.pool import *
+from routeros_ssh_connector.telemetry import *
+from routeros_ssh_connector.stats import *
+from routeros_ssh_connector.scheduler import *
+from routeros_ssh_connector.pipeline import *
+from routeros_ssh_connector.rollout import *
+from routeros_ssh_connector.inventory import *
\ No newline at end of file
@@ -0,0 +1,225 @@
+import datetime, gzip, hashlib, json, os, re, tempfile, threading
+
+from routeros_ssh_connector.instrumentation import measure
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# First line of every export ('# jun/01/2021 19:04:03 by RouterOS 6.49.10') changes on each run, so it is
+# left out of the hash and two exports of the same configuration are stored once
+EXPORT_HEADER = re.compile(rb"^# \S+ \S+ by RouterOS")
+
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+CHUNK_SIZE = 1048576
+
+class BackupArchive:
+    # Content addressed store for backups and exports. Files are streamed from SFTP through the compressor
+    # into objects/<hash[:2]>/<hash><ext> while they are hashed, so nothing is written twice and identical
+    # files are stored once across snapshots and devices. devices/<host>.json lists the snapshots of a device
+    def __init__(self, root, compression="gzip", level=None):
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown compression '{compression}'. Use one of: {', '.join(EXTENSIONS)}")
+
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires zstandard. Install it with 'pip install zstandard'")
+
+        self.root = root
+        self.compression = compression
+        self.level = level
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "devices"), exist_ok=True)
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Archive methods
+    def archive_backup(self, device, name="backup", password=None, remove=True, timeout=None):
+        filename = device.save_backup(name=name, password=password, timeout=timeout)
+
+        if filename is None:
+            print("ERROR: Unable to create backup in remote device")
+            return False
+
+        return self.archive_file(device, filename, kind="backup", remove=remove)
+
+    def archive_export(self, device, remove=True, timeout=None):
+        return self.archive_file(device, device.save_export(timeout), kind="export", remove=remove)
+
+    def archive_file(self, device, filename, kind="file", remove=False):
+        # Returns the snapshot entry added to the device manifest. 'changed' is False when the content matches the
+        # previous snapshot, which is only known once the file is read: backups and exports get a new name on
+        # every run and the device has no checksum of its own
+        with device.sftp_lock:
+            return self.archive_locked(device, filename, kind, remove)
+
+    def archive_locked(self, device, filename, kind, remove):
+        host = device.device['host']
+        remote_path = "/" + filename
+        sftp = device.get_sftp()
+        attributes = sftp.stat(remote_path)
+        last = self.last_snapshot(host, kind)
+
+        snapshot = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "kind": kind,
+            "source": filename,
+            "size": attributes.st_size,
+            "mtime": attributes.st_mtime,
+        }
+
+        snapshot.update(self.store(device, sftp, remote_path, attributes.st_size, kind))
+        snapshot['changed'] = last is None or last['sha256'] != snapshot['sha256']
+
+        self.add_snapshot(host, snapshot)
+
+        if remove:
+            device.run_command(f"/file remove {filename}")
+
+        return snapshot
+
+    def store(self, device, sftp, remote_path, size, kind):
+        hasher = hashlib.sha256()
+        header = kind == "export"
+        pending = b""
+        objects = os.path.join(self.root, "objects")
+        temporary = tempfile.NamedTemporaryFile(dir=objects, prefix=".incoming_", delete=False)
+
+        try:
+            with measure(device, "transfer", "archive", remote_path) as measurement:
+                with temporary, sftp.open(remote_path, "rb") as source:
+                    if device.sftp_options['prefetch']:
+                        source.prefetch(size, max_concurrent_requests=device.sftp_options['max_requests'])
+
+                    with self.compressor(temporary) as target:
+                        while True:
+                            chunk = source.read(CHUNK_SIZE)
+
+                            if not chunk:
+                                break
+
+                            target.write(chunk)
+                            measurement.transferred(len(chunk))
+
+                            if header:
+                                # Holds the data back until the whole first line is known
+                                pending += chunk
+
+                                if b"\n" not in pending:
+                                    continue
+
+                                first, _, rest = pending.partition(b"\n")
+                                hasher.update(rest if EXPORT_HEADER.match(first) else pending)
+                                header = False
+                            else:
+                                hasher.update(chunk)
+
+                    if header and not EXPORT_HEADER.match(pending):
+                        hasher.update(pending)
+
+            digest = hasher.hexdigest()
+            name = os.path.join(digest[:2], digest + EXTENSIONS[self.compression])
+            path = os.path.join(objects, name)
+
+            if os.path.exists(path):
+                os.remove(temporary.name)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temporary.name, path)
+
+        except BaseException:
+            if os.path.exists(temporary.name):
+                os.remove(temporary.name)
+
+            raise
+
+        return {"sha256": digest, "object": name}
+
+    def compressor(self, target):
+        if self.compression == "gzip":
+            # mtime=0 keeps the compressed object identical for identical content
+            return gzip.GzipFile(fileobj=target, mode="wb", compresslevel=6 if self.level is None else self.level, mtime=0)
+
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=3 if self.level is None else self.level).stream_writer(target, closefd=False)
+
+        return NoCompression(target)
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Snapshot methods
+    def snapshots(self, host, kind=None):
+        path = self.manifest_path(host)
+
+        if not os.path.exists(path):
+            return []
+
+        with open(path) as manifest:
+            snapshots = json.load(manifest)
+
+        return [snapshot for snapshot in snapshots if kind is None or snapshot['kind'] == kind]
+
+    def last_snapshot(self, host, kind):
+        snapshots = self.snapshots(host, kind)
+
+        return snapshots[-1] if snapshots else None
+
+    def add_snapshot(self, host, snapshot):
+        path = self.manifest_path(host)
+
+        with self.lock:
+            snapshots = self.snapshots(host)
+            snapshots.append(snapshot)
+
+            with open(path + ".tmp", "w") as manifest:
+                json.dump(snapshots, manifest, indent=1)
+
+            os.replace(path + ".tmp", path)
+
+    def open_snapshot(self, snapshot):
+        # Readable binary file with the original (decompressed) content of a snapshot
+        path = os.path.join(self.root, "objects", snapshot['object'])
+
+        if path.endswith(".gz"):
+            return gzip.open(path, "rb")
+
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise ImportError("zstd compression requires zstandard. Install it with 'pip install zstandard'")
+
+            return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+        return open(path, "rb")
+
+    def restore(self, snapshot, local_path):
+        local_path = local_path + f"/{snapshot['source']}"
+
+        with self.open_snapshot(snapshot) as source, open(local_path, "wb") as target:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+
+                if not chunk:
+                    break
+
+                target.write(chunk)
+
+        return local_path
+
+    def manifest_path(self, host):
+        return os.path.join(self.root, "devices", re.sub(r"[^\w.-]", "_", str(host)) + ".json")
+
+
+class NoCompression:
+    # Same interface as the compressors for compression="none", leaves the target open
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def write(self, data):
+        return self.target.write(data)
@@ -0,0 +1,588 @@
+import asyncio, os, re, time, uuid
+
+from routeros_ssh_connector.batch import AsyncMikrotikBatch, BATCHABLE
+from routeros_ssh_connector.cache import cached, invalidates, ALL
+from routeros_ssh_connector.connector import MikrotikDevice, UPDATE_STATUS, INSTALLED_VERSION, LATEST_VERSION
+from routeros_ssh_connector.exceptions import MikrotikConnectionError, MikrotikUnreachableError, MikrotikAuthenticationError, MikrotikTimeoutError
+from routeros_ssh_connector.instrumentation import measure, instrumented, redact
+from routeros_ssh_connector.inventory import INVENTORY_FIELDS
+from routeros_ssh_connector.routes import route_from_line
+from routeros_ssh_connector.snapshots import ConfigSnapshot
+from routeros_ssh_connector.stats import InterfaceStats, COUNTERS, require_numpy, parse_duration
+from routeros_ssh_connector.telemetry import AsyncSubscription
+from routeros_ssh_connector.transports import LOGIN_OPTIONS, BATCH_MARKER, batch_script, split_batch_output, clean_output
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+class AsyncMikrotikDevice(MikrotikDevice):
+    def __init__(self, command_timeout=60, poll_interval=0.25, output_format="text", sftp_block_size=-1, sftp_max_requests=-1, hooks=None):
+        super().__init__(command_timeout=command_timeout, poll_interval=poll_interval, output_format=output_format, hooks=hooks)
+        self.connection = None
+        self.sftp_options['block_size'] = sftp_block_size
+        self.sftp_options['max_requests'] = sftp_max_requests
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Connection methods
+    async def connect(self, ip_address, username, password, port=22, conn_timeout=5):
+        if asyncssh is None:
+            raise ImportError("AsyncMikrotikDevice requires asyncssh. Install it with 'pip install asyncssh'")
+
+        self.device = {
+            "host": ip_address,
+            "username": username,
+            "password": password,
+            "device_type": "mikrotik_routeros",
+            "port": port,
+        }
+
+        try:
+            with measure(self, "connect", "connect"):
+                self.connection = await asyncssh.connect(ip_address, port, username=username + LOGIN_OPTIONS, password=password,
+                                                         known_hosts=None, connect_timeout=conn_timeout)
+
+        except asyncssh.PermissionDenied as e:
+            raise MikrotikAuthenticationError("Authentication failed. Check username and password") from e
+
+        except (OSError, asyncio.TimeoutError) as e:
+            raise MikrotikUnreachableError("No response from device. Check device connection parameters") from e
+
+        except asyncssh.Error as e:
+            raise MikrotikConnectionError(str(e)) from e
+
+    async def disconnect(self):
+        self.drop_sftp()
+        self.connection.close()
+        await self.connection.wait_closed()
+
+    async def get_sftp(self):
+        return await self.open_sftp()
+
+    async def open_sftp(self):
+        # The SFTP client runs on a channel of the same SSH connection and serves concurrent requests itself,
+        # so there is no lock here
+        if self.sftp is None:
+            self.sftp = await self.connection.start_sftp_client()
+
+        return self.sftp
+
+    def drop_sftp(self):
+        if self.sftp is not None:
+            self.sftp.exit()
+
+        self.sftp = None
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> GET methods
+    @cached("export")
+    @instrumented
+    async def get_export_configuration(self, timeout=None):
+        output = await self.run_command("/export terse", timeout=timeout)
+
+        return "\n".join(line for line in output.splitlines() if line != "")
+
+    @instrumented
+    async def get_config_snapshot(self, timeout=None):
+        return ConfigSnapshot.from_export(await self.get_export_configuration(timeout))
+
+    async def stream_export(self, timeout=None):
+        async for line in self.stream_lines("/export terse", timeout):
+            if line != "":
+                yield line
+
+    @cached("identity")
+    @instrumented
+    async def get_identity(self):
+        return self.parse_identity(await self.run_command("/system identity print"))
+
+    @cached("interfaces")
+    @instrumented
+    async def get_interfaces(self, where=None, fields=None):
+        if fields is not None:
+            return await self.print_as_value("/interface", where, fields)
+
+        if self.output_format != "text":
+            return self.parse_interface_records(await self.print_as_value("/interface", where))
+
+        return self.parse_interfaces(await self.run_command(self.filtered("/interface print detail without-paging", where)))
+
+    @instrumented
+    async def get_interface_stats(self, where=None):
+        require_numpy()
+
+        output, uptime = await asyncio.gather(self.run_command(self.as_value_query("/interface", where, ("name",) + COUNTERS)),
+                                              self.run_command(":put [/system resource get uptime]"))
+
+        return InterfaceStats.from_records(self.device['host'], self.parse_as_value(output), time.time(), parse_duration(uptime))
+
+    @cached("ip_addresses")
+    @instrumented
+    async def get_ip_addresses(self, where=None, fields=None):
+        if fields is not None:
+            return await self.print_as_value("/ip address", where, fields)
+
+        if self.output_format != "text":
+            return self.parse_ip_address_records(await self.print_as_value("/ip address", where))
+
+        return self.parse_ip_addresses(await self.run_command(self.filtered("/ip addr print without-paging", where)))
+
+    @cached("resources")
+    @instrumented
+    async def get_resources(self):
+        return self.parse_resources(await self.run_command("/system resource print"))
+
+    @cached("routes")
+    @instrumented
+    async def get_routes(self, where=None, fields=None):
+        if fields is not None:
+            return [{field: route[field] for field in fields if field in route} async for route in self.iter_routes(where=where, fields=fields)]
+
+        routes = [route_from_line(line) async for line in self.route_lines(where=where)]
+
+        return self.parse_routes(route for route in routes if route is not None)
+
+    async def iter_routes(self, timeout=None, where=None, fields=None):
+        async for line in self.route_lines(timeout, where, fields):
+            route = self.parse_terse_line(line)
+
+            if route is not None:
+                yield route
+
+    @cached("services")
+    @instrumented
+    async def get_services(self, where=None, fields=None):
+        if fields is not None:
+            return await self.print_as_value("/ip service", where, fields)
+
+        if self.output_format != "text":
+            return self.parse_service_records(await self.print_as_value("/ip service", where))
+
+        return self.parse_services(await self.run_command(self.filtered("/ip service print without-paging", where)))
+
+    @cached("users")
+    @instrumented
+    async def get_users(self, where=None, fields=None):
+        if fields is not None:
+            return await self.print_as_value("/user", where, fields)
+
+        if self.output_format != "text":
+            return self.parse_user_records(await self.print_as_value("/user", where))
+
+        return self.parse_users(await self.run_command(self.filtered("/user print", where)))
+
+    @instrumented
+    async def get_inventory(self):
+        # The menus are read at the same time, each on its own channel
+        kinds = list(INVENTORY_FIELDS)
+        identity, resources, *records = await asyncio.gather(self.get_identity(), self.get_resources(),
+                                                             *(getattr(self, "get_" + kind)(fields=INVENTORY_FIELDS[kind]) for kind in kinds))
+
+        return dict({"identity": identity, "resources": resources}, **dict(zip(kinds, records)))
+
+    @instrumented
+    async def print_as_value(self, path, where=None, fields=None, timeout=None):
+        return self.parse_as_value(await self.run_command(self.as_value_query(path, where, fields), timeout=timeout))
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> MONITOR methods
+    def subscribe(self, command, parser, timeout=None):
+        # monitor_traffic(), monitor_resources() and follow_log() return async iterators: 'async for event in ...'
+        return AsyncSubscription(self.connection, command, parser, timeout)
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> UPDATE methods
+    @invalidates()
+    async def update_address_pool(self, *args, **kwargs):
+        return await self.run_captured("update_address_pool", *args, **kwargs)
+
+    @invalidates("ip_addresses", "routes")
+    async def update_dhcp_client(self, *args, **kwargs):
+        return await self.run_captured("update_dhcp_client", *args, **kwargs)
+
+    @invalidates()
+    async def update_dhcp_server_server(self, *args, **kwargs):
+        return await self.run_captured("update_dhcp_server_server", *args, **kwargs)
+
+    @invalidates()
+    async def update_dhcp_server_network(self, address, gateway=None, netmask=None, dns_server=None, ntp_server=None):
+        counts = self.parse_counts(await self.run_command(self.count_query("/ip dhcp-server network", {"address": address})))
+        error, cmd = self.dhcp_network_command(counts, address, gateway, netmask, dns_server, ntp_server)
+
+        if error is not None:
+            return error
+
+        return self.check_result(await self.run_command(cmd))
+
+    @invalidates("identity")
+    async def update_identity(self, *args, **kwargs):
+        return await self.run_captured("update_identity", *args, **kwargs)
+
+    @invalidates("ip_addresses", "routes")
+    async def update_ip_address(self, *args, **kwargs):
+        return await self.run_captured("update_ip_address", *args, **kwargs)
+
+    @invalidates("services")
+    async def update_services(self, *args, **kwargs):
+        return await self.run_captured("update_services", *args, **kwargs)
+
+    @invalidates("users")
+    async def update_user(self, *args, **kwargs):
+        return await self.run_captured("update_user", *args, **kwargs)
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> CREATE methods
+    @invalidates()
+    async def create_address_pool(self, *args, **kwargs):
+        return await self.run_captured("create_address_pool", *args, **kwargs)
+
+    @invalidates("ip_addresses", "routes")
+    async def create_dhcp_client(self, *args, **kwargs):
+        return await self.run_captured("create_dhcp_client", *args, **kwargs)
+
+    @invalidates()
+    async def create_dhcp_server(self, interface, network_address=None, disabled="no", name="dhcp_server", address_pool="static-only", lease_time="00:10:00", dns_server="1.1.1.1,9.9.9.9"):
+        server_cmd = self.check_result(await self.run_command(self.dhcp_server_add_command(interface, disabled, name, address_pool, lease_time)))
+
+        # check_result() is None when the device printed nothing, which is how 'add' succeeds
+        if server_cmd not in (True, None):
+            return server_cmd
+
+        cmd, result = self.dhcp_network_add_command(await self.get_ip_addresses(), interface, network_address, dns_server)
+
+        if cmd is None:
+            return result
+
+        return self.check_result(await self.run_command(cmd))
+
+    @invalidates("ip_addresses", "routes")
+    async def create_ip_address(self, *args, **kwargs):
+        return await self.run_captured("create_ip_address", *args, **kwargs)
+
+    @invalidates("routes")
+    async def create_route(self, *args, **kwargs):
+        return await self.run_captured("create_route", *args, **kwargs)
+
+    @invalidates("users")
+    async def create_user(self, *args, **kwargs):
+        return await self.run_captured("create_user", *args, **kwargs)
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> TOOLS methods
+    @invalidates("routes")
+    async def create_routes(self, routes, chunk_size=5000, progress=None, timeout=None):
+        return await self.import_commands(self.route_commands(routes), "routes", chunk_size, progress, timeout)
+
+    @invalidates()
+    async def load_address_list(self, name, addresses, diff=False, chunk_size=5000, progress=None, timeout=None):
+        current = None
+
+        if diff:
+            current = self.address_list_entries(await self.print_as_value("/ip firewall address-list", where=f"list={self.quote_value(name)} dynamic=no", timeout=timeout))
+
+        commands, added, removed = self.address_list_commands(name, addresses, current)
+        report = await self.import_commands(commands, "address_list_" + re.sub(r"[^\w-]", "_", name), chunk_size, progress, timeout)
+
+        if diff:
+            report['added'] = added
+            report['removed'] = removed
+
+        return report
+
+    @invalidates("interfaces")
+    async def configure_wlan(self, ssid, password, band, country="no_country_set"):
+        for command in self.wlan_profile_commands(password):
+            await self.run_command(command)
+
+        output = await self.run_command("/interface wireless print detail")
+        ros_license_level = await self.run_command(":put [/system license get nlevel]")
+
+        if "input does not match" in ros_license_level:
+            ros_license_level = await self.run_command(":put [/system license get level]")
+
+        commands, message = self.wlan_commands(ssid, band, self.wlan_indexes(output), self.wlan_radio_mode(ros_license_level))
+
+        return self.wlan_result([await self.run_command(command) for command in commands], message)
+
+    def batch(self, window=50):
+        return AsyncMikrotikBatch(self, window=window)
+
+    async def download_backup(self, local_path, filename=None):
+        if filename is None:
+            filename = await self.save_backup()
+
+            if filename is not None:
+                return await self.download_file(filename, local_path)
+        else:
+            return await self.download_file(filename, local_path)
+
+    async def download_export(self, local_path, timeout=None):
+        return await self.download_file(await self.save_export(timeout), local_path)
+
+    async def download_file(self, filename, local_path):
+        remote_path = "/" + filename
+        local_path = local_path + f"/{filename}"
+
+        try:
+            await self.sftp_transfer("get", remote_path, local_path)
+
+            return local_path
+
+        except (OSError, asyncssh.SFTPError) as e:
+            print(f"ERROR: {e}")
+            return False
+
+    @invalidates()
+    async def enable_cloud_dns(self, timeout=None):
+        await self.run_command("/ip cloud set ddns-enabled=yes")
+
+        return await self.wait_for(":put [/ip cloud get dns-name]", lambda dns_name: dns_name.strip() != "", timeout)
+
+    async def make_backup(self, name="backup", password=None, encryption="aes-sha256", dont_encrypt="yes", timeout=None):
+        return await self.save_backup(name, password, encryption, dont_encrypt, timeout) is not None
+
+    @invalidates(ALL)
+    async def reboot_device(self):
+        with self.reboot_script() as (folder, filename):
+            return await self.upload_file(folder, filename)
+
+    @invalidates(ALL)
+    async def send_command(self, query, timeout=None):
+        output = await self.run_command(query, timeout=timeout)
+
+        return "\n".join(line.lstrip() for line in output.splitlines() if line != "")
+
+    async def stream_command(self, query, timeout=None):
+        # 'async for line in router.stream_command(...)'
+        async for line in self.stream_lines(query, timeout):
+            if line != "":
+                yield line.lstrip()
+
+    @invalidates(ALL)
+    async def update_system(self, channel="long-term", timeout=None):
+        print("Checking RouterOS updates...")
+        await self.run_command(f"/system routerboard settings set auto-upgrade=yes")
+
+        if (await self.check_for_updates(channel, timeout))['available']:
+            await self.run_command("/system package update install")
+            return "Update available!. Updating RouterOS device..."
+        else:
+            return "Device is up to date!"
+
+    @invalidates(ALL)
+    async def check_for_updates(self, channel="long-term", timeout=None):
+        for command in self.update_check_commands(channel):
+            await self.run_command(command)
+
+        status = await self.wait_for(UPDATE_STATUS, self.update_checked, timeout)
+
+        return self.update_report(await self.get_installed_version(), await self.run_command(LATEST_VERSION), status)
+
+    @invalidates(ALL)
+    async def download_update(self, timeout=None):
+        await self.run_command("/system package update download", timeout=timeout)
+
+        status = await self.wait_for(UPDATE_STATUS, self.update_downloaded, timeout)
+
+        return "downloaded" in status.lower()
+
+    async def get_installed_version(self):
+        return (await self.run_command(INSTALLED_VERSION)).strip()
+
+    async def upload_file(self, local_path, filename):
+        try:
+            await self.sftp_transfer("put", "/" + filename, local_path + f"/{filename}")
+            return True
+
+        except (OSError, asyncssh.SFTPError) as e:
+            print(f"ERROR: {e}")
+            return False
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Auxiliary methods
+    async def route_lines(self, timeout=None, where=None, fields=None):
+        # Unique name, so concurrent calls don't overwrite or remove each other's file
+        filename = f"routes_{await self.get_identity()}_{uuid.uuid4().hex[:8]}.txt"
+
+        await self.run_command(self.filtered(f"/ip route print detail terse without-paging file={filename}", where, fields), timeout=timeout)
+
+        pending = b""
+
+        try:
+            async for chunk in self.read_blocks("/" + filename):
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+
+                for line in lines:
+                    yield line.decode("utf-8", errors="replace")
+
+            yield pending.decode("utf-8", errors="replace")
+
+        finally:
+            await self.run_command(f"/file remove {filename}")
+
+    async def read_blocks(self, remote_path, size=1048576):
+        # Like transfer(), retry once on a fresh SFTP client if the cached one was closed by the device,
+        # going on from the offset already read
+        offset = 0
+
+        for attempt in range(2):
+            sftp = await self.get_sftp()
+
+            try:
+                async with sftp.open(remote_path, "rb", block_size=self.sftp_options['block_size'], max_requests=self.sftp_options['max_requests']) as handle:
+                    while True:
+                        block = await handle.read(size, offset)
+
+                        if not block:
+                            return
+
+                        offset += len(block)
+                        yield block
+
+            except (asyncssh.SFTPConnectionLost, asyncssh.ChannelOpenError, BrokenPipeError):
+                if attempt == 0:
+                    self.drop_sftp()
+                    continue
+
+                raise
+
+    async def run_command(self, command, timeout=None):
+        # Exec requests complete when the device closes the channel, so no prompt matching is needed
+        with measure(self, "command", command=command) as measurement:
+            try:
+                result = await self.connection.run(command, check=False, timeout=self.command_timeout if timeout is None else timeout)
+
+            except asyncssh.TimeoutError as e:
+                raise MikrotikTimeoutError(f"Command '{redact(command)}' did not finish in time") from e
+
+            measurement.received(result.stdout)
+
+        return clean_output(result.stdout)
+
+    @invalidates(ALL)
+    async def run_commands(self, commands, timeout=None):
+        # Each command on its own channel, all at the same time
+        return list(await asyncio.gather(*(self.run_command(command, timeout=timeout) for command in commands)))
+
+    @invalidates(ALL)
+    async def run_batch(self, commands, timeout=None, stop_on_error=False):
+        if stop_on_error:
+            markers = [f"{BATCH_MARKER}{uuid.uuid4().hex[:12]}_{number}__" for number in range(len(commands))]
+
+            return split_batch_output(await self.run_command(batch_script(commands, markers), timeout=timeout), markers)
+
+        # Exec requests run as scripts that abort on error, so independent commands go one per request, in order
+        return [await self.run_command(command, timeout=timeout) for command in commands]
+
+    async def wait_for(self, query, condition, timeout=None):
+        deadline = time.monotonic() + (self.command_timeout if timeout is None else timeout)
+        output = await self.run_command(query)
+
+        while not condition(output) and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            output = await self.run_command(query)
+
+        return output
+
+    async def stream_lines(self, command, timeout=None):
+        # Output lines of command as they arrive; timeout is the maximum idle time between lines
+        timeout = self.command_timeout if timeout is None else timeout
+        process = await self.connection.create_process(command)
+
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), timeout)
+
+                except asyncio.TimeoutError as e:
+                    raise MikrotikTimeoutError(f"Command '{redact(command)}' produced no output for {timeout} seconds") from e
+
+                if line == "":
+                    break
+
+                yield line.rstrip("\r\n")
+
+        finally:
+            process.close()
+
+    async def sftp_transfer(self, direction, remote_path, local_path):
+        await self.transfer(direction, remote_path, local_path)
+
+    async def transfer(self, direction, remote_path, local_path):
+        # Retry once on a fresh SFTP client if the cached one was closed by the device
+        for attempt in range(2):
+            sftp = await self.get_sftp()
+
+            try:
+                with measure(self, "transfer", direction, remote_path) as measurement:
+                    if direction == "get":
+                        await sftp.get(remote_path, local_path, block_size=self.sftp_options['block_size'], max_requests=self.sftp_options['max_requests'])
+                    else:
+                        await sftp.put(local_path, remote_path, block_size=self.sftp_options['block_size'], max_requests=self.sftp_options['max_requests'])
+
+                    measurement.transferred(os.path.getsize(local_path))
+
+                return
+
+            except (asyncssh.SFTPConnectionLost, asyncssh.ChannelOpenError, BrokenPipeError):
+                if attempt == 0:
+                    self.drop_sftp()
+                    continue
+
+                raise
+
+    def capture_commands(self, method, *args, **kwargs):
+        # The synchronous implementation runs against a recorder. Methods that read from the device or transfer
+        # files would call coroutines synchronously there, so only the single command ones can be captured
+        if method not in BATCHABLE:
+            raise ValueError(f"'{method}' doesn't send a single command and can't be captured")
+
+        return super().capture_commands(method, *args, **kwargs)
+
+    async def save_backup(self, name="backup", password=None, encryption="aes-sha256", dont_encrypt="yes", timeout=None):
+        filename, cmd = self.backup_command(await self.get_identity(), name, password, encryption, dont_encrypt)
+
+        return self.backup_saved(filename, await self.run_command(cmd, timeout=timeout))
+
+    async def save_export(self, timeout=None):
+        filename, cmd = self.export_command(await self.get_identity())
+
+        await self.run_command(cmd, timeout=timeout)
+        self.last_export = {"name": filename}
+
+        return filename
+
+    async def import_commands(self, commands, name="import", chunk_size=5000, progress=None, timeout=None):
+        report = {"chunks": 0, "commands": 0, "errors": []}
+
+        for chunk in self.chunked(commands, chunk_size):
+            await self.import_chunk(chunk, name, report, progress, timeout)
+
+        return report
+
+    async def import_chunk(self, chunk, name, report, progress, timeout):
+        filename = self.write_chunk(chunk, name, report)
+
+        try:
+            if not await self.upload_file(self.tempdir, filename):
+                error = f"ERROR: Upload of '{filename}' failed"
+
+            else:
+                error = self.import_error(await self.run_command(f"/import file-name={filename} verbose=no", timeout=timeout))
+                await self.run_command(f"/file remove {filename}")
+
+        finally:
+            os.remove(self.tempdir + filename)
+
+        self.chunk_done(chunk, report, error, progress)
+
+    async def run_captured(self, method, *args, **kwargs):
+        # Commands are generated by the synchronous implementation so both APIs send exactly the same thing
+        result = None
+
+        for command in self.capture_commands(method, *args, **kwargs):
+            result = self.check_result(await self.run_command(command))
+
+        return result
@@ -0,0 +1,96 @@
+from routeros_ssh_connector.connector import MikrotikDevice
+
+# Methods that send a single command and can be queued. The rest read from the device to decide what to send
+# (update_dhcp_server_network, create_dhcp_server) or upload and import files (create_routes, update_system),
+# which would happen when they are queued and not when the batch is executed
+BATCHABLE = (
+    "update_address_pool", "update_dhcp_client", "update_dhcp_server_server", "update_identity",
+    "update_ip_address", "update_services", "update_user",
+    "create_address_pool", "create_dhcp_client", "create_ip_address", "create_route", "create_user",
+)
+
+class MikrotikBatch:
+    def __init__(self, device, window=50):
+        self.device = device
+        self.window = window
+        self.operations = []
+
+    def __getattr__(self, name):
+        if not hasattr(MikrotikDevice, name) or not (name.startswith("update_") or name.startswith("create_")):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        if name not in BATCHABLE:
+            raise AttributeError(f"'{name}' doesn't send a single command and can't be batched")
+
+        def queue(*args, **kwargs):
+            for command in self.device.capture_commands(name, *args, **kwargs):
+                self.operations.append({"method": name, "command": command.strip()})
+
+            return self
+
+        return queue
+
+    def __len__(self):
+        return len(self.operations)
+
+    def add(self, command):
+        self.operations.append({"method": "send_command", "command": command.strip()})
+
+        return self
+
+    def execute(self, stop_on_error=False, timeout=None):
+        results = []
+        failed = False
+
+        for operations in self.windows():
+            if failed:
+                outputs = [None] * len(operations)
+            else:
+                outputs = self.device.run_batch([operation['command'] for operation in operations], timeout=timeout, stop_on_error=stop_on_error)
+
+            failed = self.collect(results, operations, outputs, stop_on_error) or failed
+
+        self.operations = []
+
+        return results
+
+    def windows(self):
+        for start in range(0, len(self.operations), self.window):
+            yield self.operations[start:start + self.window]
+
+    def collect(self, results, operations, outputs, stop_on_error):
+        # Appends the results of one window; True when a command failed and stop_on_error skips the rest
+        failed = False
+
+        for operation, output in zip(operations, outputs):
+            if output is None:
+                result = "ERROR: Not executed because a previous command failed"
+            else:
+                # Same semantics as calling the method directly
+                result = self.device.check_result(output)
+
+                if result is not None and result is not True and stop_on_error:
+                    failed = True
+
+            results.append({"method": operation['method'], "command": operation['command'], "result": result})
+
+        return failed
+
+
+class AsyncMikrotikBatch(MikrotikBatch):
+    # Same queue for AsyncMikrotikDevice: 'await batch.execute()'
+    async def execute(self, stop_on_error=False, timeout=None):
+        results = []
+        failed = False
+
+        for operations in self.windows():
+            if failed:
+                outputs = [None] * len(operations)
+            else:
+                outputs = await self.device.run_batch([operation['command'] for operation in operations], timeout=timeout, stop_on_error=stop_on_error)
+
+            failed = self.collect(results, operations, outputs, stop_on_error) or failed
+
+        self.operations = []
+
+        return results
@@ -0,0 +1,234 @@
+import asyncio, copy, functools, inspect, threading, time
+
+from collections import OrderedDict
+
+# Tag used by writes whose effect can't be known in advance (raw commands, imports, reboots...)
+ALL = "*"
+
+class TTLCache:
+    def __init__(self, ttl=10, ttls=None, maxsize=256):
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # Bumped on every invalidation, so a result read before a write is never stored after it
+        self.generation = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+
+                self.misses += 1
+                return False, None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return True, entry[2]
+
+    def set(self, key, value, tags, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.entries[key] = (time.monotonic() + self.ttls.get(key[0], self.ttl), tags, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *tags):
+        with self.lock:
+            self.generation += 1
+
+            if ALL in tags:
+                self.entries.clear()
+                return
+
+            for key in [key for key, entry in self.entries.items() if ALL in entry[1] or set(tags) & entry[1]]:
+                del self.entries[key]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+
+class SingleFlight:
+    # Concurrent calls with the same key wait for the one already running and share its result (or exception)
+    # instead of sending the same command again
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tasks = {}
+        self.shared = 0
+
+    def do(self, key, function):
+        # Returns (shared, value); shared results are the same object for every caller
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "value": None, "error": None}
+            else:
+                self.shared += 1
+
+        if not leader:
+            call['done'].wait()
+
+            if call['error'] is not None:
+                raise call['error']
+
+            return True, call['value']
+
+        try:
+            call['value'] = function()
+
+        except BaseException as e:
+            call['error'] = e
+            raise
+
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+
+            call['done'].set()
+
+        return False, call['value']
+
+    async def do_async(self, key, function):
+        # Same for coroutine functions. Callers share one event loop, so they await the task of the first one.
+        # The task is shielded: a caller that is cancelled doesn't cancel it for the others
+        task = self.tasks.get(key)
+        shared = task is not None
+
+        if shared:
+            self.shared += 1
+        else:
+            task = self.tasks[key] = asyncio.ensure_future(function())
+            task.add_done_callback(lambda done: self.finished(key, done))
+
+        return shared, await asyncio.shield(task)
+
+    def finished(self, key, task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+
+    def forget(self):
+        # Calls started from now on don't join the ones in flight, used after writes
+        with self.lock:
+            self.calls.clear()
+            self.tasks.clear()
+
+
+def cached(*tags):
+    # Results are stored per method and arguments; callers always get their own copy
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                key = cache_key(method, args, kwargs)
+
+                if key is None:
+                    return await method(self, *args, **kwargs)
+
+                cache = self.cache
+
+                if cache is not None:
+                    hit, value = cache.get(key)
+
+                    if hit:
+                        return copy.deepcopy(value)
+
+                async def load():
+                    generation = None if cache is None else cache.generation
+                    value = await method(self, *args, **kwargs)
+
+                    if cache is not None:
+                        cache.set(key, value, set(tags), generation)
+
+                    return value
+
+                shared, value = await self.flights.do_async(key, load)
+
+                return copy.deepcopy(value) if shared or cache is not None else value
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = cache_key(method, args, kwargs)
+
+            if key is None:
+                return method(self, *args, **kwargs)
+
+            cache = self.cache
+
+            if cache is not None:
+                hit, value = cache.get(key)
+
+                if hit:
+                    return copy.deepcopy(value)
+
+            def load():
+                generation = None if cache is None else cache.generation
+                value = method(self, *args, **kwargs)
+
+                if cache is not None:
+                    cache.set(key, value, set(tags), generation)
+
+                return value
+
+            # Identical calls made while this one runs share its command
+            shared, value = self.flights.do(key, load)
+
+            return copy.deepcopy(value) if shared or cache is not None else value
+
+        return wrapper
+
+    return decorator
+
+
+def cache_key(method, args, kwargs):
+    # None for unhashable arguments, which are never cached nor shared
+    key = (method.__name__, args, tuple(sorted(kwargs.items())))
+
+    try:
+        hash(key)
+    except TypeError:
+        return None
+
+    return key
+
+
+def invalidates(*tags):
+    # Every change also invalidates the full export
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                try:
+                    return await method(self, *args, **kwargs)
+                finally:
+                    self.invalidate(*tags)
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.invalidate(*tags)
+
+        return wrapper
+
+    return decorator
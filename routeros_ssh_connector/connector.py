@@ -1,20 +1,100 @@
-import re, time, paramiko, tempfile, os, sys, paramiko
+import re, time, paramiko, tempfile, os, sys, json, itertools, copy, threading, uuid, shutil, contextlib
 
 from datetime import datetime
-from netmiko import Netmiko
-from packaging.version import Version, parse
+from packaging.version import Version, InvalidVersion, parse
+from routeros_ssh_connector.exceptions import *
+from routeros_ssh_connector.cache import TTLCache, SingleFlight, cached, invalidates, ALL
+from routeros_ssh_connector.instrumentation import measure, instrumented
+from routeros_ssh_connector.inventory import INVENTORY_FIELDS
+from routeros_ssh_connector.routes import RouteTable, TERSE_PAIR
+from routeros_ssh_connector.snapshots import ConfigSnapshot
+from routeros_ssh_connector.stats import InterfaceStats, COUNTERS, require_numpy, parse_duration
+from routeros_ssh_connector.telemetry import Subscription, MonitorParser, LogParser
+from routeros_ssh_connector.transports import NetmikoTransport, ExecTransport
+
+# Property names accepted in where filters and field lists, anything else could inject console syntax
+PROPERTY_NAME = re.compile(r'[a-zA-Z.][\w.-]*')
+
+# Characters escaped inside quoted values. Control characters without a short escape are written as \NN (hex),
+# so no value can end the line and start a command of its own
+QUOTED_SPECIAL = re.compile(r'[\\"$?\x00-\x1f\x7f]')
+
+# Values written into .rsc chunks as they are: addresses, networks, ranges, interface names, numbers and yes/no.
+# Anything else is quoted, as entries often come from untrusted feeds
+PLAIN_VALUE = re.compile(r'[\w.:/%,-]+')
+
+# Properties returned as integers by print_as_value(). Anything else stays a string, even when it is all digits:
+# names, comments and passwords can be numbers too
+NUMERIC_PROPERTIES = frozenset(COUNTERS + (
+    "mtu", "actual-mtu", "l2mtu", "max-l2mtu", "link-downs", "tx-queue-drop",
+    "fp-rx-byte", "fp-tx-byte", "fp-rx-packet", "fp-tx-packet",
+    "port", "max-sessions", "distance", "scope", "target-scope", "default-route-distance",
+    "vlan-id", "pvid", "priority", "bytes", "packets",
+    "cpu-count", "cpu-frequency", "cpu-load", "free-memory", "total-memory", "free-hdd-space", "total-hdd-space",
+    "write-sect-since-reboot", "write-sect-total", "bad-blocks",
+))
+
+ESCAPES = {"\\": "\\\\", '"': '\\"', "$": "\\$", "?": "\\?", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+INTERFACE_STATUS = {
+    "": "not_connected",
+    "R": "running",
+    "X": "disabled",
+    "D": "dynamic",
+    "S": "slave",
+    "RS": "running-slave",
+    "XS": "disabled-slave",
+    "DRS": "dynamic-running-slave",
+}
+
+# Polled while the device looks for and downloads updates
+UPDATE_STATUS = ":put [/system package update get status]"
+INSTALLED_VERSION = ":put [/system package update get installed-version]"
+LATEST_VERSION = ":put [/system package update get latest-version]"
+
+BACKENDS = {
+    "netmiko": NetmikoTransport,
+    "exec": ExecTransport,
+}
 
 class MikrotikDevice:
-    def __init__(self):
+    def __init__(self, command_timeout=60, poll_interval=0.25, output_format="text", sftp_window_size=None, sftp_max_packet_size=None, sftp_prefetch=True, sftp_max_requests=None, hooks=None):
         self.now = datetime.now()
         self.current_datetime = self.now.strftime("%d-%m-%Y_%H-%M-%S")
         self.last_backup = {}
         self.last_export = {}
         self.tempdir = tempfile.gettempdir().replace("\\", "/") + "/"
 
+        # Commands return as soon as the prompt (or sentinel) is read; command_timeout is only the deadline
+        self.command_timeout = command_timeout
+        self.poll_interval = poll_interval
+
+        # "text" scrapes the printed tables, "as-value" and "json" (RouterOS v7.13+) request machine-readable output
+        self.output_format = output_format
+
+        # Read-only getters are cached only after enable_cache(); identical getters running at the same time
+        # from several threads always share one command
+        self.cache = None
+        self.flights = SingleFlight()
+
+        # Called around every connect, command, transfer and getter, see add_hook()
+        self.hooks = list(hooks or [])
+
+        # SFTP session is opened on first transfer and reused until disconnect(). Paramiko's SFTP client can't
+        # serve several threads at once, so transfers hold sftp_lock while they use it
+        self.sftp = None
+        self.sftp_transport = None
+        self.sftp_lock = threading.RLock()
+        self.sftp_options = {
+            "window_size": sftp_window_size,
+            "max_packet_size": sftp_max_packet_size,
+            "prefetch": sftp_prefetch,
+            "max_requests": sftp_max_requests,
+        }
+
 
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Connection methods
-    def connect(self, ip_address, username, password, port=22):
+    def connect(self, ip_address, username, password, port=22, conn_timeout=5, exit_on_error=True, backend="netmiko"):
         self.device = {
             "host": ip_address,
             "username": username,
@@ -23,380 +103,807 @@ class MikrotikDevice:
             "port": port,
         }
         try:
-            self.net_connect = Netmiko(**self.device, global_cmd_verify=False, global_delay_factor=2, conn_timeout=5)
+            with measure(self, "connect", "connect"):
+                self.transport = BACKENDS[backend](self.device, conn_timeout=conn_timeout)
 
-        except Exception as e:
-            if "TCP connection to device failed" in str(e):
+            # Kept for code that talks to the Netmiko session directly
+            self.net_connect = getattr(self.transport, "connection", None)
+
+        except MikrotikConnectionError as e:
+            if not exit_on_error:
+                raise
+
+            if isinstance(e, MikrotikUnreachableError):
                 print("ERROR: No response from device. Check device connection parameters")
-                sys.exit()
 
-            elif "Authentication to device failed" in str(e):
+            elif isinstance(e, MikrotikAuthenticationError):
                 print("ERROR: Authentication failed. Check username and password")
-                sys.exit()
-                
+
             else:
                 print("EXCEPTION:", str(e))
-                sys.exit()
+
+            sys.exit()
 
     def disconnect(self):
-        self.net_connect.disconnect()
+        self.close_sftp()
+        self.transport.disconnect()
 
+    def get_sftp(self):
+        with self.sftp_lock:
+            return self.open_sftp()
 
- # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> GET methods
-    def get_export_configuration(self):
-        self.output = self.net_connect.send_command("/export terse", delay_factor=8)    
+    def open_sftp(self):
+        if self.sftp is not None and self.sftp_transport is not None and self.sftp_transport.is_active():
+            return self.sftp
 
-        output = ""    
+        self.close_sftp()
 
-        for line in self.output.splitlines():
-            if line != "":
-                if output == "":
-                    output += line
-                else:
-                    output += "\n" + line
-        
-        return output
+        transport_options = {}
 
-    def get_identity(self):
-        self.output = self.net_connect.send_command("/system identity print")        
+        if self.sftp_options['window_size'] is not None:
+            transport_options['default_window_size'] = self.sftp_options['window_size']
 
-        for line in self.output.splitlines():            
-            parsed = re.sub(" +", "", line).strip().split(":")
+        if self.sftp_options['max_packet_size'] is not None:
+            transport_options['default_max_packet_size'] = self.sftp_options['max_packet_size']
 
-            if parsed != "":
-                return parsed[1]
+        self.sftp_transport = paramiko.Transport((self.device['host'], self.device['port']), **transport_options)
+        self.sftp_transport.connect(None, self.device['username'], self.device['password'])
+        self.sftp = paramiko.SFTPClient.from_transport(self.sftp_transport, window_size=self.sftp_options['window_size'], max_packet_size=self.sftp_options['max_packet_size'])
 
-    def get_interfaces(self):
-        return self.parse_interfaces(self.net_connect.send_command("/interface print detail without-paging"))
+        return self.sftp
 
-    def get_ip_addresses(self):
-        self.ip_addresses = []
+    def close_sftp(self):
+        with self.sftp_lock:
+            self.drop_sftp()
 
-        self.output = self.net_connect.send_command("/ip addr print without-paging")        
+    def drop_sftp(self):
+        if self.sftp is not None:
+            try:
+                self.sftp.close()
+            except Exception:
+                pass
 
-        for line in self.output.splitlines():
-            ip_address = {}
-            parsed = re.sub(" +", " ", line).strip().split(" ")
+        if self.sftp_transport is not None:
+            self.sftp_transport.close()
 
-            if re.search("^([0-9]|[1-9][0-9]{1,2}|[1-7][0-9]{3}|80[0-9]{2}|81[0-8][0-9]|819[0-2])", parsed[0]):
-                if re.search("[A-Z]", parsed[1]):
-                    ip_address["address"] = parsed[2]
-                
-                else:
-                    ip_address["address"] = parsed[1]
+        self.sftp = None
+        self.sftp_transport = None
 
-                ip_address["network"] = parsed[2]
-                ip_address["interface"] = parsed[3]
-                self.ip_addresses.append(ip_address)
 
-        return self.ip_addresses
+ # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> GET methods
+    @cached("export")
+    @instrumented
+    def get_export_configuration(self, timeout=None):
+        output = self.run_command("/export terse", timeout=timeout)
 
-    def get_resources(self):
-        self.resources = {}
-        self.output = self.net_connect.send_command("/system resource print")        
+        return "\n".join(line for line in output.splitlines() if line != "")
 
-        for line in self.output.splitlines():            
-            parsed = line.replace(": ", ":").replace("MiB", " MiB").replace("KiB", " KiB").replace("MHz", " MHz").replace("%", " %").strip().split(":")
+    @instrumented
+    def get_config_snapshot(self, timeout=None):
+        return ConfigSnapshot.from_export(self.stream_export(timeout))
 
-            if parsed[0] != "":
-                if parsed[0] == "uptime":
-                    parsed[1] = parsed[1].replace("y", "y ").replace("w", "w ").replace("d", "d ").replace("h", "h ").replace("m", "m ")
-                    self.resources[parsed[0]] = parsed[1]
+    def stream_export(self, timeout=None):
+        for line in self.transport.stream_command("/export terse", self.command_timeout if timeout is None else timeout):
+            if line != "":
+                yield line
 
-                if parsed[0] == "build-time":
-                    self.resources[parsed[0]] = parsed[1] + ":" + parsed[2] + ":" + parsed[3]
+    @cached("identity")
+    @instrumented
+    def get_identity(self):
+        return self.parse_identity(self.run_command("/system identity print"))
 
-                else:
-                    self.resources[parsed[0]] = parsed[1]
+    @cached("interfaces")
+    @instrumented
+    def get_interfaces(self, where=None, fields=None):
+        if fields is not None:
+            return self.print_as_value("/interface", where, fields)
 
-        return self.resources
+        if self.output_format != "text":
+            return self.parse_interface_records(self.print_as_value("/interface", where))
 
-    def get_routes(self):
-        print("*** INFO ***: This process may take some time to get info depending on how many routes have in your device. Please wait...")
+        return self.parse_interfaces(self.run_command(self.filtered("/interface print detail without-paging", where)))
 
-        self.routes = []
-        filename = f"routes_{self.get_identity()}.txt"
-        delay = 0
+    @instrumented
+    def get_interface_stats(self, where=None):
+        # rx/tx byte, packet, error and drop counters of every interface as numpy columns, see InterfaceStats.
+        # Never cached: every call is a new sample
+        require_numpy()
 
-        total_routes = int(self.net_connect.send_command(f"/ip route print count-only"))
+        output = self.run_command(self.as_value_query("/interface", where, ("name",) + COUNTERS))
+        received = time.time()
+        uptime = self.run_command(":put [/system resource get uptime]")
 
-        if total_routes <= 500:
-            delay = 4
-        
-        elif total_routes <= 1500:
-            delay = 8
-        
-        elif total_routes <= 2500:
-            delay = 16
+        return InterfaceStats.from_records(self.device['host'], self.parse_as_value(output), received, parse_duration(uptime))
 
-        elif total_routes > 2500:
-            delay = 32
+    @cached("ip_addresses")
+    @instrumented
+    def get_ip_addresses(self, where=None, fields=None):
+        if fields is not None:
+            return self.print_as_value("/ip address", where, fields)
 
-        self.net_connect.send_command(f"/ip route print detail terse without-paging file={filename}", delay_factor=delay)
-        self.download_file(filename, self.tempdir)
+        if self.output_format != "text":
+            return self.parse_ip_address_records(self.print_as_value("/ip address", where))
 
-        routes = open(self.tempdir + filename, "r")
+        return self.parse_ip_addresses(self.run_command(self.filtered("/ip addr print without-paging", where)))
 
-        for line in routes:
-            parsed = re.sub(" +", " ", line).strip()            
+    @cached("resources")
+    @instrumented
+    def get_resources(self):
+        return self.parse_resources(self.run_command("/system resource print"))
 
-            if re.search("^([0-9]|[1-9][0-9]{1,5}|[1-7][0-9]{6}|8000000)", parsed):
-                route = {}
+    @cached("routes")
+    @instrumented
+    def get_routes(self, where=None, fields=None):
+        print("*** INFO ***: This process may take some time to get info depending on how many routes have in your device. Please wait...")
 
-                route_line = parsed.split(" ")
-                
-                route['flags'] = route_line[1]
-                route["destination"] = re.search(r'dst-address=(.*?) [a-z]', parsed).group(1)
+        if fields is not None:
+            return [{field: route[field] for field in fields if field in route} for route in self.iter_routes(where=where, fields=fields)]
 
-                if "gateway" in parsed:
-                    route["gateway"] = re.search(r'gateway=(.*?) [a-z]', parsed).group(1)
-                else:
-                    route["gateway"] = ""
+        # Raw lines, RouteTable only parses the properties it keeps
+        return self.parse_routes(self.route_lines(where=where))
 
-                route["distance"] = re.search(r'distance=(.*?) [a-z]', parsed).group(1)
-                
-                self.routes.append(route)
+    def iter_routes(self, timeout=None, where=None, fields=None):
+        for line in self.route_lines(timeout, where, fields):
+            route = self.parse_terse_line(line)
 
-        self.net_connect.send_command(f"/file remove {filename}")
+            if route is not None:
+                yield route
 
-        routes.close()
-        os.remove(self.tempdir + filename)
+    @cached("services")
+    @instrumented
+    def get_services(self, where=None, fields=None):
+        if fields is not None:
+            return self.print_as_value("/ip service", where, fields)
 
-        return self.routes
+        if self.output_format != "text":
+            return self.parse_service_records(self.print_as_value("/ip service", where))
 
-    def get_services(self):
-        self.services = []        
+        return self.parse_services(self.run_command(self.filtered("/ip service print without-paging", where)))
 
-        self.output = self.net_connect.send_command("/ip service print without-paging")        
+    @cached("users")
+    @instrumented
+    def get_users(self, where=None, fields=None):
+        if fields is not None:
+            return self.print_as_value("/user", where, fields)
 
-        for line in self.output.splitlines():
-            service = {}
+        if self.output_format != "text":
+            return self.parse_user_records(self.print_as_value("/user", where))
 
-            parsed = re.sub(" +", " ", line).strip().split(" ")            
+        return self.parse_users(self.run_command(self.filtered("/user print", where)))
 
-            if re.search("^([0-9]|1[0-9]|2[0-9])", parsed[0]):
-                if re.search("[XI]", parsed[1]):
-                    service["name"] = parsed[2]
-                    service["port"] = parsed[3]
-                    if len(parsed) > 4:
-                        service["address"] = parsed[4]
-                else:
-                    service["name"] = parsed[1]
-                    service["port"] = parsed[2]
-                    if len(parsed) > 3:
-                        service["address"] = parsed[3]
-                
-                self.services.append(service)
+    @instrumented
+    def get_inventory(self):
+        # Everything InventoryStore keeps about the device: {"identity", "resources", "interfaces", "ip_addresses",
+        # "services", "users"}, the lists with the properties of INVENTORY_FIELDS
+        inventory = {"identity": self.get_identity(), "resources": self.get_resources()}
 
-        return self.services
+        for kind, fields in INVENTORY_FIELDS.items():
+            inventory[kind] = getattr(self, "get_" + kind)(fields=fields)
 
-    def get_users(self):
-        self.users = []
+        return inventory
 
-        self.output = self.net_connect.send_command("/user print")        
+    @instrumented
+    def print_as_value(self, path, where=None, fields=None, timeout=None):
+        return self.parse_as_value(self.run_command(self.as_value_query(path, where, fields), timeout=timeout))
 
-        for line in self.output.splitlines():
-            user = {}
-            parsed = re.sub(" +", " ", line).strip().split(" ")
 
-            if re.search("^([0-9]|1[0-9]|2[0-9])", parsed[0]):
-                user["username"] = parsed[1]
-                user["group"] = parsed[2]            
-                self.users.append(user)
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> MONITOR methods
+    def monitor_traffic(self, interfaces, interval=1, timeout=None):
+        # One event per interface and sample: {"name": "ether1", "rx-bits-per-second": 8200, ..., "received": <epoch>}
+        if not isinstance(interfaces, str):
+            interfaces = ",".join(interfaces)
+
+        command = f"/interface monitor-traffic interface={self.quote_value(interfaces)} interval={interval} without-paging"
+
+        return self.subscribe(command, MonitorParser(), self.command_timeout if timeout is None else timeout)
 
-        return self.users        
+    def monitor_resources(self, timeout=None):
+        # One event per second: {"cpu-used": 5, "cpu-used-per-cpu": "5%,3%", "free-memory": 126353408, "received": <epoch>}
+        return self.subscribe("/system resource monitor without-paging", MonitorParser(), self.command_timeout if timeout is None else timeout)
+
+    def follow_log(self, where=None, history=False, timeout=None):
+        # New log entries as they are written; history=True starts with the entries already in memory. Logs can
+        # stay quiet for any time, so there is no timeout unless one is given
+        command = self.filtered(f"/log print {'follow' if history else 'follow-only'} without-paging", where)
+
+        return self.subscribe(command, LogParser(), timeout)
+
+    def subscribe(self, command, parser, timeout=None):
+        # Events parsed from a command that keeps printing until it is closed. It runs on an SSH channel of its
+        # own, so other commands can be sent to the device while subscriptions are open
+        return Subscription(self.transport.open_stream(command, timeout), parser)
 
 
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> UPDATE methods
+    @invalidates()
     def update_address_pool(self, pool_name, new_pool_name=None, addresses=None, next_pool=None):
-        self.cmd = f"/ip pool set {pool_name}"
+        cmd = f"/ip pool set {pool_name}"
 
         if new_pool_name is not None:
-            self.cmd += f" name={new_pool_name}"
+            cmd += f" name={new_pool_name}"
 
         if addresses is not None:
-            self.cmd += f" ranges={addresses}"
+            cmd += f" ranges={addresses}"
 
         if next_pool is not None:
-            self.cmd += f" next-pool={next_pool}"
+            cmd += f" next-pool={next_pool}"
 
-        return self.check_result(self.net_connect.send_command(self.cmd))
+        return self.check_result(self.run_command(cmd))
 
+    @invalidates("ip_addresses", "routes")
     def update_dhcp_client(self, interface, disabled, add_default_route, route_distance, use_peer_dns, use_peer_ntp):
-        return self.check_result(self.net_connect.send_command(f"/ip dhcp-client set numbers=[find interface=\"{interface}\"] disabled={disabled} add-default-route={add_default_route} default-route-distance={route_distance} use-peer-dns={use_peer_dns} use-peer-ntp={use_peer_ntp}"))
+        return self.check_result(self.run_command(f"/ip dhcp-client set numbers=[find interface=\"{interface}\"] disabled={disabled} add-default-route={add_default_route} default-route-distance={route_distance} use-peer-dns={use_peer_dns} use-peer-ntp={use_peer_ntp}"))
 
+    @invalidates()
     def update_dhcp_server_server(self, interface, disabled=None, name=None, lease_time=None, address_pool=None):
-        self.cmd = f"/ip dhcp-server set numbers=[find interface=\"{interface}\"]"
+        cmd = f"/ip dhcp-server set numbers=[find interface=\"{interface}\"]"
 
         if disabled is not None:
-            self.cmd += f" disabled={disabled}"
+            cmd += f" disabled={disabled}"
 
         if name is not None:
-            self.cmd += f" name={name}"
+            cmd += f" name={name}"
 
         if lease_time is not None:
-            self.cmd += f" lease-time={lease_time}"
+            cmd += f" lease-time={lease_time}"
 
         if address_pool is not None:
-            self.cmd += f" address-pool={address_pool}"
+            cmd += f" address-pool={address_pool}"
 
-        return self.check_result(self.net_connect.send_command(self.cmd))
+        return self.check_result(self.run_command(cmd))
 
+    @invalidates()
     def update_dhcp_server_network(self, address, gateway=None, netmask=None, dns_server=None, ntp_server=None):
-        get_networks = self.net_connect.send_command("/ip dhcp-server network print")
-
-        network_match = False
-        network_count = 0
-
-        for network in get_networks.splitlines():
-            parsed_line = re.sub(" +", " ", network).strip().split(" ")
-
-            if re.search("^\d+", parsed_line[0]):
-                network_count += 1
-
-                if parsed_line[1] == address:
-                    network_match = True
+        # Only the number of networks and of matches cross the link, not the whole table
+        counts = self.parse_counts(self.run_command(self.count_query("/ip dhcp-server network", {"address": address})))
+        error, cmd = self.dhcp_network_command(counts, address, gateway, netmask, dns_server, ntp_server)
 
-                    self.cmd = f"/ip dhcp-server network set numbers=[find address=\"{address}\"]"
+        if error is not None:
+            return error
 
-                    if gateway is not None:
-                        self.cmd += f" gateway={gateway}"
-
-                    if netmask is not None:
-                        self.cmd += f" netmask={netmask}"
-
-                    if dns_server is not None:
-                        self.cmd += f" dns-server={dns_server}"
-
-                    if ntp_server is not None:
-                        self.cmd += f" ntp-server={ntp_server}"                    
-
-                    return self.check_result(self.net_connect.send_command(self.cmd))
-
-        if network_count == 0:
-            return "ERROR: There are not any created network. Please, create it first"
-
-        if network_match == False:
-            return "ERROR: There are not any network with specified address"
+        return self.check_result(self.run_command(cmd))
 
+    @invalidates("identity")
     def update_identity(self, name):
-        return self.check_result(self.net_connect.send_command(f"/system identity set name={name}"))
+        return self.check_result(self.run_command(f"/system identity set name={name}"))
 
+    @invalidates("ip_addresses", "routes")
     def update_ip_address(self, interface, address, disabled="no"):
-        return self.check_result(self.net_connect.send_command(f"/ip address set address={address} disabled={disabled} [find interface=\"{interface}\"]"))
+        return self.check_result(self.run_command(f"/ip address set address={address} disabled={disabled} [find interface=\"{interface}\"]"))
 
+    @invalidates("services")
     def update_services(self, service, disabled, port=None, address=None):
-        self.command = f"/ip service set {service} disabled={disabled}"
+        cmd = f"/ip service set {service} disabled={disabled}"
+
+        if port is not None:
+            cmd += f" port={port}"
 
-        if port != None:
-            self.command += f" port={port}"
-        
-        if address != None:
-            self.command += f" address={address}"
+        if address is not None:
+            cmd += f" address={address}"
 
-        return self.check_result(self.net_connect.send_command(self.command))
+        return self.check_result(self.run_command(cmd))
 
+    @invalidates("users")
     def update_user(self, username, password, group):
-        self.command = f"/user set {username}"        
+        cmd = f"/user set {username}"
 
         if password != "":
-            self.command += f" password={password}"
+            cmd += f" password={password}"
 
         if group != "":
-            self.command += f" group={group}"
+            cmd += f" group={group}"
 
-        return self.check_result(self.net_connect.send_command(self.command))
+        return self.check_result(self.run_command(cmd))
 
 
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> CREATE methods
+    @invalidates()
     def create_address_pool(self, name, range, next_pool="none"):
-        return self.check_result(self.net_connect.send_command(f"/ip pool add name={name} ranges={range} next-pool={next_pool}"))
+        return self.check_result(self.run_command(f"/ip pool add name={name} ranges={range} next-pool={next_pool}"))
 
+    @invalidates("ip_addresses", "routes")
     def create_dhcp_client(self, interface, disabled="no", add_default_route="yes", route_distance=1, use_peer_dns="yes", use_peer_ntp="yes"):
-        return self.check_result(self.net_connect.send_command(f"""
+        return self.check_result(self.run_command(f"""
             /ip dhcp-client add interface=\"{interface}\" disabled={disabled} add-default-route={add_default_route} default-route-distance={route_distance} use-peer-dns={use_peer_dns} use-peer-ntp={use_peer_ntp}
             """))
 
+    @invalidates()
     def create_dhcp_server(self, interface, network_address=None, disabled="no", name="dhcp_server", address_pool="static-only", lease_time="00:10:00", dns_server="1.1.1.1,9.9.9.9"):
-        server_cmd = self.check_result(self.net_connect.send_command(f"/ip dhcp-server add disabled={disabled} interface=\"{interface}\" name={name} address-pool={address_pool} lease-time={lease_time}"))
-        network_cmd = ""
-
-        if server_cmd == True:
-            ip_addresses = self.get_ip_addresses()
-            available_ip_addresses = []
-            
-            for ip_address in ip_addresses:
-                if ip_address['interface'] == interface:
-                    available_ip_addresses.append(ip_address['address'])
-                    
-            if len(available_ip_addresses) == 1:
-                network = ip_address['network']
-                prefix = ip_address['address'].split("/")[1]
-                address = network + "/" + prefix
-                gateway = ip_address['address'].split("/")[0]
-                
-                network_cmd = self.check_result(self.net_connect.send_command(f"/ip dhcp-server network add address={address} gateway={gateway} dns-server={dns_server}"))
+        server_cmd = self.check_result(self.run_command(self.dhcp_server_add_command(interface, disabled, name, address_pool, lease_time)))
 
-                if network_cmd is not True:
-                    return network_cmd
+        # check_result() is None when the device printed nothing, which is how 'add' succeeds
+        if server_cmd not in (True, None):
+            return server_cmd
 
-            else:
-                if network_address is not None:                    
-                    network = ip_address['network']
-                    prefix = ip_address['address'].split("/")[1]
-                    address = network + "/" + prefix
-                    gateway = ip_address['address'].split("/")[0]
-                
-                    network_cmd = self.check_result(self.net_connect.send_command(f"/ip dhcp-server network add address={address} gateway={gateway} dns-server={dns_server}"))
+        cmd, result = self.dhcp_network_add_command(self.get_ip_addresses(), interface, network_address, dns_server)
 
-                    if network_cmd is not True:
-                        return network_cmd
-                    
-                else:
-                    err_msg = f"ERROR: There is more than one IP address assigned to the same interface. Run the command again and pass 'network_address' parameter with the IP address on which you want to configure the DHCP server."
-                    print(err_msg, "\nAvailable IP addresses are:")
+        if cmd is None:
+            return result
 
-                    for ip in available_ip_addresses:
-                        print(f"\t{ip}")
-
-        else:
-            return server_cmd
-
-        if server_cmd == True and network_cmd == True:
-            return True
+        return self.check_result(self.run_command(cmd))
 
+    @invalidates("ip_addresses", "routes")
     def create_ip_address(self, ip_address, interface):
-        return self.check_result(self.net_connect.send_command(f"/ip address add address={ip_address} interface=\"{interface}\""))
+        return self.check_result(self.run_command(f"/ip address add address={ip_address} interface=\"{interface}\""))
 
+    @invalidates("routes")
     def create_route(self, dst_address, gateway, distance, disabled="no"):
-        return self.check_result(self.net_connect.send_command(f"/ip route add dst-address={dst_address} gateway={gateway} distance={distance} disabled={disabled}"))
+        return self.check_result(self.run_command(f"/ip route add dst-address={dst_address} gateway={gateway} distance={distance} disabled={disabled}"))
 
+    @invalidates("users")
     def create_user(self, username, password, group):
-        return self.check_result(self.net_connect.send_command(f"/user add name={username} password={password} group={group}"))
+        return self.check_result(self.run_command(f"/user add name={username} password={password} group={group}"))
 
 
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> TOOLS methods
-    def configure_wlan(self, ssid, password, band, country="no_country_set"):
-        self.net_connect.send_command(f"/interface wireless security-profiles remove auto_wlan")
+    @invalidates("routes")
+    def create_routes(self, routes, chunk_size=5000, progress=None, timeout=None):
+        # routes: iterable of dicts with the same keys as create_route() parameters
+        return self.import_commands(self.route_commands(routes), "routes", chunk_size, progress, timeout)
+
+    @invalidates()
+    def load_address_list(self, name, addresses, diff=False, chunk_size=5000, progress=None, timeout=None):
+        current = None
+
+        if diff:
+            current = self.address_list_entries(self.print_as_value("/ip firewall address-list", where=f"list={self.quote_value(name)} dynamic=no", timeout=timeout))
+
+        commands, added, removed = self.address_list_commands(name, addresses, current)
+        report = self.import_commands(commands, "address_list_" + re.sub(r"[^\w-]", "_", name), chunk_size, progress, timeout)
 
-        self.net_connect.send_command(f"/interface wireless security-profiles add name=auto_wlan mode=dynamic-keys authentication-types=wpa2-psk,wpa2-eap \
-                                        unicast-ciphers=aes-ccm,tkip group-ciphers=aes-ccm,tkip wpa2-pre-shared-key={password}")
+        if diff:
+            report['added'] = added
+            report['removed'] = removed
 
-        self.net_connect.send_command("/int wi reset-configuration [find]")
+        return report
 
-        output = self.net_connect.send_command(f"/interface wireless print detail")
-        ros_license_level = self.net_connect.send_command(f":put [/system license get nlevel]")
+    @invalidates("interfaces")
+    def configure_wlan(self, ssid, password, band, country="no_country_set"):
+        for command in self.wlan_profile_commands(password):
+            self.run_command(command)
+
+        output = self.run_command(f"/interface wireless print detail")
+        ros_license_level = self.run_command(f":put [/system license get nlevel]")
 
         if "input does not match" in ros_license_level:
-            ros_license_level = self.net_connect.send_command(f":put [/system license get level]")
+            ros_license_level = self.run_command(f":put [/system license get level]")
+
+        commands, message = self.wlan_commands(ssid, band, self.wlan_indexes(output), self.wlan_radio_mode(ros_license_level))
+
+        return self.wlan_result([self.run_command(command) for command in commands], message)
+
+    def batch(self, window=50):
+        from routeros_ssh_connector.batch import MikrotikBatch
+
+        return MikrotikBatch(self, window=window)
+
+    def download_backup(self, local_path, filename=None):
+        if filename == None:
+            filename = self.save_backup()
+
+            if filename is not None:
+                return self.download_file(filename, local_path)
+        else:
+            return self.download_file(filename, local_path)
+
+    def download_export(self, local_path, timeout=None):
+        print("*** INFO ***: This process may take some time to get info depending on how many config are in your device. Please wait...")
+
+        filename = self.save_export(timeout)
+
+        return self.download_file(filename, local_path)
+
+    def download_file(self, filename, local_path):
+        remote_path = "/" + filename
+        local_path = local_path + f"/{filename}"
+
+        try:
+            self.sftp_transfer("get", remote_path, local_path)
+
+            return local_path
+
+        except Exception as e:
+            if "Errno 13" in str(e):
+                print(f"ERROR: Permission denied in local folder {local_path}")
+                return False
+
+            elif "Errno 2" in str(e):
+                print("ERROR: File '{}'not found. Please make sure that file exists in remote device".format(remote_path.replace("/", "")))
+                return False
+
+            else:
+                print(f"ERROR: {e}")
+                return False
+
+    @invalidates()
+    def enable_cloud_dns(self, timeout=None):
+        self.run_command("/ip cloud set ddns-enabled=yes")
+
+        return self.wait_for(":put [/ip cloud get dns-name]", lambda dns_name: dns_name.strip() != "", timeout)
+
+    def make_backup(self, name="backup", password=None, encryption="aes-sha256", dont_encrypt="yes", timeout=None):
+        return self.save_backup(name, password, encryption, dont_encrypt, timeout) is not None
+
+    @invalidates(ALL)
+    def reboot_device(self):
+        with self.reboot_script() as (folder, filename):
+            return self.upload_file(folder, filename)
+
+    @invalidates(ALL)
+    def send_command(self, query, timeout=None):
+        return "\n".join(line.lstrip() for line in str(self.run_command(query, timeout=timeout)).splitlines() if line != "")
+
+    def stream_command(self, query, timeout=None):
+        for line in self.transport.stream_command(query, self.command_timeout if timeout is None else timeout):
+            if line != "":
+                yield line.lstrip()
+
+    @invalidates(ALL)
+    def update_system(self, channel="long-term", timeout=None):
+        print("Checking RouterOS updates...")
+        self.run_command(f"/system routerboard settings set auto-upgrade=yes")
+
+        if self.check_for_updates(channel, timeout)['available']:
+            self.run_command("/system package update install")
+            return "Update available!. Updating RouterOS device..."
+        else:
+            return "Device is up to date!"
+
+    @invalidates(ALL)
+    def check_for_updates(self, channel="long-term", timeout=None):
+        # {"installed": "6.49.10", "latest": "6.49.11", "status": "New version is available", "available": True}
+        for command in self.update_check_commands(channel):
+            self.run_command(command)
+
+        status = self.wait_for(UPDATE_STATUS, self.update_checked, timeout)
+
+        return self.update_report(self.get_installed_version(), self.run_command(LATEST_VERSION), status)
+
+    @invalidates(ALL)
+    def download_update(self, timeout=None):
+        # Downloads the packages of the latest version without installing them, the next reboot does. True once
+        # the device reports them downloaded
+        self.run_command("/system package update download", timeout=timeout)
+
+        status = self.wait_for(UPDATE_STATUS, self.update_downloaded, timeout)
+
+        return "downloaded" in status.lower()
+
+    def get_installed_version(self):
+        return self.run_command(INSTALLED_VERSION).strip()
+
+    def newer_version(self, version, than):
+        # False when either one is not a version, e.g. when the update server could not be reached
+        try:
+            return Version(version) > Version(than)
+        except InvalidVersion:
+            return False
+
+    def upload_file(self, local_path, filename):
+        remote_path = "/" + filename
+        local_path = local_path + f"/{filename}"
+
+        try:
+            self.sftp_transfer("put", remote_path, local_path)
+            return True
+
+        except Exception as e:
+            print(f"ERROR: {e}")
+            return False
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Auxiliary methods
+    def enable_cache(self, ttl=10, ttls=None, maxsize=256):
+        # ttls: per-method TTLs in seconds, e.g. {"get_identity": 3600}
+        self.cache = TTLCache(ttl=ttl, ttls=ttls, maxsize=maxsize)
+
+    def disable_cache(self):
+        self.cache = None
+
+    def cache_stats(self):
+        return None if self.cache is None else self.cache.stats()
+
+    def invalidate(self, *tags):
+        # What writes do after running: cached results with these tags and the full export are dropped, and
+        # getters started from now on don't join the ones in flight
+        self.flights.forget()
+
+        if self.cache is not None:
+            self.cache.invalidate("export", *tags)
+
+    def add_hook(self, hook):
+        # hook: callable that gets every finished event, or an object with before(event) and/or after(event) methods
+        self.hooks.append(hook)
+
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def route_lines(self, timeout=None, where=None, fields=None):
+        # Lines of '/ip route print detail terse', read straight from the SFTP handle, nothing is written locally.
+        # Unique name, so calls from several threads don't overwrite or remove each other's file
+        filename = f"routes_{self.get_identity()}_{uuid.uuid4().hex[:8]}.txt"
+
+        self.run_command(self.filtered(f"/ip route print detail terse without-paging file={filename}", where, fields), timeout=timeout, sentinel=True)
+
+        try:
+            pending = b""
+
+            for block in self.read_blocks("/" + filename):
+                lines = (pending + block).split(b"\n")
+                pending = lines.pop()
+
+                for line in lines:
+                    yield line.decode("utf-8", errors="replace") + "\n"
+
+            if pending:
+                yield pending.decode("utf-8", errors="replace")
+
+        finally:
+            self.run_command(f"/file remove {filename}")
+
+    def read_blocks(self, remote_path, size=65536):
+        # Contents of a file on the device, block by block. sftp_lock is only held while a block is read and never
+        # while the caller works on it, so transfers from other threads go on between blocks
+        handle = None
+        offset = 0
+        retried = False
+
+        try:
+            while True:
+                with self.sftp_lock:
+                    try:
+                        if handle is None:
+                            handle = self.open_file(remote_path, offset)
+
+                        block = handle.read(size)
+
+                    except (EOFError, OSError, paramiko.SSHException):
+                        # Like transfer(), retry once on a fresh session if the device dropped the cached one,
+                        # going on from the offset already read
+                        if retried or self.sftp_transport is not None and self.sftp_transport.is_active():
+                            raise
+
+                        retried = True
+                        handle = None
+                        self.drop_sftp()
+                        continue
+
+                if not block:
+                    return
+
+                offset += len(block)
+                yield block
+
+        finally:
+            if handle is not None:
+                with self.sftp_lock:
+                    handle.close()
+
+    def open_file(self, remote_path, offset=0):
+        # Called with sftp_lock held
+        handle = self.open_sftp().open(remote_path, "rb")
+        handle.seek(offset)
+
+        if self.sftp_options['prefetch']:
+            handle.prefetch(max_concurrent_requests=self.sftp_options['max_requests'])
+
+        return handle
+
+    def run_command(self, command, timeout=None, sentinel=False):
+        with measure(self, "command", command=command) as measurement:
+            output = self.transport.send_command(command, self.command_timeout if timeout is None else timeout, sentinel=sentinel)
+            measurement.received(output)
+
+        return output
+
+    @invalidates(ALL)
+    def run_commands(self, commands, timeout=None):
+        with measure(self, "command", "run_commands", "; ".join(commands)) as measurement:
+            outputs = self.transport.send_commands(commands, self.command_timeout if timeout is None else timeout)
+            measurement.received(outputs)
+
+        return outputs
+
+    @invalidates(ALL)
+    def run_batch(self, commands, timeout=None, stop_on_error=False):
+        with measure(self, "command", "run_batch", "; ".join(commands)) as measurement:
+            outputs = self.transport.send_batch(commands, self.command_timeout if timeout is None else timeout, stop_on_error=stop_on_error)
+            measurement.received(outputs)
+
+        return outputs
+
+    def wait_for(self, query, condition, timeout=None):
+        deadline = time.monotonic() + (self.command_timeout if timeout is None else timeout)
+        output = self.run_command(query)
+
+        while not condition(output) and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            output = self.run_command(query)
+
+        return output
+
+    def sftp_transfer(self, direction, remote_path, local_path):
+        with self.sftp_lock:
+            self.transfer(direction, remote_path, local_path)
+
+    def transfer(self, direction, remote_path, local_path):
+        # Retry once on a fresh session if the cached one was dropped by the device
+        for attempt in range(2):
+            sftp = self.get_sftp()
+
+            try:
+                with measure(self, "transfer", direction, remote_path) as measurement:
+                    if direction == "get":
+                        sftp.stat(remote_path)
+                        sftp.get(remotepath=remote_path, localpath=local_path, prefetch=self.sftp_options['prefetch'], max_concurrent_prefetch_requests=self.sftp_options['max_requests'])
+                    else:
+                        sftp.put(localpath=local_path, remotepath=remote_path)
+
+                    measurement.transferred(os.path.getsize(local_path))
+
+                return
+
+            except (EOFError, OSError, paramiko.SSHException):
+                if attempt == 0 and not self.sftp_transport.is_active():
+                    self.close_sftp()
+                    continue
+
+                raise
+
+    def capture_commands(self, method, *args, **kwargs):
+        # Runs a write method against a recorder instead of the device and returns the commands it would send.
+        # The recorder replaces run_command on a shallow copy, so other threads keep using the device meanwhile
+        commands = []
+        recorder = copy.copy(self)
+        recorder.run_command = lambda command, **options: commands.append(command) or ""
+
+        # Nothing changed on the device yet. Whoever sends the commands invalidates the cache, e.g. run_batch()
+        recorder.invalidate = lambda *tags: None
+
+        getattr(MikrotikDevice, method)(recorder, *args, **kwargs)
+
+        return commands
+
+    def save_backup(self, name="backup", password=None, encryption="aes-sha256", dont_encrypt="yes", timeout=None):
+        # Name of the backup file created on the device, or None
+        filename, cmd = self.backup_command(self.get_identity(), name, password, encryption, dont_encrypt)
+
+        return self.backup_saved(filename, self.run_command(cmd, timeout=timeout, sentinel=True))
+
+    def save_export(self, timeout=None):
+        filename, cmd = self.export_command(self.get_identity())
+
+        self.run_command(cmd, timeout=timeout, sentinel=True)
+        self.last_export = {"name": filename}
+
+        return filename
+
+    def backup_command(self, identity, name="backup", password=None, encryption="aes-sha256", dont_encrypt="yes"):
+        # (file name, command). Every call gets a name of its own and last_backup is only kept for reference,
+        # as other threads may be saving their own backup
+        filename = f"{name}_{identity}_{self.current_datetime}_{uuid.uuid4().hex[:8]}.backup"
 
-        radio_mode = None
+        base_cmd = f"/system backup save name={filename} encryption={encryption} dont-encrypt={dont_encrypt}"
 
+        if password is not None:
+            base_cmd += f" password={password}"
+
+        return filename, base_cmd
+
+    def backup_saved(self, filename, output):
+        self.last_backup = {"name": filename}
+
+        return filename if "backup saved" in output else None
+
+    def export_command(self, identity):
+        filename = f"export_{identity}_{self.current_datetime}_{uuid.uuid4().hex[:8]}.rsc"
+
+        return filename, f"/export terse file={filename}"
+
+    def dhcp_network_command(self, counts, address, gateway=None, netmask=None, dns_server=None, ntp_server=None):
+        # (error, command). counts: (networks, matching) from count_query(), None when they couldn't be read
+        if counts is None:
+            return "ERROR: Unable to read DHCP server networks", None
+
+        if counts[0] == 0:
+            return "ERROR: There are not any created network. Please, create it first", None
+
+        if counts[1] == 0:
+            return "ERROR: There are not any network with specified address", None
+
+        cmd = f"/ip dhcp-server network set numbers=[find {self.where_clause({'address': address})}]"
+
+        if gateway is not None:
+            cmd += f" gateway={gateway}"
+
+        if netmask is not None:
+            cmd += f" netmask={netmask}"
+
+        if dns_server is not None:
+            cmd += f" dns-server={dns_server}"
+
+        if ntp_server is not None:
+            cmd += f" ntp-server={ntp_server}"
+
+        return None, cmd
+
+    def dhcp_server_add_command(self, interface, disabled="no", name="dhcp_server", address_pool="static-only", lease_time="00:10:00"):
+        return f"/ip dhcp-server add disabled={disabled} interface=\"{interface}\" name={name} address-pool={address_pool} lease-time={lease_time}"
+
+    def dhcp_network_add_command(self, ip_addresses, interface, network_address=None, dns_server="1.1.1.1,9.9.9.9"):
+        # (command, None) for the network of the interface address, or (None, what create_dhcp_server returns)
+        # when there is none or it can't tell which one. network_address picks an address, with or without prefix
+        available_ip_addresses = [ip_address for ip_address in ip_addresses if ip_address['interface'] == interface]
+
+        if not available_ip_addresses:
+            return None, f"ERROR: There are not any IP address assigned to interface {interface}"
+
+        if network_address is not None:
+            available_ip_addresses = [ip_address for ip_address in available_ip_addresses if network_address in (ip_address['address'], ip_address['address'].split("/")[0])]
+
+            if not available_ip_addresses:
+                return None, f"ERROR: IP address {network_address} is not assigned to interface {interface}"
+
+        elif len(available_ip_addresses) > 1:
+            err_msg = f"ERROR: There is more than one IP address assigned to the same interface. Run the command again and pass 'network_address' parameter with the IP address on which you want to configure the DHCP server."
+            print(err_msg, "\nAvailable IP addresses are:")
+
+            for ip_address in available_ip_addresses:
+                print(f"\t{ip_address['address']}")
+
+            return None, None
+
+        ip_address = available_ip_addresses[0]
+        address = ip_address['network'] + "/" + ip_address['address'].split("/")[1]
+        gateway = ip_address['address'].split("/")[0]
+
+        return f"/ip dhcp-server network add address={address} gateway={gateway} dns-server={dns_server}", None
+
+    @contextlib.contextmanager
+    def reboot_script(self):
+        # (folder, file name) of the script that reboots the device, which runs as soon as it is uploaded. It is
+        # written in a folder of its own, so devices rebooted at the same time never share the local file
+        folder = tempfile.mkdtemp()
+
+        try:
+            with open(os.path.join(folder, "reboot.auto.rsc"), "w") as script:
+                script.write("/system reboot")
+
+            yield folder, "reboot.auto.rsc"
+
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def update_check_commands(self, channel):
+        return [f"/system package update set channel={channel}", "/system package update check-for-updates once"]
+
+    def update_checked(self, status):
+        return "finding out" not in status and "checking" not in status
+
+    def update_downloaded(self, status):
+        return "downloaded" in status.lower() or "error" in status.lower()
+
+    def update_report(self, installed, latest, status):
+        latest = latest.strip()
+
+        return {"installed": installed, "latest": latest, "status": status.strip(), "available": self.newer_version(latest, installed)}
+
+    def wlan_profile_commands(self, password):
+        return [f"/interface wireless security-profiles remove auto_wlan",
+                f"/interface wireless security-profiles add name=auto_wlan mode=dynamic-keys authentication-types=wpa2-psk,wpa2-eap \
+                                        unicast-ciphers=aes-ccm,tkip group-ciphers=aes-ccm,tkip wpa2-pre-shared-key={password}",
+                "/int wi reset-configuration [find]"]
+
+    def wlan_radio_mode(self, ros_license_level):
         if int(ros_license_level) < 4:
-            radio_mode = "bridge"
+            return "bridge"
         else:
-            radio_mode = "ap-bridge"     
+            return "ap-bridge"
 
+    def wlan_indexes(self, output):
+        # (2.4 GHz, 5 GHz) interface numbers in '/interface wireless print detail', None when missing
         wlan_2g_index = None
         wlan_5g_index = None
 
@@ -405,7 +912,7 @@ class MikrotikDevice:
                 if "name" in line:
                     interface_index = int(line.strip().split(" ")[0])
                     frequency = re.search(r"frequency=(.*?) [a-z]", line)
-                    
+
                     if frequency:
                         if int(frequency.group(1)) in range (2000,3000):
                             wlan_2g_index = interface_index
@@ -413,6 +920,12 @@ class MikrotikDevice:
                         elif int(frequency.group(1)) in range (5000,6000):
                             wlan_5g_index = interface_index
 
+        return wlan_2g_index, wlan_5g_index
+
+    def wlan_commands(self, ssid, band, indexes, radio_mode):
+        # (commands, message returned when they succeed). Without commands the message is returned as it is
+        wlan_2g_index, wlan_5g_index = indexes
+
         query_cmd_2g = f"/interface wireless set {wlan_2g_index} disabled=no ssid={ssid} radio-name={ssid} mode={radio_mode} band=2ghz-b/g/n channel-width=20/40mhz-Ce \
             frequency=auto wireless-protocol=802.11 wps-mode=disabled frequency-mode=regulatory-domain country=no_country_set installation=indoor wmm-support=enabled \
                 max-station-count=100 distance=indoors hw-retries=8"
@@ -422,192 +935,192 @@ class MikrotikDevice:
                 max-station-count=100 distance=indoors hw-retries=8"
 
         if band == "2g":
-            if wlan_2g_index != None:                
-                output = self.net_connect.send_command(query_cmd_2g)
-                        
-                if "any value of country" in output:
-                    return "ERROR: Invalid country name!"
-                else:
-                    return "2.4 GHz wlan configured sucessfully!"
+            if wlan_2g_index != None:
+                return [query_cmd_2g], "2.4 GHz wlan configured sucessfully!"
 
-            else:
-                return "There aren't any 2.4 GHz wlan interface present"
+            return [], "There aren't any 2.4 GHz wlan interface present"
 
         elif band == "5g":
             if wlan_5g_index != None:
-                output = self.net_connect.send_command(query_cmd_5g)
-
-                if "any value of country" in output:
-                    return "ERROR: Invalid country name!"
-                else:
-                    return "5 GHz wlan configured sucessfully!"
+                return [query_cmd_5g], "5 GHz wlan configured sucessfully!"
 
-            else:
-                return "There aren't any 5 GHz wlan interface present"
+            return [], "There aren't any 5 GHz wlan interface present"
 
         elif band == "both":
             if wlan_2g_index != None and wlan_5g_index != None:
-                output2 = self.net_connect.send_command(query_cmd_2g)
-
-                output5 = self.net_connect.send_command(query_cmd_5g)
-
-                if "any value of country" in output2 or "any value of country" in output5:
-                    return "ERROR: Invalid country name!"
-                else:
-                    return "2.4 and 5 GHz wlan configured sucessfully!"
+                return [query_cmd_2g, query_cmd_5g], "2.4 and 5 GHz wlan configured sucessfully!"
 
             elif wlan_2g_index != None and wlan_5g_index == None:
                 print("WARNING: There aren't any 5 GHz wlan interface present. Configuring 2.4 GHz wlan only")
-
-                output = self.net_connect.send_command(query_cmd_2g)
-
-                if "any value of country" in output:
-                    return "ERROR: Invalid country name!"
-                else:
-                    return "2.4 GHz wlan configured sucessfully!"                
+                return [query_cmd_2g], "2.4 GHz wlan configured sucessfully!"
 
             elif wlan_2g_index == None and wlan_5g_index != None:
                 print("WARNING: There aren't any 2.4 GHz wlan interface present. Configuring 5 GHz wlan only")
+                return [query_cmd_5g], "5 GHz wlan configured sucessfully!"
 
-                self.net_connect.send_command(query_cmd_5g)
+        return [], None
 
-                if "any value of country" in output:
-                    return "ERROR: Invalid country name!"
-                else:
-                    return "5 GHz wlan configured sucessfully!"
+    def wlan_result(self, outputs, message):
+        if any("any value of country" in output for output in outputs):
+            return "ERROR: Invalid country name!"
 
-    def download_backup(self, local_path, filename=None):
-        if filename == None:
-            if self.make_backup():
-                return self.download_file(self.last_backup['name'], local_path)
-        else:
-            return self.download_file(filename, local_path)
+        return message
 
-    def download_export(self, local_path):
-        print("*** INFO ***: This process may take some time to get info depending on how many config are in your device. Please wait...")
+    def as_value_query(self, path, where=None, fields=None):
+        query = self.filtered(f"{path} print as-value", where, fields)
 
-        self.last_export['name'] = "export_" + self.get_identity() + "_" + self.current_datetime + ".rsc"
-        self.net_connect.send_command(f"/export terse file={self.last_export['name']}", delay_factor=16)
+        if self.output_format == "json":
+            return f":put [:serialize to=json [{query}]]"
 
-        return self.download_file(self.last_export['name'], local_path)
+        # One 'key=value' line per property and a lone '.' closing each record
+        return f":foreach item in=[{query}] do={{:foreach key,value in=$item do={{:put ($key . \"=\" . [:tostr $value])}}; :put \".\"}}"
 
-    def download_file(self, filename, local_path):
-        transport = paramiko.Transport((self.device['host'], self.device['port']))
-        transport.connect(None, self.device['username'], self.device['password'])
-        sftp = paramiko.SFTPClient.from_transport(transport)
+    def quote_value(self, value):
+        return '"' + QUOTED_SPECIAL.sub(lambda special: ESCAPES.get(special.group(), "\\%02X" % ord(special.group())), str(value)) + '"'
 
-        remote_path = "/" + filename
-        local_path = local_path + f"/{filename}"
+    def filtered(self, command, where=None, fields=None):
+        # Lets the device drop rows and columns before they are sent: 'proplist' must come before 'where',
+        # which takes the rest of the line
+        if fields is not None:
+            command += " proplist=" + ",".join(self.property_name(field) for field in fields)
 
-        try:
-            sftp.stat(remote_path)
-            sftp.get(remotepath=remote_path, localpath=local_path)
-            
-            return local_path
+        if where is not None and where != {}:
+            command += " where " + self.where_clause(where)
 
-        except Exception as e:
-            if "Errno 13" in str(e):
-                print(f"ERROR: Permission denied in local folder {local_path}")
-                return False
+        return command
 
-            elif "Errno 2" in str(e):
-                print("ERROR: File '{}'not found. Please make sure that file exists in remote device".format(remote_path.replace("/", "")))
-                return False
+    def where_clause(self, where):
+        # where: {property: value} pairs that must all match, or a raw RouterOS expression
+        if isinstance(where, str):
+            return where
 
-            else:
-                print(f"ERROR: {e}")
-                return False
+        conditions = []
 
-    def enable_cloud_dns(self):
-        self.net_connect.send_command("/ip cloud set ddns-enabled=yes")
-        time.sleep(2)
+        for key, value in where.items():
+            if isinstance(value, bool):
+                value = "yes" if value else "no"
 
-        return self.net_connect.send_command(":put [/ip cloud get dns-name]")
+            elif not isinstance(value, int):
+                value = self.quote_value(value)
 
-    def make_backup(self, name="backup", password=None, encryption="aes-sha256", dont_encrypt="yes"):
-        self.last_backup['name'] = name + "_" + self.get_identity() + "_" + self.current_datetime + ".backup"
+            conditions.append(f"{self.property_name(key)}={value}")
 
-        base_cmd = f"/system backup save name={self.last_backup['name']} encryption={encryption} dont-encrypt={dont_encrypt}"
+        return " and ".join(conditions)
 
-        if password is not None:
-            base_cmd += f" password={password}"
-        
-        self.output = self.net_connect.send_command(base_cmd, delay_factor=8)
+    def property_name(self, name):
+        if not PROPERTY_NAME.fullmatch(str(name)):
+            raise ValueError(f"Invalid RouterOS property name: {name!r}")
 
-        if "backup saved" in self.output:
-            return True
-        else:
-            return False
+        return name
 
-    def reboot_device(self):
-        filename = "reboot.auto.rsc"
-        f = open(self.tempdir + filename, "w")
-        f.write("/system reboot")
-        f.close()
+    def count_query(self, path, where):
+        # 'total,matching' for a menu in a single round trip
+        return f':put ([:len [{path} find]] . "," . [:len [{path} find where {self.where_clause(where)}]])'
+
+    def parse_counts(self, output):
+        counts = re.fullmatch(r"\s*(\d+),(\d+)\s*", str(output))
+
+        return None if counts is None else (int(counts.group(1)), int(counts.group(2)))
+
+    def import_commands(self, commands, name="import", chunk_size=5000, progress=None, timeout=None):
+        # Streams commands into numbered .rsc chunks that are uploaded, imported and removed one at a time
+        report = {"chunks": 0, "commands": 0, "errors": []}
+
+        for chunk in self.chunked(commands, chunk_size):
+            self.import_chunk(chunk, name, report, progress, timeout)
+
+        return report
 
-        if self.upload_file(self.tempdir, filename):
+    def import_chunk(self, chunk, name, report, progress, timeout):
+        filename = self.write_chunk(chunk, name, report)
+
+        try:
+            if not self.upload_file(self.tempdir, filename):
+                error = f"ERROR: Upload of '{filename}' failed"
+
+            else:
+                error = self.import_error(self.run_command(f"/import file-name={filename} verbose=no", timeout=timeout))
+                self.run_command(f"/file remove {filename}")
+
+        finally:
             os.remove(self.tempdir + filename)
-            return True
-        else:
-            return False
 
-    def send_command(self, query):
-        output = ""
+        self.chunk_done(chunk, report, error, progress)
 
-        for line in str(self.net_connect.send_command(query, delay_factor=8)).splitlines():
-            if line != "":
-                if output == "":
-                    output += line.lstrip()
-                else:
-                    output += "\n" + line.lstrip()
-        
-        return output
+    def chunked(self, commands, chunk_size):
+        commands = iter(commands)
+        chunk = list(itertools.islice(commands, chunk_size))
 
-    def update_system(self, channel="long-term"):
-        print("Checking RouterOS updates...")
-        self.net_connect.send_command(f"/system package update set channel={channel}")
-        self.net_connect.send_command(f"/system routerboard settings set auto-upgrade=yes")        
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(commands, chunk_size))
 
-        current_package_version = self.net_connect.send_command("/system package update print")
+    def write_chunk(self, chunk, name, report):
+        # Concurrent imports on one device each get their own files, locally and on the device
+        filename = f"{name}_{self.current_datetime}_{uuid.uuid4().hex[:8]}_{report['chunks']}.rsc"
 
-        current_version = ""
+        with open(self.tempdir + filename, "w") as rsc:
+            rsc.write("\n".join(chunk) + "\n")
 
-        for line in current_package_version.splitlines():
-            if line != "":
-                parsed_line = line.strip().replace(" ", "")
+        return filename
 
-                if parsed_line.split(":")[0] == "installed-version":
-                    current_version = Version(parsed_line.split(":")[1])
+    def import_error(self, output):
+        return None if "successfully" in output else output.strip()
 
-        self.net_connect.send_command("/system package update check-for-updates once")
-        time.sleep(3)
+    def chunk_done(self, chunk, report, error, progress):
+        if error is not None:
+            report['errors'].append({"chunk": report['chunks'], "error": error})
 
-        latest_version = Version(self.net_connect.send_command(":put [/system package update get latest-version]"))
+        report['chunks'] += 1
+        report['commands'] += len(chunk)
 
-        if latest_version > current_version:            
-            self.net_connect.send_command("/system package update install")
-            return "Update available!. Updating RouterOS device..."
-        else:
-            return "Device is up to date!"
+        if progress is not None:
+            progress(report)
 
-    def upload_file(self, local_path, filename):
-        transport = paramiko.Transport((self.device['host'], self.device['port']))
-        transport.connect(None, self.device['username'], self.device['password'])
-        sftp = paramiko.SFTPClient.from_transport(transport)
+    def route_commands(self, routes):
+        commands = (f"add dst-address={self.rsc_value(route['dst_address'])} gateway={self.rsc_value(route['gateway'])} "
+                    f"distance={self.rsc_value(route.get('distance', 1))} disabled={self.rsc_value(route.get('disabled', 'no'))}" for route in routes)
 
-        remote_path = "/" + filename
-        local_path = local_path + f"/{filename}"
+        return self.with_menu("/ip route", commands)
 
-        try:
-            sftp.put(localpath=local_path, remotepath=remote_path)
-            return True
+    def address_list_entries(self, records):
+        # {address: .id} of the static entries already in a list
+        return {self.normalize_address(entry['address']): entry['.id'] for entry in records}
 
-        except Exception as e:
-            print(f"ERROR: {e}")
-            return False
+    def address_list_commands(self, name, addresses, current=None):
+        # (commands, added, removed). With current, only the delta against the entries already on the device
+        # is sent; added and removed are None without it
+        addresses = (self.normalize_address(address) for address in addresses)
+        commands = []
+        added = removed = None
 
+        if current is not None:
+            wanted = set(addresses)
+            ids = [current[address] for address in current if address not in wanted]
+            addresses = [address for address in wanted if address not in current]
+            added, removed = len(addresses), len(ids)
+
+            commands = (f"remove {','.join(ids[start:start + 100])}" for start in range(0, len(ids), 100))
+
+        commands = itertools.chain(commands, (f"add list={self.quote_value(name)} address={self.rsc_value(address)}" for address in addresses))
+
+        return self.with_menu("/ip firewall address-list", commands), added, removed
+
+    def rsc_value(self, value):
+        value = str(value)
+
+        return value if PLAIN_VALUE.fullmatch(value) else self.quote_value(value)
+
+    def with_menu(self, menu, commands):
+        # Every chunk must start in the right menu, so the path is prefixed to each line
+        for command in commands:
+            yield f"{menu} {command}"
+
+    def normalize_address(self, address):
+        address = str(address).strip()
+
+        return address[:-3] if address.endswith("/32") else address
 
-# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Auxiliary methods
     def check_result(self, command_output):
         for line in command_output.splitlines():
             message = re.sub(" +", " ", line).strip()
@@ -617,8 +1130,96 @@ class MikrotikDevice:
             else:
                 return True
 
+    def parse_terse_line(self, line):
+        # Single pass over 'N FLAGS key=value key="quoted value" ...' lines. Bare words between
+        # pairs (e.g. 'gateway-status=1.1.1.1 reachable via ether1') belong to the previous value
+        record = {}
+        head = None
+        last_key = None
+        position = 0
+
+        for pair in TERSE_PAIR.finditer(line):
+            gap = line[position:pair.start()].strip()
+
+            if head is None:
+                head = gap
+            elif gap != "":
+                record[last_key] += " " + gap
+
+            key, value = pair.group(1), pair.group(2)
+
+            if value.startswith('"'):
+                value = value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+            record[key] = value
+            last_key = key
+            position = pair.end()
+
+        if head is None:
+            return None
+
+        tail = line[position:].strip()
+
+        if tail != "":
+            record[last_key] += " " + tail
+
+        head = head.split(" ", 1)
+
+        if not head[0].isdigit():
+            return None
+
+        record['index'] = head[0]
+        record['flags'] = head[1].strip() if len(head) > 1 else ""
+
+        return record
+
+    def parse_as_value(self, raw_output):
+        records = []
+
+        if self.output_format == "json":
+            for item in json.loads(raw_output):
+                records.append({key: self.convert_value(key, value) for key, value in item.items()})
+
+            return records
+
+        record = {}
+
+        for line in raw_output.splitlines():
+            key, separator, value = line.strip().partition("=")
+
+            if separator:
+                record[key] = self.convert_value(key, value)
+
+            elif key == "." and record:
+                records.append(record)
+                record = {}
+
+        return records
+
+    def convert_value(self, key, value):
+        if not isinstance(value, str):
+            return value
+
+        if value == "true":
+            return True
+
+        if value == "false":
+            return False
+
+        if key in NUMERIC_PROPERTIES and value.isdigit():
+            return int(value)
+
+        return value
+
+    def parse_identity(self, raw_identity):
+        for line in raw_identity.splitlines():            
+            parsed = re.sub(" +", "", line).strip().split(":")
+
+            if parsed != "":
+                return parsed[1]
+
     def parse_interfaces(self, raw_interfaces):
-        self.interfaces = []
+        interfaces = []
 
         for line in raw_interfaces.splitlines():
             interface = {}
@@ -669,6 +1270,128 @@ class MikrotikDevice:
                 else:
                     interface['mac_address'] = ""
 
-                self.interfaces.append(interface)
+                interfaces.append(interface)
+
+        return interfaces
+
+    def parse_ip_addresses(self, raw_ip_addresses):
+        ip_addresses = []
+
+        for line in raw_ip_addresses.splitlines():
+            ip_address = {}
+            parsed = re.sub(" +", " ", line).strip().split(" ")
+
+            if re.search("^([0-9]|[1-9][0-9]{1,2}|[1-7][0-9]{3}|80[0-9]{2}|81[0-8][0-9]|819[0-2])", parsed[0]):
+                if re.search("[A-Z]", parsed[1]):
+                    ip_address["address"] = parsed[2]
+                
+                else:
+                    ip_address["address"] = parsed[1]
+
+                ip_address["network"] = parsed[2]
+                ip_address["interface"] = parsed[3]
+                ip_addresses.append(ip_address)
+
+        return ip_addresses
+
+    def parse_resources(self, raw_resources):
+        resources = {}
+
+        for line in raw_resources.splitlines():            
+            parsed = line.replace(": ", ":").replace("MiB", " MiB").replace("KiB", " KiB").replace("MHz", " MHz").replace("%", " %").strip().split(":")
+
+            if parsed[0] != "":
+                if parsed[0] == "uptime":
+                    parsed[1] = parsed[1].replace("y", "y ").replace("w", "w ").replace("d", "d ").replace("h", "h ").replace("m", "m ")
+                    resources[parsed[0]] = parsed[1]
+
+                if parsed[0] == "build-time":
+                    resources[parsed[0]] = parsed[1] + ":" + parsed[2] + ":" + parsed[3]
+
+                else:
+                    resources[parsed[0]] = parsed[1]
+
+        return resources
+
+    def parse_routes(self, routes):
+        return RouteTable(routes)
+
+    def parse_services(self, raw_services):
+        services = []
+
+        for line in raw_services.splitlines():
+            service = {}
+
+            parsed = re.sub(" +", " ", line).strip().split(" ")            
+
+            if re.search("^([0-9]|1[0-9]|2[0-9])", parsed[0]):
+                if re.search("[XI]", parsed[1]):
+                    service["name"] = parsed[2]
+                    service["port"] = parsed[3]
+                    if len(parsed) > 4:
+                        service["address"] = parsed[4]
+                else:
+                    service["name"] = parsed[1]
+                    service["port"] = parsed[2]
+                    if len(parsed) > 3:
+                        service["address"] = parsed[3]
+                
+                services.append(service)
+
+        return services
+
+    def parse_users(self, raw_users):
+        users = []
+
+        for line in raw_users.splitlines():
+            user = {}
+            parsed = re.sub(" +", " ", line).strip().split(" ")
+
+            if re.search("^([0-9]|1[0-9]|2[0-9])", parsed[0]):
+                user["username"] = parsed[1]
+                user["group"] = parsed[2]            
+                users.append(user)
+
+        return users
+
+    def parse_interface_records(self, records):
+        interfaces = []
+
+        for record in records:
+            flags = ""
+
+            for flag, field in (("D", "dynamic"), ("X", "disabled"), ("R", "running"), ("S", "slave")):
+                if record.get(field) is True:
+                    flags += flag
+
+            interface = {"status": INTERFACE_STATUS.get(flags, flags), "name": record.get('name', "")}
+
+            if "default-name" in record:
+                interface["default-name"] = record['default-name']
+
+            interface["type"] = record.get('type', "")
+            interface["mtu"] = str(record.get('actual-mtu', ""))
+            interface["mac_address"] = record.get('mac-address', "")
+
+            interfaces.append(interface)
+
+        return interfaces
+
+    def parse_ip_address_records(self, records):
+        return [{"address": record['address'], "network": record['network'], "interface": record['interface']} for record in records]
+
+    def parse_service_records(self, records):
+        services = []
+
+        for record in records:
+            service = {"name": record['name'], "port": str(record['port'])}
+
+            if record.get('address', "") != "":
+                service["address"] = record['address']
+
+            services.append(service)
+
+        return services
 
-        return self.interfaces
+    def parse_user_records(self, records):
+        return [{"username": record['name'], "group": record['group']} for record in records]
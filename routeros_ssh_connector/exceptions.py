@@ -0,0 +1,14 @@
+class MikrotikConnectionError(Exception):
+    pass
+
+
+class MikrotikUnreachableError(MikrotikConnectionError):
+    pass
+
+
+class MikrotikTimeoutError(MikrotikConnectionError):
+    pass
+
+
+class MikrotikAuthenticationError(MikrotikConnectionError):
+    pass
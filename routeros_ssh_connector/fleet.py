@@ -0,0 +1,114 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from routeros_ssh_connector.connector import MikrotikDevice
+from routeros_ssh_connector.exceptions import MikrotikTimeoutError
+
+class MikrotikFleet:
+    def __init__(self, inventory, max_workers=32, timeout=300, conn_timeout=5, device_options=None, manager=None):
+        # inventory: iterable of dicts with the same keys as MikrotikDevice.connect()
+        # (ip_address, username, password and optionally port)
+        # manager: MikrotikConnectionManager whose sessions are reused between runs instead of connecting every time
+        self.inventory = list(inventory)
+        self.manager = manager
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.conn_timeout = conn_timeout
+        self.device_options = device_options or {}
+        self.poll_interval = 0.5
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Execution methods
+    def run(self, method, *args, **kwargs):
+        # Yields one result per device as soon as it completes, never raises for a single device
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = {}
+
+        try:
+            for host in self.inventory:
+                state = {}
+                future = executor.submit(self.run_on_device, host, state, method, args, kwargs)
+                pending[future] = (host, state)
+
+            while pending:
+                done, _ = wait(pending, timeout=self.poll_interval if self.timeout is not None else None, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    pending.pop(future)
+                    yield future.result()
+
+                if self.timeout is None:
+                    continue
+
+                now = time.monotonic()
+
+                for future, (host, state) in list(pending.items()):
+                    if "started" in state and now - state['started'] > self.timeout:
+                        pending.pop(future)
+                        self.abort(state)
+
+                        yield self.make_result(host, error=MikrotikTimeoutError(f"Device did not finish in {self.timeout} seconds"), elapsed=now - state['started'])
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_all(self, method, *args, **kwargs):
+        return list(self.run(method, *args, **kwargs))
+
+    def run_on_device(self, host, state, method, args, kwargs):
+        state['started'] = time.monotonic()
+
+        try:
+            if self.manager is not None:
+                with self.manager.device(**host) as device:
+                    state['device'] = device
+                    result = self.call(device, method, args, kwargs)
+
+                return self.make_result(host, result=result, elapsed=time.monotonic() - state['started'])
+
+            device = MikrotikDevice(**self.device_options)
+            state['device'] = device
+            device.connect(**host, conn_timeout=self.conn_timeout, exit_on_error=False)
+
+            try:
+                result = self.call(device, method, args, kwargs)
+
+            finally:
+                device.disconnect()
+
+            return self.make_result(host, result=result, elapsed=time.monotonic() - state['started'])
+
+        except Exception as e:
+            return self.make_result(host, error=e, elapsed=time.monotonic() - state['started'])
+
+    def call(self, device, method, args, kwargs):
+        if callable(method):
+            return method(device, *args, **kwargs)
+
+        return getattr(device, method)(*args, **kwargs)
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Auxiliary methods
+    def abort(self, state):
+        # Closing the session unblocks the worker thread stuck waiting on the device
+        if "device" not in state:
+            return
+
+        if self.manager is not None:
+            self.manager.discard(state['device'])
+            return
+
+        try:
+            state['device'].disconnect()
+        except Exception:
+            pass
+
+    def make_result(self, host, result=None, error=None, elapsed=0.0):
+        return {
+            "host": host.get('ip_address'),
+            "port": host.get('port', 22),
+            "ok": error is None,
+            "result": result,
+            "error": None if error is None else {"type": type(error).__name__, "message": str(error)},
+            "elapsed": elapsed,
+        }
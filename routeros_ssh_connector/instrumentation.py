@@ -0,0 +1,327 @@
+import bisect, contextvars, functools, inspect, re, threading, time
+
+try:
+    from opentelemetry import context as otel_context, trace
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:
+    trace = None
+
+# Values of these properties never leave the device object: hooks, metrics and spans get '***' instead
+SECRET = re.compile(r'((?:^|\s)[\w-]*(?:password|secret|pre-shared-key|passphrase|psk)=)("(?:[^"\\]|\\.)*"|\S*)', re.I)
+
+# First line of the output when RouterOS rejects a command
+ROUTEROS_ERRORS = ("failure:", "syntax error", "expected ", "bad command name", "input does not match", "invalid value", "no such item", "ambiguous value")
+
+ACTIONS = ("print", "set", "add", "remove", "get", "enable", "disable", "export", "import", "save", "load", "monitor", "monitor-traffic",
+           "reset-configuration", "check-for-updates", "install", "reboot", "find", "edit", "comment", "move", "unset", "ping", "run")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Event kinds that are all waiting for the device; "method" events split their time into wait and parse
+IO_KINDS = ("connect", "command", "transfer")
+
+# Innermost event being measured, so commands add their wait time and bytes to the method that sent them.
+# A context variable keeps threads and asyncio tasks sharing a device apart
+CURRENT_EVENT = contextvars.ContextVar("routeros_current_event", default=None)
+
+def redact(command):
+    return SECRET.sub(r"\1***", command)
+
+
+def command_name(command):
+    # Low cardinality name for metrics: the menu path and action, without arguments or item names
+    words = []
+
+    for word in command.split():
+        if "=" in word or word[:1] in "\"[{($" or len(words) == 4:
+            break
+
+        words.append(word)
+
+        if word in ACTIONS:
+            break
+
+    return " ".join(words)
+
+
+def command_outcome(output):
+    for line in str(output).splitlines():
+        if line.strip() != "":
+            return "failure" if line.strip().lower().startswith(ROUTEROS_ERRORS) else "ok"
+
+    return "ok"
+
+
+def result_outcome(result):
+    # Legacy methods report errors as False or as an 'ERROR: ...' string instead of raising
+    if result is False or (isinstance(result, str) and result.startswith("ERROR")):
+        return "failure"
+
+    return "ok"
+
+
+def measure(device, kind, name=None, command=None):
+    # Returns a context manager that times one operation and runs the device hooks around it.
+    # Commands are named after their menu path when no name is given
+    if not device.hooks:
+        return NO_MEASURE
+
+    return Measurement(device, kind, name, command)
+
+
+class Measurement:
+    def __init__(self, device, kind, name, command):
+        self.device = device
+        self.event = {
+            "host": (getattr(device, "device", None) or {}).get("host"),
+            "kind": kind,
+            "name": command_name(command) if name is None else name,
+            "command": None if command is None else redact(command),
+            "start": time.time(),
+            "duration": None,
+            "wait": 0.0,
+            "parse": 0.0,
+            "bytes": 0,
+            "commands": 1 if kind == "command" else 0,
+            "outcome": None,
+            "error": None,
+        }
+
+    def __enter__(self):
+        for hook in list(self.device.hooks):
+            before = getattr(hook, "before", None)
+
+            if before is not None:
+                before(self.event)
+
+        self.parent = CURRENT_EVENT.get()
+        self.token = CURRENT_EVENT.set(self.event)
+        self.started = time.perf_counter()
+
+        return self
+
+    def received(self, output):
+        # output: one command output or the list returned for a batch
+        outputs = output if isinstance(output, list) else [output]
+
+        self.event['commands'] = len(outputs)
+        self.event['bytes'] += sum(len(output.encode("utf-8", errors="replace")) for output in outputs if isinstance(output, str))
+        self.event['outcome'] = "failure" if "failure" in (command_outcome(output) for output in outputs if output is not None) else "ok"
+
+    def transferred(self, size):
+        self.event['bytes'] += size
+
+    def returned(self, result):
+        self.event['outcome'] = result_outcome(result)
+
+    def __exit__(self, exc_type, exc, traceback):
+        event = self.event
+        event['duration'] = time.perf_counter() - self.started
+        CURRENT_EVENT.reset(self.token)
+
+        if exc is not None:
+            event['outcome'] = "error"
+            # Error messages may quote the command, so they are redacted like it
+            event['error'] = {"type": type(exc).__name__, "message": redact(str(exc))}
+
+        elif event['outcome'] is None:
+            event['outcome'] = "ok"
+
+        if event['kind'] in IO_KINDS:
+            event['wait'] = event['duration']
+        else:
+            # Anything not spent waiting for the device is parsing and bookkeeping on this side
+            event['parse'] = max(event['duration'] - event['wait'], 0.0)
+
+        if self.parent is not None:
+            self.parent['wait'] += event['wait']
+            self.parent['bytes'] += event['bytes']
+            self.parent['commands'] += event['commands']
+
+        for hook in list(self.device.hooks):
+            after = getattr(hook, "after", hook)
+
+            if callable(after):
+                after(event)
+
+        return False
+
+
+class NoMeasure:
+    # Shared no-op used when the device has no hooks, so instrumentation costs nothing by default
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def received(self, output):
+        pass
+
+    def transferred(self, size):
+        pass
+
+    def returned(self, result):
+        pass
+
+
+NO_MEASURE = NoMeasure()
+
+def instrumented(method):
+    # Reports the method as one event; the commands it sends are reported as nested events
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            if not self.hooks:
+                return await method(self, *args, **kwargs)
+
+            with measure(self, "method", method.__name__) as measurement:
+                result = await method(self, *args, **kwargs)
+                measurement.returned(result)
+
+                return result
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.hooks:
+            return method(self, *args, **kwargs)
+
+        with measure(self, "method", method.__name__) as measurement:
+            result = method(self, *args, **kwargs)
+            measurement.returned(result)
+
+            return result
+
+    return wrapper
+
+
+class PrometheusMetrics:
+    # Metrics registry fed by device hooks. render() returns the Prometheus text exposition format, ready
+    # to be served on /metrics or written for the node_exporter textfile collector
+    def __init__(self, namespace="routeros", buckets=DURATION_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.events = {}
+        self.durations = {}
+        self.waits = {}
+        self.parses = {}
+        self.bytes = {}
+
+    def __call__(self, event):
+        labels = (event['host'] or "", event['kind'], event['name'])
+
+        with self.lock:
+            key = labels + (event['outcome'],)
+            self.events[key] = self.events.get(key, 0) + 1
+
+            histogram = self.durations.get(labels)
+
+            if histogram is None:
+                histogram = self.durations[labels] = [[0] * len(self.buckets), 0.0, 0]
+
+            index = bisect.bisect_left(self.buckets, event['duration'])
+
+            if index < len(self.buckets):
+                histogram[0][index] += 1
+
+            histogram[1] += event['duration']
+            histogram[2] += 1
+
+            self.waits[labels] = self.waits.get(labels, 0.0) + event['wait']
+            self.parses[labels] = self.parses.get(labels, 0.0) + event['parse']
+            self.bytes[labels] = self.bytes.get(labels, 0) + event['bytes']
+
+    def render(self):
+        name = self.namespace
+        lines = []
+
+        with self.lock:
+            lines.append(f"# HELP {name}_events_total Operations sent to RouterOS devices by outcome")
+            lines.append(f"# TYPE {name}_events_total counter")
+
+            for (host, kind, operation, outcome), value in sorted(self.events.items()):
+                lines.append(f"{name}_events_total{{{self.labels(host, kind, operation)},outcome=\"{outcome}\"}} {value}")
+
+            lines.append(f"# HELP {name}_duration_seconds Time spent in each operation")
+            lines.append(f"# TYPE {name}_duration_seconds histogram")
+
+            for labels, (counts, total, count) in sorted(self.durations.items()):
+                cumulative = 0
+
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_duration_seconds_bucket{{{self.labels(*labels)},le=\"{bucket}\"}} {cumulative}")
+
+                lines.append(f"{name}_duration_seconds_bucket{{{self.labels(*labels)},le=\"+Inf\"}} {count}")
+                lines.append(f"{name}_duration_seconds_sum{{{self.labels(*labels)}}} {total}")
+                lines.append(f"{name}_duration_seconds_count{{{self.labels(*labels)}}} {count}")
+
+            for metric, values, help_text in (("wait_seconds_total", self.waits, "Time spent waiting for the device"),
+                                              ("parse_seconds_total", self.parses, "Time spent parsing outputs"),
+                                              ("received_bytes_total", self.bytes, "Bytes of output received")):
+                lines.append(f"# HELP {name}_{metric} {help_text}")
+                lines.append(f"# TYPE {name}_{metric} counter")
+
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}_{metric}{{{self.labels(*labels)}}} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def labels(self, host, kind, operation):
+        escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        return f'host="{escape(host)}",kind="{escape(kind)}",operation="{escape(operation)}"'
+
+
+class OpenTelemetrySpans:
+    # One span per event, nested like the calls that produced them (a method span contains its command spans)
+    def __init__(self, tracer=None):
+        if trace is None:
+            raise ImportError("OpenTelemetrySpans requires opentelemetry-api. Install it with 'pip install opentelemetry-api'")
+
+        self.tracer = tracer or trace.get_tracer("routeros_ssh_connector")
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def before(self, event):
+        span = self.tracer.start_span(f"routeros.{event['kind']} {event['name']}", start_time=int(event['start'] * 1e9))
+        # Current span while the operation runs, so spans of nested events get it as parent
+        token = otel_context.attach(trace.set_span_in_context(span))
+
+        with self.lock:
+            self.spans[id(event)] = (span, token)
+
+    def after(self, event):
+        with self.lock:
+            span, token = self.spans.pop(id(event), (None, None))
+
+        if span is None:
+            return
+
+        otel_context.detach(token)
+
+        attributes = {
+            "routeros.kind": event['kind'],
+            "routeros.operation": event['name'],
+            "routeros.outcome": event['outcome'],
+            "routeros.wait_seconds": event['wait'],
+            "routeros.parse_seconds": event['parse'],
+            "routeros.received_bytes": event['bytes'],
+            "routeros.commands": event['commands'],
+        }
+
+        if event['host'] is not None:
+            attributes['net.peer.name'] = event['host']
+
+        if event['command'] is not None:
+            attributes['routeros.command'] = event['command']
+
+        span.set_attributes(attributes)
+
+        if event['error'] is not None:
+            span.set_status(Status(StatusCode.ERROR, f"{event['error']['type']}: {event['error']['message']}"))
+
+        span.end(end_time=int((event['start'] + event['duration']) * 1e9))
@@ -0,0 +1,287 @@
+import hashlib, ipaddress, json, sqlite3, threading, time
+
+# Properties get_inventory() asks for in each menu. Flags such as 'disabled' only come with as-value output,
+# so these are always read with print_as_value() whatever the output_format of the device
+INVENTORY_FIELDS = {
+    "interfaces": ("name", "default-name", "type", "mtu", "mac-address", "disabled", "running", "comment"),
+    "ip_addresses": ("address", "network", "interface", "disabled", "dynamic", "comment"),
+    "services": ("name", "port", "address", "disabled"),
+    "users": ("name", "group", "address", "disabled", "comment"),
+}
+
+# Properties that identify a record within its menu, so a record that changed is rewritten in place
+RECORD_KEYS = {
+    "interfaces": ("name",),
+    "ip_addresses": ("address", "interface"),
+    "services": ("name",),
+    "users": ("name",),
+}
+
+# Indexed columns accepted as filters by query()
+INDEXED_COLUMNS = ("host", "port", "name", "address", "mac", "interface", "disabled")
+
+INVENTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    identity TEXT,
+    board TEXT,
+    version TEXT,
+    architecture TEXT,
+    resources TEXT,
+    seen REAL,
+    PRIMARY KEY (host, port)
+);
+CREATE INDEX IF NOT EXISTS devices_identity ON devices (identity);
+CREATE TABLE IF NOT EXISTS items (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT,
+    address TEXT,
+    mac TEXT,
+    interface TEXT,
+    disabled INTEGER,
+    data TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (host, port, kind, key)
+);
+CREATE INDEX IF NOT EXISTS items_name ON items (name, kind);
+CREATE INDEX IF NOT EXISTS items_address ON items (address);
+CREATE INDEX IF NOT EXISTS items_mac ON items (mac);
+CREATE INDEX IF NOT EXISTS items_interface ON items (interface);
+"""
+
+class InventoryStore:
+    # Fleet inventory in one SQLite file: a row per device (identity and resources) and a row per interface,
+    # IP address, service and user. Name, address, MAC and interface are indexed columns, so questions such as
+    # "which devices have this IP" are an index lookup instead of a scan of every device.
+    # Refreshes are incremental: each record is stored with a digest and a sweep only writes the records that
+    # were added, changed or removed since the previous one
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        self.connection.executescript(INVENTORY_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Refresh methods
+    def sync(self, device):
+        # Reads the inventory of a connected MikrotikDevice and saves it
+        return self.save(device.device['host'], device.get_inventory(), device.device['port'])
+
+    def update(self, results):
+        # results: MikrotikFleet results of get_inventory(), failed results are skipped and their devices keep
+        # what was stored before. Returns {(host, port): changes}
+        changes = {}
+
+        for result in results:
+            if result.get('ok') and result.get('result') is not None:
+                changes[(result['host'], result['port'])] = self.save(result['host'], result['result'], result['port'])
+
+        return changes
+
+    def save(self, host, inventory, port=22, seen=None):
+        # inventory: dictionary from get_inventory(). Menus missing from it are left as they are.
+        # Returns {menu: {"added": n, "changed": n, "removed": n}}
+        seen = time.time() if seen is None else seen
+        resources = inventory.get('resources')
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO devices (host, port, identity, board, version, architecture, resources, seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (host, port) DO UPDATE SET identity = coalesce(excluded.identity, identity), board = coalesce(excluded.board, board), "
+                "version = coalesce(excluded.version, version), architecture = coalesce(excluded.architecture, architecture), "
+                "resources = coalesce(excluded.resources, resources), seen = excluded.seen",
+                (host, port, inventory.get('identity'),
+                 None if resources is None else resources.get('board-name'),
+                 None if resources is None else resources.get('version'),
+                 None if resources is None else resources.get('architecture-name'),
+                 None if resources is None else json.dumps(resources), seen))
+
+            return {kind: self.refresh(host, port, kind, inventory[kind], seen) for kind in RECORD_KEYS if inventory.get(kind) is not None}
+
+    def save_records(self, host, kind, records, port=22):
+        # Output of a single getter, e.g. save_records(host, "interfaces", device.get_interfaces())
+        if kind not in RECORD_KEYS:
+            raise ValueError(f"Unknown inventory kind '{kind}'. Use one of: {', '.join(RECORD_KEYS)}")
+
+        with self.lock, self.connection:
+            return self.refresh(host, port, kind, records, time.time())
+
+    def refresh(self, host, port, kind, records, seen):
+        stored = dict(self.connection.execute("SELECT key, digest FROM items WHERE host = ? AND port = ? AND kind = ?", (host, port, kind)))
+        rows = {}
+
+        for record in records:
+            key = record_key(kind, record)
+            unique = key
+            number = 1
+
+            # Identical keys are told apart by their order, as in ConfigSnapshot
+            while unique in rows:
+                number += 1
+                unique = f"{key}#{number}"
+
+            data = json.dumps(record, sort_keys=True, default=str)
+            digest = hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+            if stored.get(unique) != digest:
+                rows[unique] = (host, port, kind, unique) + index_columns(kind, record) + (data, digest, seen)
+            else:
+                rows[unique] = None
+
+        removed = [(host, port, kind, key) for key in stored if key not in rows]
+        changed = [row for row in rows.values() if row is not None]
+
+        self.connection.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", changed)
+        self.connection.executemany("DELETE FROM items WHERE host = ? AND port = ? AND kind = ? AND key = ?", removed)
+
+        added = sum(1 for row in changed if row[3] not in stored)
+
+        return {"added": added, "changed": len(changed) - added, "removed": len(removed)}
+
+    def remove_device(self, host, port=22):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM items WHERE host = ? AND port = ?", (host, port))
+            self.connection.execute("DELETE FROM devices WHERE host = ? AND port = ?", (host, port))
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Query methods
+    def find_address(self, address):
+        # Devices with this IP address on an interface, with or without prefix length
+        return self.query("ip_addresses", address=normalize_address(address))
+
+    def find_mac(self, mac):
+        return self.query("interfaces", mac=normalize_mac(mac))
+
+    def find_interface(self, name):
+        return self.query("interfaces", name=name)
+
+    def find_service(self, name, enabled=None):
+        # enabled=True: only devices where the service is enabled
+        return self.query("services", name=name, **({} if enabled is None else {"disabled": not enabled}))
+
+    def find_user(self, username):
+        return self.query("users", name=username)
+
+    def find_identity(self, identity):
+        return self.devices(identity=identity)
+
+    def query(self, kind=None, **filters):
+        # Records of every device matching all filters on the indexed columns, e.g. query("interfaces", name="ether1",
+        # disabled=True). Each record is returned as the getter gave it plus host, port and identity
+        unknown = [column for column in filters if column not in INDEXED_COLUMNS]
+
+        if unknown:
+            raise ValueError(f"Unknown inventory column '{unknown[0]}'. Use one of: {', '.join(INDEXED_COLUMNS)}")
+
+        conditions = [f"items.{column} = ?" for column in filters]
+        values = [int(value) if isinstance(value, bool) else value for value in filters.values()]
+
+        if kind is not None:
+            conditions.append("items.kind = ?")
+            values.append(kind)
+
+        sql = "SELECT items.host, items.port, devices.identity, items.data FROM items LEFT JOIN devices USING (host, port)"
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        with self.lock:
+            rows = self.connection.execute(sql, values).fetchall()
+
+        return [dict(json.loads(data), host=host, port=port, identity=identity) for host, port, identity, data in rows]
+
+    def devices(self, identity=None, seen_before=None):
+        # Stored devices; seen_before: epoch, only devices whose last successful sweep is older (stale devices)
+        conditions, values = [], []
+
+        if identity is not None:
+            conditions.append("identity = ?")
+            values.append(identity)
+
+        if seen_before is not None:
+            conditions.append("seen < ?")
+            values.append(seen_before)
+
+        sql = "SELECT host, port, identity, board, version, architecture, seen FROM devices"
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        with self.lock:
+            rows = self.connection.execute(sql, values).fetchall()
+
+        return [dict(zip(("host", "port", "identity", "board", "version", "architecture", "seen"), row)) for row in rows]
+
+    def get_inventory(self, host, port=22):
+        # What was stored for one device, in the format of MikrotikDevice.get_inventory(); None when unknown
+        with self.lock:
+            device = self.connection.execute("SELECT identity, resources FROM devices WHERE host = ? AND port = ?", (host, port)).fetchone()
+            rows = self.connection.execute("SELECT kind, data FROM items WHERE host = ? AND port = ? ORDER BY rowid", (host, port)).fetchall()
+
+        if device is None:
+            return None
+
+        inventory = {"identity": device[0], "resources": None if device[1] is None else json.loads(device[1])}
+        inventory.update({kind: [] for kind in RECORD_KEYS})
+
+        for kind, data in rows:
+            inventory[kind].append(json.loads(data))
+
+        return inventory
+
+
+def record_key(kind, record):
+    # Text and as-value getters name some properties differently ('username' and 'name')
+    values = [record.get(name, record.get("username") if name == "name" else None) for name in RECORD_KEYS[kind]]
+
+    return " ".join(str(value) for value in values if value is not None)
+
+
+def index_columns(kind, record):
+    # (name, address, mac, interface, disabled) of a record
+    name = record.get("name", record.get("username"))
+    address = normalize_address(record['address']) if kind == "ip_addresses" and record.get("address") else None
+    mac = record.get("mac-address", record.get("mac_address"))
+    disabled = record.get("disabled")
+
+    # Text output of get_interfaces() has a status instead of the flags
+    if disabled is None and "status" in record:
+        disabled = record['status'].startswith("disabled")
+
+    if isinstance(disabled, str):
+        disabled = disabled in ("true", "yes")
+
+    return (name, address, normalize_mac(mac) if mac else None, record.get("interface"), None if disabled is None else int(disabled))
+
+
+def normalize_address(address):
+    address = str(address).split("/")[0]
+
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        return address
+
+
+def normalize_mac(mac):
+    return str(mac).upper().replace("-", ":")
@@ -0,0 +1,256 @@
+import hashlib, os, re, time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from routeros_ssh_connector.connector import MikrotikDevice
+from routeros_ssh_connector.instrumentation import measure
+
+CHUNK_SIZE = 1048576
+
+class BackupPipeline:
+    # Collects backups and exports from many devices in two overlapping stages: while the files of some devices
+    # are downloaded (network bound), the next devices are already generating theirs (router CPU bound).
+    # At most lookahead devices are between connect and the end of their download, which bounds the open sessions
+    # and the files waiting on devices
+    def __init__(self, inventory, local_path, kinds=("backup", "export"), generate_workers=8, download_workers=4, lookahead=16,
+                 backup_options=None, timeout=None, conn_timeout=5, device_options=None, manager=None):
+        # inventory: iterable of dicts with the keys of MikrotikDevice.connect()
+        # backup_options: keyword arguments for save_backup() (name, password, encryption, dont_encrypt)
+        self.inventory = list(inventory)
+        self.local_path = local_path
+        self.kinds = tuple(kinds)
+        self.generate_workers = generate_workers
+        self.download_workers = download_workers
+        self.lookahead = max(lookahead, 1)
+        self.backup_options = backup_options or {}
+        self.timeout = timeout
+        self.conn_timeout = conn_timeout
+        self.device_options = device_options or {}
+        self.manager = manager
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Execution methods
+    def run(self):
+        # Yields one result per device as soon as its files are downloaded, verified and removed from the device
+        generators = ThreadPoolExecutor(max_workers=self.generate_workers)
+        downloaders = ThreadPoolExecutor(max_workers=self.download_workers)
+        hosts = iter(self.inventory)
+        pending = {}
+
+        try:
+            while True:
+                # Devices ahead of the downloads start generating as long as the lookahead allows
+                while len(pending) < self.lookahead:
+                    host = next(hosts, None)
+
+                    if host is None:
+                        break
+
+                    job = self.make_result(host)
+                    pending[generators.submit(self.generate, host, job)] = ("generate", job)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, job = pending.pop(future)
+                    device = future.result()
+
+                    if stage == "generate" and job['ok']:
+                        job['queued'] = time.monotonic()
+                        pending[downloaders.submit(self.download, device, job)] = ("download", job)
+                        continue
+
+                    self.release(device)
+                    job['elapsed'] = time.monotonic() - job['started']
+                    del job['started'], job['queued']
+
+                    yield job
+
+        finally:
+            generators.shutdown(wait=False, cancel_futures=True)
+            downloaders.shutdown(wait=False, cancel_futures=True)
+
+    def run_all(self):
+        return list(self.run())
+
+    def generate(self, host, job):
+        # Connected device with its files created on it, or None when it failed. Never raises
+        device = None
+
+        try:
+            with self.timed(job, "connect"):
+                device = self.connect(host)
+
+            with self.timed(job, "generate"):
+                for kind in self.kinds:
+                    if kind == "backup":
+                        filename = device.save_backup(timeout=self.timeout, **self.backup_options)
+
+                        if filename is None:
+                            raise RuntimeError("Unable to create backup in remote device")
+                    else:
+                        filename = device.save_export(timeout=self.timeout)
+
+                    job['files'].append({"kind": kind, "source": filename})
+
+        except Exception as e:
+            self.fail(job, e)
+            self.discard(device, job)
+
+        return device
+
+    def discard(self, device, job):
+        # Files of a device that failed half way through generation are never downloaded, so they are removed
+        # instead of piling up on it. The error already reported is the one kept
+        if device is None or not job['files']:
+            return
+
+        with self.timed(job, "cleanup"):
+            try:
+                device.run_command("; ".join(f"/file remove {file['source']}" for file in job['files']))
+            except Exception:
+                return
+
+        job['files'] = []
+
+    def download(self, device, job):
+        # Files are written next to their final name, checked and only then renamed and removed from the device,
+        # so a failed file is never taken for a good one and stays on the device for another try
+        job['timings']['wait'] = time.monotonic() - job['queued']
+
+        try:
+            # Devices often share an identity, and with it their file names, so each one gets its own folder
+            folder = os.path.join(self.local_path, re.sub(r"[^\w.-]", "_", job['host'] if job['port'] == 22 else f"{job['host']}_{job['port']}"))
+            os.makedirs(folder, exist_ok=True)
+
+            for file in job['files']:
+                remote_path = "/" + file['source']
+                local_path = os.path.join(folder, file['source'])
+
+                try:
+                    with self.timed(job, "download"):
+                        size, digest = self.fetch(device, remote_path, local_path + ".part")
+
+                    with self.timed(job, "verify"):
+                        self.verify(local_path + ".part", size, digest)
+                        os.replace(local_path + ".part", local_path)
+
+                finally:
+                    if os.path.exists(local_path + ".part"):
+                        os.remove(local_path + ".part")
+
+                file.update(path=local_path, size=size, sha256=digest)
+
+            # All files in one round trip
+            with self.timed(job, "cleanup"):
+                device.run_command("; ".join(f"/file remove {file['source']}" for file in job['files']))
+
+        except Exception as e:
+            self.fail(job, e)
+
+        return device
+
+    def fetch(self, device, remote_path, local_path):
+        # Remote size and sha256 of what was written; raises when the download is short
+        hasher = hashlib.sha256()
+        received = 0
+
+        with device.sftp_lock:
+            sftp = device.get_sftp()
+            size = sftp.stat(remote_path).st_size
+
+            with measure(device, "transfer", "get", remote_path) as measurement:
+                with sftp.open(remote_path, "rb") as source, open(local_path, "wb") as target:
+                    if device.sftp_options['prefetch']:
+                        source.prefetch(size, max_concurrent_requests=device.sftp_options['max_requests'])
+
+                    while True:
+                        chunk = source.read(CHUNK_SIZE)
+
+                        if not chunk:
+                            break
+
+                        target.write(chunk)
+                        hasher.update(chunk)
+                        received += len(chunk)
+
+                    measurement.transferred(received)
+
+        if received != size:
+            raise OSError(f"{remote_path}: received {received} of {size} bytes")
+
+        return size, hasher.hexdigest()
+
+    def verify(self, local_path, size, digest):
+        # Reads the file back, so what is on disk is what came from the device
+        hasher = hashlib.sha256()
+
+        with open(local_path, "rb") as source:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+
+                if not chunk:
+                    break
+
+                hasher.update(chunk)
+
+        if os.path.getsize(local_path) != size or hasher.hexdigest() != digest:
+            raise OSError(f"{local_path}: size or checksum does not match the downloaded data")
+
+    def connect(self, host):
+        if self.manager is not None:
+            return self.manager.get(**host)
+
+        device = MikrotikDevice(**self.device_options)
+        device.connect(**host, conn_timeout=self.conn_timeout, exit_on_error=False)
+
+        return device
+
+    def release(self, device):
+        # Pooled sessions stay open for the next user
+        if device is None or self.manager is not None:
+            return
+
+        try:
+            device.disconnect()
+        except Exception:
+            pass
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Result methods
+    def make_result(self, host):
+        return {
+            "host": host.get('ip_address'),
+            "port": host.get('port', 22),
+            "ok": True,
+            "files": [],
+            "error": None,
+            "timings": {"connect": 0.0, "generate": 0.0, "wait": 0.0, "download": 0.0, "verify": 0.0, "cleanup": 0.0},
+            "elapsed": 0.0,
+            "started": time.monotonic(),
+            "queued": None,
+        }
+
+    def fail(self, job, error):
+        job['ok'] = False
+        job['error'] = {"type": type(error).__name__, "message": str(error)}
+
+    def timed(self, job, stage):
+        return StageTimer(job['timings'], stage)
+
+
+class StageTimer:
+    # Adds the time spent inside the block to timings[stage]
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.timings[self.stage] += time.monotonic() - self.started
+        return False
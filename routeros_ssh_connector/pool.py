@@ -0,0 +1,193 @@
+import hashlib, random, threading, time
+
+from contextlib import contextmanager
+from routeros_ssh_connector.connector import MikrotikDevice
+from routeros_ssh_connector.exceptions import MikrotikConnectionError, MikrotikAuthenticationError
+
+class MikrotikConnectionManager:
+    # Keeps one connected MikrotikDevice per host, port and credentials and hands the same device to every caller,
+    # since devices can be shared between threads. Sessions get SSH keepalives, are checked before being handed
+    # out, are reconnected with exponential backoff when they died and are closed after max_idle seconds unused
+    def __init__(self, backend="netmiko", conn_timeout=5, keepalive=30, max_idle=300, probe_after=60, retries=3, backoff=0.5, max_backoff=30, device_options=None):
+        self.backend = backend
+        self.conn_timeout = conn_timeout
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+
+        # Sessions unused for longer than probe_after seconds run a trivial command before being handed out, which
+        # catches connections silently dropped by a NAT or firewall in between
+        self.probe_after = probe_after
+
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.device_options = device_options or {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.evictions = 0
+        self.failures = 0
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Session methods
+    def get(self, ip_address, username, password, port=22):
+        # Connected device for the host, reusing the pooled session while it is healthy
+        return self.acquire(ip_address, username, password, port)[1]
+
+    @contextmanager
+    def device(self, ip_address, username, password, port=22):
+        # Same as get(), but the session is never evicted while in use and a session that breaks inside the
+        # block is dropped, so the next caller gets a fresh one
+        session, device = self.acquire(ip_address, username, password, port, hold=True)
+
+        try:
+            yield device
+
+        except MikrotikConnectionError:
+            self.discard(device)
+            raise
+
+        finally:
+            with self.lock:
+                session['in_use'] -= 1
+                session['used'] = time.monotonic()
+
+    def acquire(self, ip_address, username, password, port, hold=False):
+        self.evict_idle()
+
+        # The password is part of the key, so a caller with other credentials never gets a session it could not
+        # have opened itself
+        key = (ip_address, port, username, hashlib.sha256(str(password).encode()).hexdigest())
+
+        with self.lock:
+            session = self.sessions.setdefault(key, {"device": None, "lock": threading.Lock(), "used": 0.0, "in_use": 0})
+
+            if hold:
+                session['in_use'] += 1
+
+        try:
+            with session['lock']:
+                device = session['device']
+
+                if device is not None and self.healthy(device, session):
+                    self.reuses += 1
+                else:
+                    if device is not None:
+                        self.reconnects += 1
+                        self.close(device)
+
+                    session['device'] = None
+                    device = session['device'] = self.connect(ip_address, username, password, port)
+
+                session['used'] = time.monotonic()
+
+        except BaseException:
+            if hold:
+                with self.lock:
+                    session['in_use'] -= 1
+
+            raise
+
+        return session, device
+
+    def connect(self, ip_address, username, password, port):
+        # Typed MikrotikConnectionError subclasses are raised once every attempt failed. Authentication errors are
+        # raised right away, retrying them would only risk locking the account
+        for attempt in range(self.retries + 1):
+            device = MikrotikDevice(**self.device_options)
+
+            try:
+                device.connect(ip_address, username, password, port, conn_timeout=self.conn_timeout, exit_on_error=False, backend=self.backend)
+
+                if self.keepalive:
+                    device.transport.set_keepalive(self.keepalive)
+
+                self.connects += 1
+
+                return device
+
+            except MikrotikAuthenticationError:
+                self.failures += 1
+                raise
+
+            except MikrotikConnectionError:
+                self.failures += 1
+
+                if attempt == self.retries:
+                    raise
+
+                # Exponential backoff with jitter, so devices coming back don't get every client at once
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1))
+
+    def healthy(self, device, session):
+        try:
+            if not device.transport.is_alive():
+                return False
+
+            if time.monotonic() - session['used'] > self.probe_after:
+                return "ok" in device.run_command(':put "ok"', timeout=self.conn_timeout)
+
+            return True
+
+        except Exception:
+            return False
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Pool methods
+    def evict_idle(self):
+        # Closes sessions nobody used in max_idle seconds. Runs on every get(), call it from a timer to also close
+        # sessions of hosts that are no longer requested
+        now = time.monotonic()
+        evicted = []
+
+        with self.lock:
+            for key, session in list(self.sessions.items()):
+                if session['in_use'] == 0 and now - session['used'] > self.max_idle and session['lock'].acquire(blocking=False):
+                    try:
+                        if session['device'] is not None:
+                            evicted.append(session['device'])
+
+                        del self.sessions[key]
+                    finally:
+                        session['lock'].release()
+
+        for device in evicted:
+            self.evictions += 1
+            self.close(device)
+
+        return len(evicted)
+
+    def discard(self, device):
+        # Drops a session known to be broken, the next get() reconnects
+        with self.lock:
+            sessions = [session for session in self.sessions.values() if session['device'] is device]
+
+        for session in sessions:
+            with session['lock']:
+                if session['device'] is device:
+                    session['device'] = None
+
+        self.close(device)
+
+    def close(self, device):
+        try:
+            device.disconnect()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+
+        for session in sessions:
+            if session['device'] is not None:
+                self.close(session['device'])
+
+    def stats(self):
+        with self.lock:
+            sessions = len([session for session in self.sessions.values() if session['device'] is not None])
+
+        return {"sessions": sessions, "connects": self.connects, "reuses": self.reuses, "reconnects": self.reconnects, "evictions": self.evictions, "failures": self.failures}
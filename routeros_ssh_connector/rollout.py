@@ -0,0 +1,255 @@
+import os, socket, time, paramiko
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from routeros_ssh_connector.connector import MikrotikDevice
+from routeros_ssh_connector.exceptions import MikrotikConnectionError, MikrotikTimeoutError
+
+class FirmwareRollout:
+    # Upgrades RouterOS across a fleet in waves. Every device is checked and gets its packages staged in parallel
+    # before the first reboot, either downloaded by the device itself or uploaded from local .npk files, so a wave
+    # is only the reboot and the wait for the devices to come back with the new version. All devices of a wave
+    # upgrade at the same time and the rollout stops when more than max_failure_rate of a wave fails, so the
+    # total time depends on the number of waves, not on the number of devices
+    def __init__(self, inventory, channel="long-term", wave_size=10, first_wave=1, max_failure_rate=0.2, packages=None, version=None,
+                 stage_workers=32, reboot_timeout=600, poll_interval=5, timeout=None, conn_timeout=5, device_options=None):
+        # first_wave: canary devices upgraded alone before the regular waves
+        # packages: local .npk paths uploaded to every device, or {architecture-name: [paths]}; version is then
+        # the version they install. Without packages the devices download the latest version of channel
+        self.inventory = list(inventory)
+        self.channel = channel
+        self.wave_size = max(wave_size, 1)
+        self.first_wave = first_wave
+        self.max_failure_rate = max_failure_rate
+        self.packages = packages
+        self.version = version
+        self.stage_workers = stage_workers
+        self.reboot_timeout = reboot_timeout
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.conn_timeout = conn_timeout
+        self.device_options = device_options or {}
+
+        if packages is not None and version is None:
+            raise ValueError("Pass the version the packages install with 'version'")
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Rollout methods
+    def run(self):
+        # Yields one result per device: "up-to-date" and failed stagings first, then the devices of each wave as
+        # they come back. Devices left when the rollout stops are returned as "skipped"
+        staged = {}
+
+        with ThreadPoolExecutor(max_workers=self.stage_workers) as executor:
+            futures = {executor.submit(self.stage, host): position for position, host in enumerate(self.inventory)}
+
+            for future in as_completed(futures):
+                result = future.result()
+
+                if result['status'] == "staged":
+                    staged[futures[future]] = result
+                else:
+                    yield result
+
+        # Inventory order decides the waves
+        staged = [(self.inventory[position], staged[position]) for position in sorted(staged)]
+        stopped = None
+
+        for number, wave in enumerate(self.waves(staged)):
+            if stopped is not None:
+                for host, result in wave:
+                    result['wave'] = number
+                    yield self.finish(result, "skipped", error=stopped)
+
+                continue
+
+            failures = 0
+
+            with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                for future in as_completed([executor.submit(self.upgrade, host, result, number) for host, result in wave]):
+                    result = future.result()
+                    failures += not result['ok']
+
+                    yield result
+
+            if failures / len(wave) > self.max_failure_rate:
+                stopped = RuntimeError(f"Rollout stopped: {failures} of {len(wave)} devices failed in wave {number}")
+
+    def run_all(self):
+        return list(self.run())
+
+    def waves(self, staged):
+        start = 0
+
+        if self.first_wave:
+            yield staged[:self.first_wave]
+            start = self.first_wave
+
+        for position in range(start, len(staged), self.wave_size):
+            yield staged[position:position + self.wave_size]
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Device methods
+    def stage(self, host):
+        result = self.make_result(host)
+        started = time.monotonic()
+        device = None
+
+        try:
+            device = self.connect(host)
+
+            if self.packages is None:
+                update = device.check_for_updates(self.channel, self.timeout)
+                result.update(installed=update['installed'], target=update['latest'])
+
+                if not update['available']:
+                    return self.finish(result, "up-to-date")
+
+                if not device.download_update(self.timeout):
+                    raise RuntimeError(f"Device did not download RouterOS {update['latest']}")
+
+            else:
+                result.update(installed=device.get_installed_version(), target=self.version)
+
+                if not device.newer_version(self.version, result['installed']):
+                    return self.finish(result, "up-to-date")
+
+                for path in self.device_packages(device):
+                    if not device.upload_file(os.path.dirname(path) or ".", os.path.basename(path)):
+                        raise RuntimeError(f"Unable to upload {os.path.basename(path)}")
+
+            result['status'] = "staged"
+
+            return result
+
+        except Exception as e:
+            return self.finish(result, "failed", error=e)
+
+        finally:
+            result['timings']['stage'] = time.monotonic() - started
+            self.release(device)
+
+    def device_packages(self, device):
+        if not isinstance(self.packages, dict):
+            return self.packages
+
+        architecture = device.get_resources().get("architecture-name", "").strip()
+
+        if architecture not in self.packages:
+            raise RuntimeError(f"No packages for architecture '{architecture}'")
+
+        return self.packages[architecture]
+
+    def upgrade(self, host, result, wave):
+        result['wave'] = wave
+        started = time.monotonic()
+        device = None
+
+        try:
+            device = self.connect(host)
+
+            if self.packages is None:
+                # The device drops the session while it installs and reboots, so the command may never complete
+                try:
+                    device.run_command("/system package update install", timeout=self.conn_timeout)
+                except (MikrotikConnectionError, OSError, EOFError, paramiko.SSHException):
+                    pass
+
+            # A device that never got the reboot script fails now instead of after reboot_timeout
+            elif not device.reboot_device():
+                raise RuntimeError("Unable to upload the reboot script")
+
+            self.release(device)
+            device = None
+            result['timings']['reboot'] = time.monotonic() - started
+
+            version = self.wait_until_back(host, result['target'])
+            result['timings']['wait'] = time.monotonic() - started - result['timings']['reboot']
+            result['version'] = version
+
+            if version is None:
+                return self.finish(result, "failed", error=MikrotikTimeoutError(f"Device did not come back with RouterOS {result['target']} in {self.reboot_timeout} seconds"))
+
+            return self.finish(result, "upgraded")
+
+        except Exception as e:
+            return self.finish(result, "failed", error=e)
+
+        finally:
+            self.release(device)
+
+    def wait_until_back(self, host, target):
+        # Installed version once the device runs target, None after reboot_timeout. Logging in is only tried once
+        # the SSH port accepts connections, and a device still running the old version is polled again, as it
+        # may not have gone down yet
+        deadline = time.monotonic() + self.reboot_timeout
+
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+
+            if not self.reachable(host):
+                continue
+
+            device = None
+
+            try:
+                device = self.connect(host)
+                installed = device.get_installed_version()
+
+                if not device.newer_version(target, installed):
+                    return installed
+
+            except Exception:
+                pass
+
+            finally:
+                self.release(device)
+
+        return None
+
+    def reachable(self, host):
+        try:
+            socket.create_connection((host['ip_address'], host.get('port', 22)), timeout=self.conn_timeout).close()
+            return True
+
+        except OSError:
+            return False
+
+    def connect(self, host):
+        device = MikrotikDevice(**self.device_options)
+        device.connect(**host, conn_timeout=self.conn_timeout, exit_on_error=False)
+
+        return device
+
+    def release(self, device):
+        if device is None:
+            return
+
+        try:
+            device.disconnect()
+        except Exception:
+            pass
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Result methods
+    def make_result(self, host):
+        return {
+            "host": host.get('ip_address'),
+            "port": host.get('port', 22),
+            "status": None,
+            "ok": True,
+            "installed": None,
+            "target": None,
+            "version": None,
+            "wave": None,
+            "error": None,
+            "timings": {"stage": 0.0, "reboot": 0.0, "wait": 0.0},
+        }
+
+    def finish(self, result, status, error=None):
+        result['status'] = status
+        result['ok'] = error is None
+
+        if error is not None:
+            result['error'] = {"type": type(error).__name__, "message": str(error)}
+
+        return result
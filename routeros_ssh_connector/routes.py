@@ -0,0 +1,245 @@
+import ipaddress, re, sys
+
+# Routes are kept as small slotted records with the destination packed as (version, integer network, prefix
+# length). Flags, gateways and distances repeat across the table and are interned, so a full table costs a
+# fraction of the per-route dictionaries get_routes() used to return
+
+# 'key=value' or 'key="quoted value"' pair of a terse line
+TERSE_PAIR = re.compile(r'(?<!\S)([a-zA-Z][\w.-]*)=("(?:[^"\\]|\\.)*"|\S*)')
+
+class Route:
+    __slots__ = ("flags", "version", "network", "prefixlen", "gateway", "distance")
+
+    def __init__(self, flags, destination, gateway, distance):
+        self.flags = sys.intern(flags)
+        self.gateway = sys.intern(gateway)
+        self.distance = sys.intern(str(distance))
+        self.version, self.network, self.prefixlen = pack_prefix(destination)
+
+    @property
+    def destination(self):
+        return unpack_prefix(self.version, self.network, self.prefixlen)
+
+    @property
+    def active(self):
+        return "A" in self.flags
+
+    @property
+    def disabled(self):
+        return "X" in self.flags
+
+    def as_dict(self):
+        return {"flags": self.flags, "destination": self.destination, "gateway": self.gateway, "distance": self.distance}
+
+    def rank(self):
+        # Among routes to the same prefix the active one wins, then the lowest distance
+        return (not self.active, int(self.distance) if self.distance.isdigit() else 256)
+
+
+def route_from_record(record):
+    # Terse records from parse_terse_line() or dictionaries with the get_routes() keys
+    return Route(record.get('flags', ""), record.get('destination', record.get('dst-address', "")), record.get('gateway', ""), record.get('distance', ""))
+
+
+def route_from_line(line):
+    # Route of a '/ip route print detail terse' line, or None for anything else. Only the three properties a
+    # Route keeps are looked up, with plain string searches unless the line has quoted values (comments)
+    # that could contain ' gateway=' themselves
+    line = line.strip()
+    equals = line.find("=")
+
+    if equals == -1:
+        return None
+
+    head = line[:line.rfind(" ", 0, equals)].split(None, 1)
+
+    if not head or not head[0].isdigit():
+        return None
+
+    flags = head[1].strip() if len(head) > 1 else ""
+
+    if '"' not in line:
+        return Route(flags, line_value(line, " dst-address="), line_value(line, " gateway="), line_value(line, " distance="))
+
+    properties = {key: value[1:-1].replace('\\"', '"').replace('\\\\', '\\') if value.startswith('"') else value
+                  for key, value in TERSE_PAIR.findall(line)}
+
+    return Route(flags, properties.get('dst-address', ""), properties.get('gateway', ""), properties.get('distance', ""))
+
+
+def line_value(line, key):
+    start = line.find(key)
+
+    if start == -1:
+        return ""
+
+    start += len(key)
+    end = line.find(" ", start)
+
+    return line[start:] if end == -1 else line[start:end]
+
+
+def pack_prefix(destination):
+    if destination == "":
+        return 0, None, 0
+
+    address, _, prefixlen = destination.partition("/")
+    octets = address.split(".")
+
+    if len(octets) == 4 and address.replace(".", "").isdigit():
+        network = (int(octets[0]) << 24) | (int(octets[1]) << 16) | (int(octets[2]) << 8) | int(octets[3])
+
+        return 4, network, int(prefixlen) if prefixlen else 32
+
+    network = ipaddress.ip_network(destination, strict=False)
+
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def unpack_prefix(version, network, prefixlen):
+    if network is None:
+        return ""
+
+    if version == 4:
+        return f"{network >> 24}.{(network >> 16) & 255}.{(network >> 8) & 255}.{network & 255}/{prefixlen}"
+
+    return f"{ipaddress.IPv6Address(network)}/{prefixlen}"
+
+
+def pack_address(address):
+    if isinstance(address, int):
+        return 4 if address < 2 ** 32 else 6, address
+
+    if isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return address.version, int(address)
+
+    octets = address.split(".")
+
+    if len(octets) == 4:
+        try:
+            return 4, (int(octets[0]) << 24) | (int(octets[1]) << 16) | (int(octets[2]) << 8) | int(octets[3])
+        except ValueError:
+            pass
+
+    address = ipaddress.ip_address(address)
+
+    return address.version, int(address)
+
+
+class RouteTable:
+    # Read-only route table. Iterating, indexing and len() behave like the list of dictionaries
+    # get_routes() returned before, lookup() does longest prefix matching and diff() compares two snapshots.
+    # routes: Route objects, terse lines or records
+    def __init__(self, routes=()):
+        self.routes = []
+
+        for route in routes:
+            if isinstance(route, str):
+                route = route_from_line(route)
+
+                if route is None:
+                    continue
+
+            elif not isinstance(route, Route):
+                route = route_from_record(route)
+
+            self.routes.append(route)
+
+        self.index = None
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __iter__(self):
+        for route in self.routes:
+            yield route.as_dict()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [route.as_dict() for route in self.routes[index]]
+
+        return self.routes[index].as_dict()
+
+    def __eq__(self, other):
+        if isinstance(other, RouteTable):
+            other = list(other)
+
+        return list(self) == other
+
+    def __repr__(self):
+        return f"<RouteTable: {len(self.routes)} routes>"
+
+    def __deepcopy__(self, memo):
+        # Never modified after creation, cached results can share it
+        return self
+
+    def build_index(self):
+        # One hash table per (version, prefix length) holding the winning route of each prefix. A lookup
+        # probes the prefix lengths present in the table from longest to shortest, at most 33 (129) probes
+        # and usually a handful, which beats walking a bitwise trie node by node in Python
+        tables = {}
+
+        for route in self.routes:
+            if route.network is None or route.disabled:
+                continue
+
+            table = tables.setdefault((route.version, route.prefixlen), {})
+            current = table.get(route.network)
+
+            if current is None or route.rank() < current.rank():
+                table[route.network] = route
+
+        self.index = {4: [], 6: []}
+
+        for (version, prefixlen), table in sorted(tables.items(), key=lambda item: -item[0][1]):
+            bits = 32 if version == 4 else 128
+            mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+            self.index[version].append((mask, table))
+
+        return self.index
+
+    def lookup(self, address):
+        # Route that wins for address (string, integer or ipaddress object) or None
+        route = self.lookup_route(address)
+
+        return None if route is None else route.as_dict()
+
+    def lookup_route(self, address):
+        index = self.index or self.build_index()
+        version, address = pack_address(address)
+
+        for mask, table in index[version]:
+            route = table.get(address & mask)
+
+            if route is not None:
+                return route
+
+        return None
+
+    def diff(self, other):
+        # Changes from this snapshot to other. Routes are matched by destination and gateway; a match whose
+        # flags or distance differ is reported as changed
+        old = self.keyed()
+        new = other.keyed()
+        changes = {"added": [], "removed": [], "changed": []}
+
+        for key, route in new.items():
+            if key not in old:
+                changes['added'].append(route.as_dict())
+
+            elif (old[key].flags, old[key].distance) != (route.flags, route.distance):
+                changes['changed'].append({"old": old[key].as_dict(), "new": route.as_dict()})
+
+        for key, route in old.items():
+            if key not in new:
+                changes['removed'].append(route.as_dict())
+
+        return changes
+
+    def keyed(self):
+        keyed = {}
+
+        for route in self.routes:
+            keyed.setdefault((route.version, route.network, route.prefixlen, route.gateway), route)
+
+        return keyed
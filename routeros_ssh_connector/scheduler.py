@@ -0,0 +1,219 @@
+import itertools, time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from routeros_ssh_connector.pool import MikrotikConnectionManager
+from routeros_ssh_connector.exceptions import MikrotikTimeoutError
+from routeros_ssh_connector.telemetry import convert_quantity
+
+class MikrotikScheduler:
+    # Runs queued jobs across a fleet without overloading any device. Before a heavy job starts, the device load
+    # is read with get_resources(): a device above max_cpu_load or below min_free_memory gets no new heavy job
+    # until it cools down, and each device runs at most device_slots heavy jobs at once. Among the jobs that can
+    # start, higher priority goes first, then the least loaded device. rate limits job starts across the fleet
+    def __init__(self, max_workers=32, max_cpu_load=60, min_free_memory=0.1, device_slots=1, rate=None, burst=1,
+                 load_ttl=15, recheck=30, max_wait=3600, manager=None, conn_timeout=5):
+        # device_slots: heavy jobs per device, or a callable that gets the get_resources() dictionary and returns
+        # them, e.g. lambda resources: 2 if resources['board-name'].startswith("CCR") else 1
+        # min_free_memory: fraction of the total memory that must be free
+        self.max_workers = max_workers
+        self.max_cpu_load = max_cpu_load
+        self.min_free_memory = min_free_memory
+        self.device_slots = device_slots
+        self.rate = rate
+        self.burst = burst
+        self.load_ttl = load_ttl
+        self.recheck = recheck
+        self.max_wait = max_wait
+        self.manager = manager or MikrotikConnectionManager(conn_timeout=conn_timeout)
+        self.owns_manager = manager is None
+        self.poll_interval = 0.5
+        self.jobs = []
+        self.loads = {}
+        self.sequence = itertools.count()
+        self.tokens = burst
+        self.refilled = time.monotonic()
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Queue methods
+    def submit(self, host, method, *args, priority=0, heavy=True, **kwargs):
+        # host: dict with the keys of MikrotikDevice.connect(); method: name of a MikrotikDevice method or a
+        # callable that gets the connected device. Light jobs (heavy=False) skip the load checks and slots
+        job = {
+            "id": next(self.sequence),
+            "host": host,
+            "method": method,
+            "args": args,
+            "kwargs": kwargs,
+            "priority": priority,
+            "heavy": heavy,
+            "submitted": time.monotonic(),
+            "deferrals": 0,
+        }
+
+        self.jobs.append(job)
+
+        return job['id']
+
+    def submit_all(self, inventory, method, *args, priority=0, heavy=True, **kwargs):
+        return [self.submit(host, method, *args, priority=priority, heavy=heavy, **kwargs) for host in inventory]
+
+    def run(self):
+        # Yields one result per job as soon as it finishes, in the format of MikrotikFleet.run() plus the job id,
+        # priority and how many times it was put back because its device was busy
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        running = {}
+        busy = {}
+
+        try:
+            while self.jobs or running:
+                now = time.monotonic()
+
+                for job in self.queue():
+                    if len(running) >= self.max_workers:
+                        break
+
+                    if not self.can_start(job, now, busy):
+                        continue
+
+                    if not self.take_token(now):
+                        break
+
+                    self.jobs.remove(job)
+                    key = self.host_key(job['host'])
+
+                    if job['heavy']:
+                        busy[key] = busy.get(key, 0) + 1
+
+                    running[executor.submit(self.run_job, job)] = job
+
+                for job in [job for job in self.jobs if now - job['submitted'] > self.max_wait]:
+                    self.jobs.remove(job)
+
+                    yield self.make_result(job, error=MikrotikTimeoutError(f"Device stayed busy for {self.max_wait} seconds"))
+
+                if not running:
+                    time.sleep(self.poll_interval)
+                    continue
+
+                done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    job = running.pop(future)
+                    key = self.host_key(job['host'])
+
+                    if job['heavy']:
+                        busy[key] -= 1
+
+                    deferred, result, error = future.result()
+
+                    if deferred:
+                        job['deferrals'] += 1
+                        self.jobs.append(job)
+                        continue
+
+                    yield self.make_result(job, result=result, error=error)
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+            if self.owns_manager:
+                self.manager.close_all()
+
+    def run_all(self):
+        return list(self.run())
+
+    def queue(self):
+        # Waiting jobs, best first: priority, then the least loaded device (devices never measured count as idle),
+        # then submission order
+        return sorted(self.jobs, key=lambda job: (-job['priority'], self.loads.get(self.host_key(job['host']), {}).get("cpu", 0), job['id']))
+
+    def can_start(self, job, now, busy):
+        if not job['heavy']:
+            return True
+
+        key = self.host_key(job['host'])
+        load = self.loads.get(key)
+
+        # Until a device is measured it gets one heavy job at a time
+        if load is None:
+            return busy.get(key, 0) < 1
+
+        return busy.get(key, 0) < load['slots'] and load.get("retry", 0) <= now
+
+    def take_token(self, now):
+        # Token bucket: rate job starts per second across the fleet, up to burst at once
+        if self.rate is None:
+            return True
+
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+
+        return True
+
+
+# >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Execution methods
+    def run_job(self, job):
+        # (deferred, result, error); never raises
+        try:
+            with self.manager.device(**job['host']) as device:
+                if job['heavy'] and not self.has_capacity(device, job['host']):
+                    return True, None, None
+
+                if callable(job['method']):
+                    return False, job['method'](device, *job['args'], **job['kwargs']), None
+
+                return False, getattr(device, job['method'])(*job['args'], **job['kwargs']), None
+
+        except Exception as e:
+            return False, None, e
+
+    def has_capacity(self, device, host):
+        key = self.host_key(host)
+        load = self.loads.get(key)
+
+        # A device that was busy is always measured again before it gets a job
+        if load is None or "retry" in load or time.monotonic() - load['time'] > self.load_ttl:
+            load = self.loads[key] = self.read_load(device)
+
+        if (load['cpu'] is not None and load['cpu'] > self.max_cpu_load) or (load['free'] is not None and load['free'] < self.min_free_memory):
+            load['retry'] = time.monotonic() + self.recheck
+            return False
+
+        return True
+
+    def read_load(self, device):
+        resources = device.get_resources()
+        quantity = lambda name: convert_quantity(resources.get(name, "").replace(" ", ""))
+
+        cpu = quantity("cpu-load")
+        free, total = quantity("free-memory"), quantity("total-memory")
+        slots = self.device_slots(resources) if callable(self.device_slots) else self.device_slots
+
+        return {
+            "time": time.monotonic(),
+            "cpu": cpu if isinstance(cpu, (int, float)) else None,
+            "free": free / total if isinstance(free, (int, float)) and isinstance(total, (int, float)) and total else None,
+            "board": resources.get("board-name"),
+            "slots": max(1, slots),
+        }
+
+    def host_key(self, host):
+        return host.get('ip_address'), host.get('port', 22)
+
+    def make_result(self, job, result=None, error=None):
+        return {
+            "job": job['id'],
+            "host": job['host'].get('ip_address'),
+            "port": job['host'].get('port', 22),
+            "priority": job['priority'],
+            "ok": error is None,
+            "result": result,
+            "error": None if error is None else {"type": type(error).__name__, "message": str(error)},
+            "deferrals": job['deferrals'],
+            "elapsed": time.monotonic() - job['submitted'],
+        }
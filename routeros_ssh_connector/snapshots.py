@@ -0,0 +1,274 @@
+import gzip, json, re
+
+# '/menu path add|set [selector] key=value ...', one command per line as printed by '/export terse'
+COMMAND = re.compile(r'(/\S*(?: [\w-]+)*?) (add|set)(?: (.*))?$')
+
+PROPERTY = re.compile(r'(?<!\S)([a-zA-Z][\w.-]*)=("(?:[^"\\]|\\.)*"|\S*)')
+
+# Properties that identify an added item within its menu, so editing any other property is reported as a change
+# of that item. Menus without a rule use 'name' when present and otherwise the whole command, as happens with
+# ordered lists such as firewall rules, where an edit shows up as one rule removed and one added
+KEYS = {
+    "/ip address": ("address", "interface"),
+    "/ipv6 address": ("address", "interface"),
+    "/ip route": ("dst-address", "gateway", "routing-table", "routing-mark"),
+    "/ipv6 route": ("dst-address", "gateway", "routing-table"),
+    "/ip firewall address-list": ("list", "address"),
+    "/ipv6 firewall address-list": ("list", "address"),
+    "/ip dhcp-server network": ("address",),
+    "/ip dhcp-server lease": ("mac-address",),
+    "/ip dns static": ("name", "type", "address", "cname"),
+    "/interface bridge port": ("bridge", "interface"),
+    "/interface bridge vlan": ("bridge", "vlan-ids"),
+    "/interface list member": ("list", "interface"),
+}
+
+class ConfigSnapshot:
+    # Configuration parsed from a terse export into {menu path: {item key: item}}. Items are
+    # {"action": "add"|"set", "selector": ..., "properties": {name: raw value}}; values keep the quoting of the
+    # export so they can be sent back as they are. Menus and items keep the order of the export
+    def __init__(self, sections=None, header=None):
+        self.sections = sections or {}
+        self.header = header
+
+    @classmethod
+    def from_export(cls, export):
+        # export: the text of '/export terse' or an iterable of its lines, e.g. stream_export()
+        snapshot = cls()
+
+        for line in export.splitlines() if isinstance(export, str) else export:
+            line = line.strip()
+
+            if line.startswith("#"):
+                if snapshot.header is None and " by RouterOS " in line:
+                    snapshot.header = line.lstrip("# ")
+
+                continue
+
+            command = COMMAND.match(line)
+
+            if command is not None:
+                snapshot.add(command.group(1), command.group(2), command.group(3) or "")
+
+        return snapshot
+
+    def add(self, path, action, arguments):
+        selector = ""
+
+        if action == "set":
+            selector, arguments = split_selector(arguments)
+
+        properties = dict(PROPERTY.findall(arguments))
+        section = self.sections.setdefault(path, {})
+        key = selector if action == "set" else item_key(path, properties)
+        unique = key
+        number = 1
+
+        # Identical items (or identical key properties) are told apart by their order
+        while unique in section:
+            number += 1
+            unique = f"{key}#{number}"
+
+        section[unique] = {"action": action, "selector": selector, "properties": properties}
+
+    def __len__(self):
+        return sum(len(section) for section in self.sections.values())
+
+    def __iter__(self):
+        for path, section in self.sections.items():
+            for key, item in section.items():
+                yield path, key, item
+
+    def __eq__(self, other):
+        return isinstance(other, ConfigSnapshot) and self.sections == other.sections
+
+    def __repr__(self):
+        return f"<ConfigSnapshot: {len(self.sections)} sections, {len(self)} items>"
+
+    def diff(self, other):
+        # Changes from this snapshot to other. One pass over both snapshots with dictionary lookups, and
+        # sections that did not change at all are skipped with a single comparison. 'sections' lists the menus
+        # with changes in the order of the new export. Removed and changed items carry the selector that finds
+        # them on a device configured like this snapshot, None when no selector finds only that item
+        changes = {"added": [], "removed": [], "changed": [], "sections": []}
+        indexes = {}
+
+        for path, section in self.sections.items():
+            new_section = other.sections.get(path, {})
+
+            if section == new_section:
+                continue
+
+            indexes[path] = index = selector_index(section)
+
+            for key, item in section.items():
+                if key not in new_section:
+                    changes['removed'].append({"path": path, "key": key, "item": item, "selector": find_item(path, item, index)})
+
+        for path, new_section in other.sections.items():
+            section = self.sections.get(path, {})
+
+            if section == new_section:
+                continue
+
+            changes['sections'].append(path)
+
+            for key, item in new_section.items():
+                old = section.get(key)
+
+                if old is None:
+                    changes['added'].append({"path": path, "key": key, "item": item})
+
+                elif old != item:
+                    properties = {name: (old['properties'].get(name), item['properties'].get(name))
+                                  for name in old['properties'].keys() | item['properties'].keys()
+                                  if old['properties'].get(name) != item['properties'].get(name)}
+
+                    changes['changed'].append({"path": path, "key": key, "old": old, "new": item, "properties": properties,
+                                               "selector": find_item(path, old, indexes[path])})
+
+        return changes
+
+    def save(self, path):
+        # JSON, gzip compressed when path ends with .gz
+        data = json.dumps({"header": self.header, "sections": self.sections})
+
+        with (gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")) as target:
+            target.write(data)
+
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as source:
+            data = json.load(source)
+
+        return cls(data['sections'], data['header'])
+
+
+def split_selector(arguments):
+    # 'set' takes the item before the properties: '[ find default-name=ether1 ]', a name or number, or nothing
+    if arguments.startswith("["):
+        depth = 0
+
+        for position, character in enumerate(arguments):
+            depth += {"[": 1, "]": -1}.get(character, 0)
+
+            if depth == 0:
+                return arguments[:position + 1], arguments[position + 1:].lstrip()
+
+    first, _, rest = arguments.partition(" ")
+
+    if first != "" and "=" not in first:
+        return first, rest
+
+    return "", arguments
+
+
+def item_key(path, properties):
+    names = KEYS.get(path) or (("name",) if "name" in properties else None)
+
+    if names is not None:
+        key = " ".join(f"{name}={properties[name]}" for name in names if name in properties)
+
+        if key != "":
+            return key
+
+    return " ".join(f"{name}={value}" for name, value in properties.items())
+
+
+def find_item(path, item, index=None):
+    # Selector that finds an item on the device, or None when there isn't one that finds only this item: it has
+    # no properties, or another item of index (see selector_index()) has the same values, e.g. duplicate rules
+    if item['action'] == "set":
+        return item['selector']
+
+    names = KEYS.get(path) or (("name",) if "name" in item['properties'] else item['properties'].keys())
+    conditions = [(name, item['properties'][name]) for name in names if name in item['properties']]
+
+    if not conditions:
+        return None
+
+    if index is not None and len(set.intersection(*sorted((index[condition] for condition in conditions), key=len))) > 1:
+        return None
+
+    return f"[ find where {' and '.join(f'{name}={value}' for name, value in conditions)} ]"
+
+
+def selector_index(section):
+    # {(property, value): keys of the added items that have it} of one section
+    index = {}
+
+    for key, item in section.items():
+        if item['action'] == "add":
+            for condition in item['properties'].items():
+                index.setdefault(condition, set()).add(key)
+
+    return index
+
+
+def reconcile(changes):
+    # RouterOS commands that turn a device configured like the old snapshot into the new one: removals first
+    # (last section first), then changes and additions in export order. Properties dropped from added items are
+    # unset, so the item keeps its place in ordered menus. Settings that are no longer exported can't be
+    # removed, and items that no selector finds on their own are never touched: both are returned as comments
+    # to be applied by hand
+    commands = []
+
+    for change in reversed(changes['removed']):
+        path, item = change['path'], change['item']
+        selector = change['selector'] if "selector" in change else find_item(path, item)
+
+        if selector is None:
+            commands.append(f"# {join(path, 'add', arguments(item['properties']))}: no selector finds only this item, remove it by hand")
+            continue
+
+        if item['action'] == "add":
+            commands.append(f"{path} remove {selector}")
+            continue
+
+        for name in item['properties']:
+            commands.append(f"# {join(path, selector)}: '{name}' is no longer exported, set it back to its default by hand")
+
+    order = {path: position for position, path in enumerate(changes['sections'])}
+
+    for change in sorted(changes['changed'] + changes['added'], key=lambda change: order[change['path']]):
+        path = change['path']
+        item = change['new'] if "new" in change else change['item']
+
+        if "new" not in change:
+            if item['action'] == "add":
+                commands.append(join(path, "add", arguments(item['properties'])))
+            else:
+                commands.append(join(path, "set", item['selector'], arguments(item['properties'])))
+
+            continue
+
+        selector = change['selector'] if "selector" in change else find_item(path, change['old'])
+
+        if selector is None:
+            commands.append(f"# {join(path, 'add', arguments(change['old']['properties']))}: no selector finds only this item, "
+                            f"change it to '{arguments(item['properties'])}' by hand")
+            continue
+
+        dropped = [name for name, (old, new) in change['properties'].items() if new is None]
+        updated = {name: new for name, (old, new) in change['properties'].items() if new is not None}
+
+        if updated:
+            commands.append(join(path, "set", selector, arguments(updated)))
+
+        for name in dropped:
+            if item['action'] == "add":
+                commands.append(f"{path} unset {selector} value-name={name}")
+            else:
+                commands.append(f"# {join(path, selector)}: '{name}' is no longer exported, set it back to its default by hand")
+
+    return commands
+
+
+def arguments(properties):
+    return " ".join(f"{name}={value}" for name, value in properties.items())
+
+
+def join(*words):
+    return " ".join(word for word in words if word != "")
@@ -0,0 +1,194 @@
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Interface counters, in the order of the columns of InterfaceStats.counters and InterfaceRates.rates
+COUNTERS = ("rx-byte", "tx-byte", "rx-packet", "tx-packet", "rx-error", "tx-error", "rx-drop", "tx-drop")
+
+# '1w2d03:04:05' as printed by ':put', or '1w2d3h4m5s' as printed by '/system resource print'
+DURATION = re.compile(r'(?:(\d+)w)?(?:(\d+)d)?(?:(\d+):(\d+):(\d+)|(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?)$')
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError("Interface statistics require numpy. Install it with 'pip install numpy'")
+
+
+def parse_duration(value):
+    # Seconds, or None when value is not a RouterOS duration
+    duration = DURATION.match(str(value).strip())
+
+    if duration is None or not any(duration.groups()):
+        return None
+
+    weeks, days, hours, minutes, seconds, h, m, s = (int(part or 0) for part in duration.groups())
+
+    return weeks * 604800 + days * 86400 + (hours + h) * 3600 + (minutes + m) * 60 + seconds + s
+
+
+class InterfaceStats:
+    # Counters of the interfaces of one device at one moment. Row i of the counters matrix (uint64, one column per
+    # entry of COUNTERS) belongs to names[i]; time is when they were read and uptime the device uptime in seconds
+    def __init__(self, host, names, counters, time, uptime=None):
+        require_numpy()
+
+        self.host = host
+        self.names = numpy.asarray(names, dtype=str)
+        self.counters = numpy.asarray(counters, dtype=numpy.uint64).reshape(len(self.names), len(COUNTERS))
+        self.time = time
+        self.uptime = uptime
+
+    @classmethod
+    def from_records(cls, host, records, time, uptime=None):
+        # records: dictionaries from print_as_value() with 'name' and the COUNTERS properties
+        names = [record['name'] for record in records]
+        counters = [[int(record.get(counter, 0)) for counter in COUNTERS] for record in records]
+
+        return cls(host, names, counters, time, uptime)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return f"<InterfaceStats: {self.host}, {len(self.names)} interfaces>"
+
+    def column(self, counter):
+        return self.counters[:, COUNTERS.index(counter)]
+
+    def as_dicts(self):
+        return [dict(zip(("name",) + COUNTERS, [name] + row)) for name, row in zip(self.names.tolist(), self.counters.tolist())]
+
+
+class InterfaceRates:
+    # Per second rates of every interface found in two consecutive samples: bytes, packets, errors and drops per
+    # second, one float64 column per entry of COUNTERS. 'resets' marks rows whose counters restarted (reboot or
+    # reset-counters), their rate covers the counters since the restart
+    def __init__(self, hosts, names, rates, elapsed, resets):
+        self.hosts = hosts
+        self.names = names
+        self.rates = rates
+        self.elapsed = elapsed
+        self.resets = resets
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return f"<InterfaceRates: {len(numpy.unique(self.hosts))} devices, {len(self.names)} interfaces>"
+
+    def column(self, counter):
+        return self.rates[:, COUNTERS.index(counter)]
+
+    def as_dicts(self):
+        return [dict(zip(("host", "name") + COUNTERS, [host, name] + row))
+                for host, name, row in zip(self.hosts.tolist(), self.names.tolist(), self.rates.tolist())]
+
+    def top(self, counter="rx-byte", n=10):
+        # The n busiest interfaces for counter, busiest first. argpartition picks them without sorting every row
+        values = numpy.nan_to_num(self.column(counter), nan=-numpy.inf)
+        n = min(n, len(values))
+
+        if n == 0:
+            return []
+
+        rows = numpy.argpartition(-values, n - 1)[:n]
+        rows = rows[numpy.argsort(-values[rows], kind="stable")]
+
+        return [{"host": host, "name": name, counter: rate}
+                for host, name, rate in zip(self.hosts[rows].tolist(), self.names[rows].tolist(), self.column(counter)[rows].tolist())]
+
+    def percentiles(self, counter="rx-byte", q=(50, 90, 95, 99)):
+        values = self.column(counter)
+
+        if not numpy.any(~numpy.isnan(values)):
+            return {percentile: None for percentile in q}
+
+        return dict(zip(q, numpy.nanpercentile(values, q).tolist()))
+
+    def totals(self, counter="rx-byte"):
+        # {host: sum of the rates of its interfaces}
+        hosts, rows = numpy.unique(self.hosts, return_inverse=True)
+        sums = numpy.bincount(rows, weights=numpy.nan_to_num(self.column(counter)), minlength=len(hosts))
+
+        return dict(zip(hosts.tolist(), sums.tolist()))
+
+
+class InterfaceRateAggregator:
+    # Rates across a fleet between consecutive rounds of get_interface_stats(). Each round the samples of every
+    # device are stacked into one matrix, so matching interfaces, deltas, wraps, resets and summaries are a few
+    # whole-array operations whatever the number of devices and interfaces.
+    # counter_bits: 64 for RouterOS counters; with 32 a counter that went down without a reboot has wrapped
+    def __init__(self, counter_bits=64):
+        require_numpy()
+
+        self.counter_bits = counter_bits
+        self.samples = {}
+
+    def update(self, samples):
+        # samples: InterfaceStats or MikrotikFleet results holding them, failed results are skipped. Devices
+        # missing from a round keep their last sample. Returns InterfaceRates, None on the first round
+        current = {}
+
+        for sample in samples:
+            if isinstance(sample, dict):
+                sample = sample['result'] if sample.get('ok') else None
+
+            if isinstance(sample, InterfaceStats):
+                current[sample.host] = sample
+
+        previous = [self.samples[host] for host in current if host in self.samples]
+        self.samples.update(current)
+
+        if not previous:
+            return None
+
+        return self.rates(stack(previous), stack(current.values()))
+
+    def rates(self, previous, current):
+        _, old_rows, new_rows = numpy.intersect1d(previous['keys'], current['keys'], assume_unique=True, return_indices=True)
+
+        old = previous['counters'][old_rows]
+        new = current['counters'][new_rows]
+        old_devices = previous['devices'][old_rows]
+        new_devices = current['devices'][new_rows]
+
+        elapsed = current['time'][new_devices] - previous['time'][old_devices]
+        rebooted = (current['uptime'][new_devices] < previous['uptime'][old_devices])[:, None]
+
+        # uint64 subtraction already wraps modulo 2**64
+        delta = new - old
+        decreased = new < old
+
+        if self.counter_bits < 64:
+            delta = numpy.where(decreased & ~rebooted, delta + numpy.uint64(1 << self.counter_bits), delta)
+            resets = numpy.broadcast_to(rebooted, delta.shape)
+        else:
+            resets = rebooted | decreased
+
+        # After a restart the counter itself is what was counted since
+        delta = numpy.where(resets, new, delta)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            rates = numpy.where(elapsed[:, None] > 0, delta / elapsed[:, None], numpy.nan)
+
+        return InterfaceRates(current['hosts'][new_rows], current['names'][new_rows], rates, elapsed, resets.any(axis=1))
+
+
+def stack(samples):
+    # One matrix for many devices: rows of all samples one after the other, 'devices' maps each row to its sample
+    samples = list(samples)
+    lengths = [len(sample) for sample in samples]
+    hosts = numpy.array([str(sample.host) for sample in samples], dtype=str)
+    names = numpy.concatenate([sample.names for sample in samples]) if samples else numpy.array([], dtype=str)
+
+    return {
+        "hosts": numpy.repeat(hosts, lengths),
+        "names": names,
+        "keys": numpy.char.add(numpy.char.add(numpy.repeat(hosts, lengths), "\t"), names),
+        "devices": numpy.repeat(numpy.arange(len(samples)), lengths),
+        "counters": numpy.concatenate([sample.counters for sample in samples]) if samples else numpy.empty((0, len(COUNTERS)), dtype=numpy.uint64),
+        "time": numpy.array([sample.time for sample in samples], dtype=float),
+        "uptime": numpy.array([numpy.nan if sample.uptime is None else sample.uptime for sample in samples], dtype=float),
+    }
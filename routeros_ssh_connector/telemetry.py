@@ -0,0 +1,178 @@
+import asyncio, re, time
+
+from routeros_ssh_connector.exceptions import MikrotikTimeoutError
+from routeros_ssh_connector.instrumentation import redact
+
+# Monitor commands print rates and sizes with units ('8.2kbps', '120.5MiB', '5%'), converted to plain numbers
+# (bits per second, bytes, percent) so samples can be compared and aggregated
+QUANTITY = re.compile(r'(\d+(?:\.\d+)?)(bps|kbps|Mbps|Gbps|B|KiB|MiB|GiB|%)?$')
+
+UNITS = {
+    None: 1, "%": 1,
+    "bps": 1, "kbps": 1000, "Mbps": 1000 ** 2, "Gbps": 1000 ** 3,
+    "B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3,
+}
+
+# ' 10:22:01 system,info,account user admin logged in', with a date before the time on older entries
+# ('jan/02 10:22:01') and on RouterOS v7 ('2024-01-02 10:22:01')
+LOG_LINE = re.compile(r'\s*((?:\S+ )?\d{1,2}:\d\d:\d\d) (\S+) (.*)$')
+
+def convert_quantity(value):
+    quantity = QUANTITY.match(value)
+
+    if quantity is None:
+        return value
+
+    number = float(quantity.group(1)) * UNITS[quantity.group(2)]
+
+    return int(number) if number.is_integer() else number
+
+
+class MonitorParser:
+    # 'key: value' blocks printed by monitor commands, one event per block. When several interfaces are monitored
+    # RouterOS prints one column per interface and every column becomes an event of its own
+    def __init__(self):
+        self.block = {}
+
+    def feed(self, line):
+        line = line.strip()
+
+        if line == "":
+            return self.flush()
+
+        key, separator, value = line.partition(":")
+        key = key.strip()
+
+        # Key hints such as '-- [Q quit|D dump|C-z pause]'
+        if separator == "" or " " in key:
+            return []
+
+        # A key seen twice starts the next sample, even if the blank line between samples got lost
+        events = self.flush() if key in self.block else []
+        self.block[key] = value.strip()
+
+        return events
+
+    def flush(self):
+        if not self.block:
+            return []
+
+        block, self.block = self.block, {}
+        received = time.time()
+        names = block.get("name", "").split()
+
+        if len(names) < 2:
+            return [dict({key: convert_quantity(value) for key, value in block.items()}, received=received)]
+
+        events = [{} for name in names]
+
+        for key, value in block.items():
+            columns = value.split()
+
+            for number, event in enumerate(events):
+                event[key] = convert_quantity(columns[number]) if len(columns) == len(names) else value
+
+        for event in events:
+            event['received'] = received
+
+        return events
+
+
+class LogParser:
+    # One event per log line: {"time": "10:22:01", "topics": ["system", "info"], "message": "...", "received": <epoch>}
+    def feed(self, line):
+        if line.strip() == "" or line.startswith("-- "):
+            return []
+
+        entry = LOG_LINE.match(line)
+
+        if entry is None:
+            return [{"time": None, "topics": [], "message": line.strip(), "received": time.time()}]
+
+        return [{"time": entry.group(1), "topics": entry.group(2).split(","), "message": entry.group(3), "received": time.time()}]
+
+    def flush(self):
+        return []
+
+
+class Subscription:
+    # Parsed events of a long running command on its own SSH channel. Iterating pulls the lines off the channel
+    # one at a time, so a consumer that falls behind makes the device wait instead of events queueing up.
+    # close() ends the iteration and may be called from any thread
+    def __init__(self, stream, parser):
+        self.stream = stream
+        self.parser = parser
+
+    def __iter__(self):
+        try:
+            for line in self.stream:
+                yield from self.parser.feed(line)
+
+            yield from self.parser.flush()
+
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.stream.close()
+
+
+class AsyncSubscription:
+    # asyncio version of Subscription on an asyncssh connection. The channel is opened when iteration starts, and
+    # cancelling the task that iterates closes it
+    def __init__(self, connection, command, parser, timeout):
+        self.connection = connection
+        self.command = command
+        self.parser = parser
+        self.timeout = timeout
+        self.process = None
+        self.closed = False
+
+    def __aiter__(self):
+        return self.events()
+
+    async def events(self):
+        if self.closed:
+            return
+
+        self.process = await self.connection.create_process(self.command)
+
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(self.process.stdout.readline(), self.timeout)
+
+                except asyncio.TimeoutError as e:
+                    raise MikrotikTimeoutError(f"Command '{redact(self.command)}' produced no output for {self.timeout} seconds") from e
+
+                if line == "":
+                    break
+
+                for event in self.parser.feed(line.rstrip("\r\n")):
+                    yield event
+
+            for event in self.parser.flush():
+                yield event
+
+        finally:
+            self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.closed = True
+
+        if self.process is not None:
+            self.process.close()
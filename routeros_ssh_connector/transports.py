@@ -0,0 +1,315 @@
+import re, time, socket, threading, uuid, paramiko
+
+from netmiko import Netmiko
+from netmiko.exceptions import NetmikoTimeoutException, NetmikoAuthenticationException, ReadTimeout
+from routeros_ssh_connector.exceptions import MikrotikConnectionError, MikrotikUnreachableError, MikrotikTimeoutError, MikrotikAuthenticationError
+from routeros_ssh_connector.instrumentation import redact
+
+SENTINEL = "__ROS_DONE_"
+BATCH_MARKER = "__ROS_BATCH_"
+
+# Same login options Netmiko appends: no colors, dumb terminal, 511 columns, 4098 rows
+LOGIN_OPTIONS = "+ct511w4098h"
+
+def put_marker(marker):
+    # The marker is built with string concatenation so the echoed command never matches it
+    split = len(marker) // 2
+
+    return f':put ("{marker[:split]}" . "{marker[split:]}")'
+
+
+def batch_script(commands, markers):
+    # A single line script aborts on the first failing command, which gives stop-on-error semantics
+    return "; ".join(f"{command}; {put_marker(marker)}" for command, marker in zip(commands, markers))
+
+
+def clean_output(output):
+    # The clean up Netmiko does on shell output: \n line endings and no leading or trailing blank space
+    return re.sub("\r+\n|\n\r|\r", "\n", output).strip()
+
+
+def split_batch_output(output, markers, prompt=None, echoes=()):
+    # Output before each marker belongs to its command. When a marker is missing its command failed,
+    # the remaining output is the error and later commands never ran (None). Lines with the prompt or
+    # with a typed-ahead command echoed on its own are dropped
+    results = []
+    position = 0
+
+    for marker in markers:
+        index = output.find(marker, position)
+
+        if index == -1:
+            break
+
+        results.append(output[position:index])
+        position = index + len(marker)
+
+    if len(results) < len(markers):
+        results.append(output[position:])
+
+    echoes = set(echo.strip() for echo in echoes)
+    results = ["\n".join(line for line in result.splitlines() if line.strip() not in echoes and line.strip() != "" and (prompt is None or prompt not in line)).strip()
+               for result in results]
+
+    return results + [None] * (len(markers) - len(results))
+
+
+class NetmikoTransport:
+    # Interactive shell backend: commands are typed on one channel and output is read until the prompt.
+    # The channel can only carry one exchange at a time, so threads sharing the transport take turns on a lock
+    def __init__(self, device, conn_timeout=5):
+        self.lock = threading.RLock()
+
+        try:
+            self.connection = Netmiko(**device, global_cmd_verify=False, conn_timeout=conn_timeout)
+
+        except NetmikoTimeoutException as e:
+            raise MikrotikUnreachableError("No response from device. Check device connection parameters") from e
+
+        except NetmikoAuthenticationException as e:
+            raise MikrotikAuthenticationError("Authentication failed. Check username and password") from e
+
+        except Exception as e:
+            raise MikrotikConnectionError(str(e)) from e
+
+    def send_command(self, command, timeout, sentinel=False):
+        with self.lock:
+            return self.exchange(command, timeout, sentinel)
+
+    def exchange(self, command, timeout, sentinel):
+        expect_string = None
+
+        if sentinel:
+            marker = SENTINEL + uuid.uuid4().hex[:12]
+            command = f"{command}; {put_marker(marker)}"
+            expect_string = re.escape(marker)
+
+        try:
+            output = self.connection.send_command(command, expect_string=expect_string, read_timeout=timeout, strip_prompt=not sentinel)
+
+            if sentinel:
+                output, tail = output.split(marker, 1)
+
+                # Consume the prompt printed after the marker so it doesn't leak into the next command, unless it
+                # already arrived in the same read as the marker
+                if self.connection.base_prompt not in tail:
+                    self.connection.read_until_prompt(read_timeout=timeout)
+
+        except ReadTimeout as e:
+            raise MikrotikTimeoutError(f"Command '{redact(command)}' did not finish in {timeout} seconds") from e
+
+        return output
+
+    def send_commands(self, commands, timeout):
+        with self.lock:
+            return [self.send_command(command, timeout) for command in commands]
+
+    def send_batch(self, commands, timeout, stop_on_error=False):
+        markers = [f"{BATCH_MARKER}{uuid.uuid4().hex[:12]}_{number}__" for number in range(len(commands))]
+
+        if stop_on_error:
+            return split_batch_output(self.send_command(batch_script(commands, markers), timeout), markers, self.connection.base_prompt)
+
+        # Every command is typed ahead in one write and the shell keeps going after errors
+        lines = []
+
+        for command, marker in zip(commands, markers):
+            lines.append(command)
+            lines.append(put_marker(marker))
+
+        try:
+            with self.lock:
+                self.connection.clear_buffer()
+                self.connection.write_channel(self.connection.RETURN.join(lines) + self.connection.RETURN)
+                output = self.connection.read_until_pattern(pattern=re.escape(markers[-1]), read_timeout=timeout)
+                self.connection.read_until_prompt(read_timeout=timeout)
+
+        except ReadTimeout as e:
+            raise MikrotikTimeoutError(f"Batch of {len(commands)} commands did not finish in {timeout} seconds") from e
+
+        return split_batch_output(self.connection.strip_ansi_escape_codes(output), markers, self.connection.base_prompt, lines)
+
+    def stream_command(self, command, timeout):
+        # Yields output lines as they arrive; timeout is the maximum idle time between reads. The command gets an
+        # exec channel of its own, so the shell lock is not held while the caller works on the lines
+        yield from self.open_stream(command, timeout)
+
+    def is_alive(self):
+        # Netmiko probes the shell by writing to it, which can't happen in the middle of another exchange.
+        # A transport busy with a command is alive as far as anyone can tell
+        if not self.lock.acquire(blocking=False):
+            return True
+
+        try:
+            return self.connection.is_alive()
+        finally:
+            self.lock.release()
+
+    def open_stream(self, command, timeout):
+        # Long running commands get an exec channel of their own on the same SSH session, so subscriptions
+        # never hold the shell that other commands take turns on
+        return ChannelStream(open_exec_channel(self.connection.remote_conn.get_transport(), command, timeout), command, timeout)
+
+    def set_keepalive(self, interval):
+        # SSH keepalives keep NAT and firewall state of an idle session from expiring
+        self.connection.remote_conn.get_transport().set_keepalive(interval)
+
+    def disconnect(self):
+        self.connection.disconnect()
+
+
+class ExecTransport:
+    # One-shot SSH exec requests: no prompt detection, no echo, clean output and exit status.
+    # Every command gets its own channel on a single authenticated paramiko transport
+    def __init__(self, device, conn_timeout=5, window_size=None, max_packet_size=None):
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        try:
+            self.client.connect(device['host'], port=device['port'], username=device['username'] + LOGIN_OPTIONS, password=device['password'],
+                                timeout=conn_timeout, banner_timeout=conn_timeout, auth_timeout=conn_timeout, look_for_keys=False, allow_agent=False)
+
+        except paramiko.AuthenticationException as e:
+            raise MikrotikAuthenticationError("Authentication failed. Check username and password") from e
+
+        except (socket.timeout, socket.error) as e:
+            raise MikrotikUnreachableError("No response from device. Check device connection parameters") from e
+
+        except paramiko.SSHException as e:
+            raise MikrotikConnectionError(str(e)) from e
+
+        # Closing a channel and opening the next one are two small writes in a row: without TCP_NODELAY the
+        # second one waits for the delayed ACK of the first and every command pays ~40ms
+        self.client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_command(self, command, timeout, sentinel=False):
+        # The channel closes when the command finishes, so sentinels are never needed here
+        return self.send_commands([command], timeout)[0]
+
+    def send_commands(self, commands, timeout, with_status=False):
+        # All channels are opened up front so the device works on them concurrently. with_status=True returns
+        # (output, exit status) pairs
+        deadline = time.monotonic() + timeout
+        channels = []
+        outputs = []
+
+        try:
+            # Opened inside the try, so the ones already open are closed if opening the next one fails
+            for command in commands:
+                channels.append(self.open_channel(command, timeout))
+
+            for command, channel in zip(commands, channels):
+                output, status = self.read_channel(command, channel, deadline)
+                outputs.append((output, status) if with_status else output)
+
+        finally:
+            for channel in channels:
+                channel.close()
+
+        return outputs
+
+    def send_batch(self, commands, timeout, stop_on_error=False):
+        if stop_on_error:
+            markers = [f"{BATCH_MARKER}{uuid.uuid4().hex[:12]}_{number}__" for number in range(len(commands))]
+
+            return split_batch_output(self.send_command(batch_script(commands, markers), timeout), markers)
+
+        # Exec requests run as scripts that abort on error, so independent commands go one per request,
+        # in order, over the already authenticated transport
+        return [self.send_command(command, timeout) for command in commands]
+
+    def stream_command(self, command, timeout):
+        # Yields output lines as they arrive on the channel; timeout is the maximum idle time between reads
+        yield from self.open_stream(command, timeout)
+
+    def open_stream(self, command, timeout):
+        return ChannelStream(self.open_channel(command, timeout), command, timeout)
+
+    def open_channel(self, command, timeout):
+        return open_exec_channel(self.client.get_transport(), command, timeout, self.window_size, self.max_packet_size)
+
+    def read_channel(self, command, channel, deadline):
+        chunks = []
+
+        try:
+            while True:
+                channel.settimeout(max(deadline - time.monotonic(), 0.001))
+                data = channel.recv(65536)
+
+                if not data:
+                    break
+
+                chunks.append(data)
+
+        except socket.timeout as e:
+            raise MikrotikTimeoutError(f"Command '{redact(command)}' did not finish in time") from e
+
+        # (output, exit status) of this channel only, cleaned up like Netmiko's so both backends return the same strings
+        return clean_output(b"".join(chunks).decode("utf-8", errors="replace")), channel.recv_exit_status()
+
+    def is_alive(self):
+        transport = self.client.get_transport()
+
+        return transport is not None and transport.is_active()
+
+    def set_keepalive(self, interval):
+        self.client.get_transport().set_keepalive(interval)
+
+    def disconnect(self):
+        self.client.close()
+
+
+def open_exec_channel(transport, command, timeout, window_size=None, max_packet_size=None):
+    channel = transport.open_session(window_size=window_size, max_packet_size=max_packet_size, timeout=timeout)
+
+    try:
+        channel.exec_command(command)
+
+    except BaseException:
+        channel.close()
+        raise
+
+    return channel
+
+
+class ChannelStream:
+    # Output lines of one exec channel as they arrive; timeout is the maximum idle time between reads (None waits
+    # forever). Lines are only read when asked for, so a slow reader fills the SSH window and the device stops
+    # sending instead of output piling up in memory. The channel is closed when iteration ends or is abandoned,
+    # and close() may be called from another thread to stop a reader
+    def __init__(self, channel, command, timeout):
+        self.channel = channel
+        self.command = command
+        self.timeout = timeout
+
+    def __iter__(self):
+        pending = b""
+        self.channel.settimeout(self.timeout)
+
+        try:
+            while True:
+                try:
+                    data = self.channel.recv(65536)
+
+                except socket.timeout as e:
+                    raise MikrotikTimeoutError(f"Command '{redact(self.command)}' produced no output for {self.timeout} seconds") from e
+
+                if not data:
+                    break
+
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+
+                for line in lines:
+                    yield line.rstrip(b"\r").decode("utf-8", errors="replace")
+
+            if pending:
+                yield pending.rstrip(b"\r").decode("utf-8", errors="replace")
+
+        finally:
+            self.close()
+
+    def close(self):
+        self.channel.close()
@@ -0,0 +1,30 @@
+import os, sys
+
+import pytest
+
+# The fake device lives with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from fake_routeros import FakeRouterOSServer
+from routeros_ssh_connector import MikrotikDevice
+
+
+@pytest.fixture(scope="session")
+def server():
+    server = FakeRouterOSServer(routes=300)
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+@pytest.fixture(params=["netmiko", "exec"])
+def router(request, server):
+    server.router.errors.clear()
+    device = MikrotikDevice(command_timeout=10)
+    device.connect(server.host, server.username, server.password, port=server.port, exit_on_error=False, backend=request.param)
+
+    yield device
+
+    device.disconnect()
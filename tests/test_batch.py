@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from routeros_ssh_connector import AsyncMikrotikDevice
+
+
+def test_results_match_the_methods(router):
+    results = router.batch().create_route("10.9.0.0/24", "192.168.0.1", 1).update_identity("MikroTik").execute()
+
+    assert results == [
+        {"method": "create_route", "command": "/ip route add dst-address=10.9.0.0/24 gateway=192.168.0.1 distance=1 disabled=no", "result": None},
+        {"method": "update_identity", "command": "/system identity set name=MikroTik", "result": None},
+    ]
+
+
+def test_errors_are_reported_per_command(router, server):
+    server.router.errors["/system identity set"] = "failure: not allowed"
+    batch = router.batch()
+    batch.update_identity("X").create_user("bob", "secret", "read").add("/ip service set telnet disabled=yes")
+
+    assert [result['result'] for result in batch.execute()] == ["failure: not allowed", None, None]
+    assert len(batch) == 0
+
+
+def test_stop_on_error_skips_the_rest(router, server):
+    server.router.errors["/system identity set"] = "failure: not allowed"
+    batch = router.batch(window=2)
+    batch.create_user("bob", "secret", "read").update_identity("X").create_user("eve", "secret", "read").update_user("eve", "", "full")
+    results = batch.execute(stop_on_error=True)
+
+    assert [result['result'] for result in results] == [None, "failure: not allowed",
+                                                        "ERROR: Not executed because a previous command failed",
+                                                        "ERROR: Not executed because a previous command failed"]
+
+
+def test_queued_writes_invalidate_the_cache_when_executed(router):
+    router.enable_cache(ttl=60)
+    router.get_identity()
+    batch = router.batch().update_identity("MikroTik")
+    router.get_identity()
+
+    assert router.cache_stats()['hits'] == 1
+
+    batch.execute()
+    router.get_identity()
+
+    assert router.cache_stats() == {"hits": 1, "misses": 2, "size": 1, "maxsize": 256}
+
+
+def test_methods_that_read_or_upload_cannot_be_queued(router):
+    batch = router.batch()
+
+    for name in ("create_dhcp_server", "update_dhcp_server_network", "create_routes", "update_system"):
+        with pytest.raises(AttributeError):
+            getattr(batch, name)
+
+    with pytest.raises(AttributeError):
+        batch.get_identity
+
+
+def test_async_batch(server):
+    server.router.errors.clear()
+    server.router.errors["/system identity set"] = "failure: not allowed"
+
+    async def main():
+        device = AsyncMikrotikDevice(command_timeout=10)
+        await device.connect(server.host, server.username, server.password, port=server.port)
+
+        try:
+            return await device.batch().update_identity("X").create_user("bob", "secret", "read").execute(stop_on_error=True)
+
+        finally:
+            await device.disconnect()
+            server.router.errors.clear()
+
+    assert [result['result'] for result in asyncio.run(main())] == ["failure: not allowed", "ERROR: Not executed because a previous command failed"]
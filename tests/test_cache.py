@@ -0,0 +1,157 @@
+import asyncio, threading, time
+
+import pytest
+
+from routeros_ssh_connector.cache import TTLCache, SingleFlight, ALL
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+
+    return now
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache(ttl=10, ttls={"get_identity": 60})
+    cache.set(("get_routes",), "routes", {"routes"})
+    cache.set(("get_identity",), "R1", {"identity"})
+
+    assert cache.get(("get_routes",)) == (True, "routes")
+
+    clock[0] += 11
+
+    assert cache.get(("get_routes",)) == (False, None)
+    assert cache.get(("get_identity",)) == (True, "R1")
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 1, "maxsize": 256}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set(("a",), 1, set())
+    cache.set(("b",), 2, set())
+    cache.get(("a",))
+    cache.set(("c",), 3, set())
+
+    assert cache.get(("b",)) == (False, None)
+    assert cache.get(("a",)) == (True, 1)
+
+
+def test_invalidate_drops_matching_tags_only():
+    cache = TTLCache()
+    cache.set(("get_users",), [], {"users"})
+    cache.set(("get_routes",), [], {"routes"})
+    cache.set(("send_command",), "", {ALL})
+    cache.invalidate("users")
+
+    assert cache.get(("get_users",))[0] is False
+    assert cache.get(("get_routes",))[0] is True
+    assert cache.get(("send_command",))[0] is False
+
+    cache.invalidate(ALL)
+
+    assert cache.stats()['size'] == 0
+
+
+def test_results_read_before_an_invalidation_are_not_stored():
+    cache = TTLCache()
+    generation = cache.generation
+    cache.invalidate("identity")
+    cache.set(("get_identity",), "stale", {"identity"}, generation)
+
+    assert cache.get(("get_identity",)) == (False, None)
+
+
+def test_single_flight_shares_one_call():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", load))) for _ in range(5)]
+
+    for thread in threads:
+        thread.start()
+
+    while flights.shared < 4:
+        time.sleep(0.01)
+
+    release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [(False, "value")] + [(True, "value")] * 4
+
+
+def test_single_flight_shares_errors_and_forgets():
+    flights = SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flights.do("key", fail)
+
+    assert flights.do("key", lambda: 1) == (False, 1)
+
+
+def test_single_flight_async():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async("key", load) for _ in range(3)))
+
+    assert sorted(asyncio.run(main())) == [(False, "value"), (True, "value"), (True, "value")]
+    assert len(calls) == 1
+
+
+def commands_sent(router):
+    events = []
+    router.add_hook(lambda event: events.append(event['command']) if event['kind'] == "command" else None)
+
+    return events
+
+
+def test_device_cache_hits_and_writes_invalidate(router):
+    router.enable_cache(ttl=60)
+    identity = router.get_identity()
+    commands = commands_sent(router)
+
+    assert router.get_identity() == identity
+    assert commands == []
+
+    router.update_identity("MikroTik")
+    router.get_identity()
+
+    assert commands == ["/system identity set name=MikroTik", "/system identity print"]
+    assert router.cache_stats()['hits'] == 1
+
+
+def test_device_returns_copies(router):
+    router.enable_cache(ttl=60)
+    router.get_users().append("changed")
+
+    assert "changed" not in router.get_users()
+
+
+def test_without_cache_every_call_runs(router):
+    commands = commands_sent(router)
+    router.get_identity()
+    router.get_identity()
+
+    assert commands == ["/system identity print"] * 2
+    assert router.cache_stats() is None
@@ -0,0 +1,47 @@
+import os
+
+from routeros_ssh_connector import BackupPipeline, MikrotikDevice
+
+
+def failing_export(timeout=None):
+    raise OSError("Export failed")
+
+
+class Manager:
+    # Hands out devices whose export fails after the backup was created
+    def __init__(self, server):
+        self.server = server
+
+    def get(self, **host):
+        device = MikrotikDevice(command_timeout=10)
+        device.connect(**host, exit_on_error=False, backend="exec")
+
+        if host['ip_address'] == "localhost":
+            device.save_export = failing_export
+
+        return device
+
+
+def inventory(server, *hosts):
+    return [{"ip_address": host, "username": server.username, "password": server.password, "port": server.port} for host in hosts]
+
+
+def device_files(server):
+    return sorted(name for name in os.listdir(server.root) if name.endswith((".backup", ".rsc")))
+
+
+def test_files_are_downloaded_verified_and_removed(server, tmp_path):
+    results = BackupPipeline(inventory(server, server.host), str(tmp_path), manager=Manager(server)).run_all()
+
+    assert results[0]['ok'] and [file['kind'] for file in results[0]['files']] == ["backup", "export"]
+    assert all(os.path.getsize(file['path']) == file['size'] for file in results[0]['files'])
+    assert device_files(server) == []
+
+
+def test_files_of_a_failed_generation_are_removed(server, tmp_path):
+    results = BackupPipeline(inventory(server, "localhost"), str(tmp_path), manager=Manager(server)).run_all()
+
+    assert not results[0]['ok']
+    assert results[0]['error'] == {"type": "OSError", "message": "Export failed"}
+    assert results[0]['files'] == []
+    assert device_files(server) == []
@@ -0,0 +1,54 @@
+import pytest
+
+from routeros_ssh_connector import MikrotikDevice
+
+
+@pytest.fixture
+def device():
+    return MikrotikDevice()
+
+
+@pytest.mark.parametrize("value, quoted", [
+    ("ether1", '"ether1"'),
+    ('say "hi"', '"say \\"hi\\""'),
+    ("back\\slash", '"back\\\\slash"'),
+    ("$var", '"\\$var"'),
+    ("what?", '"what\\?"'),
+    ("line\nbreak\r\ttab", '"line\\nbreak\\r\\ttab"'),
+    ("bell\x07 del\x7f", '"bell\\07 del\\7F"'),
+    (42, '"42"'),
+])
+def test_quote_value_escapes_specials(device, value, quoted):
+    assert device.quote_value(value) == quoted
+
+
+def test_quoted_value_cannot_start_a_command(device):
+    quoted = device.quote_value('x" ; /system reboot ; :put "\n/system reset-configuration')
+
+    assert "\n" not in quoted
+    assert quoted.count('"') - quoted.count('\\"') == 2
+
+
+def test_where_clause(device):
+    assert device.where_clause({"name": "ether1", "disabled": False, "mtu": 1500}) == 'name="ether1" and disabled=no and mtu=1500'
+    assert device.where_clause("mtu>1500") == "mtu>1500"
+
+
+@pytest.mark.parametrize("name", ["name=x", "name]", "a b", "1st", "", "name;"])
+def test_invalid_property_names_are_rejected(device, name):
+    with pytest.raises(ValueError):
+        device.where_clause({name: "x"})
+
+    with pytest.raises(ValueError):
+        device.filtered("/interface print", fields=[name])
+
+
+def test_filtered_puts_proplist_before_where(device):
+    assert device.filtered("/user print", {"group": "full"}, ["name", "group"]) == '/user print proplist=name,group where group="full"'
+    assert device.filtered("/user print", {}) == "/user print"
+
+
+def test_filters_run_on_the_device(router):
+    assert [user['username'] for user in router.get_users(where={"group": "full"})] == ["admin"]
+    assert router.get_services(where={"name": 'www" or name="ssh'}) == []
+    assert [service['name'] for service in router.get_services(where={"disabled": True})] == ["telnet", "ftp"]
@@ -0,0 +1,108 @@
+import asyncio, ipaddress, os
+
+from routeros_ssh_connector import AsyncMikrotikDevice, RouteTable, route_from_line
+
+
+def table(*routes):
+    return RouteTable({"flags": flags, "destination": destination, "gateway": gateway, "distance": distance}
+                      for flags, destination, gateway, distance in routes)
+
+
+def test_lookup_picks_longest_prefix():
+    routes = table(("AS", "0.0.0.0/0", "192.168.0.1", "1"),
+                   ("AS", "10.0.0.0/8", "192.168.0.2", "1"),
+                   ("AS", "10.1.0.0/16", "192.168.0.3", "1"),
+                   ("AS", "10.1.2.0/24", "192.168.0.4", "1"))
+
+    assert routes.lookup("10.1.2.3")['gateway'] == "192.168.0.4"
+    assert routes.lookup("10.1.3.3")['gateway'] == "192.168.0.3"
+    assert routes.lookup("10.2.0.1")['gateway'] == "192.168.0.2"
+    assert routes.lookup("8.8.8.8")['gateway'] == "192.168.0.1"
+    assert routes.lookup(ipaddress.ip_address("10.1.2.255"))['destination'] == "10.1.2.0/24"
+    assert routes.lookup(int(ipaddress.ip_address("10.1.2.1")))['destination'] == "10.1.2.0/24"
+
+
+def test_lookup_prefers_active_then_lowest_distance_and_skips_disabled():
+    routes = table(("S", "10.0.0.0/24", "192.168.0.1", "1"),
+                   ("AS", "10.0.0.0/24", "192.168.0.2", "5"),
+                   ("S", "10.0.0.0/24", "192.168.0.3", "2"),
+                   ("XS", "10.0.0.0/25", "192.168.0.4", "1"))
+
+    assert routes.lookup("10.0.0.1")['gateway'] == "192.168.0.2"
+
+    routes = table(("S", "10.0.0.0/24", "192.168.0.1", "3"), ("S", "10.0.0.0/24", "192.168.0.3", "2"))
+
+    assert routes.lookup("10.0.0.1")['gateway'] == "192.168.0.3"
+
+
+def test_lookup_keeps_ipv4_and_ipv6_apart():
+    routes = table(("AS", "::/0", "fe80::1", "1"), ("AS", "2001:db8::/32", "fe80::2", "1"))
+
+    assert routes.lookup("2001:db8::1")['gateway'] == "fe80::2"
+    assert routes.lookup("2001:db9::1")['gateway'] == "fe80::1"
+    assert routes.lookup("10.0.0.1") is None
+
+
+def test_route_from_line_reads_quoted_comments():
+    route = route_from_line(' 3 AS  comment="via gateway=1.1.1.1 " dst-address=10.3.0.0/16 gateway=192.168.0.9 distance=4 scope=30\n')
+
+    assert route.as_dict() == {"flags": "AS", "destination": "10.3.0.0/16", "gateway": "192.168.0.9", "distance": "4"}
+    assert route_from_line("Flags: X - disabled, A - active") is None
+
+
+def test_diff_reports_added_removed_and_changed():
+    old = table(("AS", "10.0.0.0/24", "192.168.0.1", "1"), ("AS", "10.0.1.0/24", "192.168.0.1", "1"))
+    new = table(("AS", "10.0.0.0/24", "192.168.0.1", "2"), ("AS", "10.0.2.0/24", "192.168.0.1", "1"))
+    changes = old.diff(new)
+
+    assert [route['destination'] for route in changes['added']] == ["10.0.2.0/24"]
+    assert [route['destination'] for route in changes['removed']] == ["10.0.1.0/24"]
+    assert changes['changed'] == [{"old": old[0], "new": new[0]}]
+
+
+def test_get_routes_from_device(router, server):
+    routes = router.get_routes()
+
+    assert len(routes) == server.router.route_count
+    assert routes[1] == {"flags": "ADS", "destination": "10.0.1.0/24", "gateway": "192.0.0.2", "distance": "2"}
+    assert routes.lookup("10.0.1.77")['gateway'] == "192.0.0.2"
+    assert router.get_routes(where={"gateway": "192.0.0.2"}, fields=["dst-address"]) == [{"dst-address": "10.0.1.0/24"}, {"dst-address": "10.0.255.0/24"}]
+
+
+def test_reading_goes_on_when_the_sftp_session_is_dropped(router, server):
+    content = os.urandom(200000)
+
+    with open(os.path.join(server.root, "blocks.bin"), "wb") as target:
+        target.write(content)
+
+    router.sftp_options['prefetch'] = False
+    blocks = router.read_blocks("/blocks.bin", size=1000)
+    first = next(blocks)
+    dropped = router.sftp_transport
+    dropped.close()
+
+    assert first + b"".join(blocks) == content
+    assert router.sftp_transport is not dropped
+
+
+def test_async_reading_goes_on_when_the_sftp_client_is_closed(server):
+    content = os.urandom(200000)
+
+    with open(os.path.join(server.root, "blocks.bin"), "wb") as target:
+        target.write(content)
+
+    async def main():
+        device = AsyncMikrotikDevice(command_timeout=10)
+        await device.connect(server.host, server.username, server.password, port=server.port)
+
+        try:
+            blocks = device.read_blocks("/blocks.bin", size=1000)
+            first = await blocks.__anext__()
+            device.sftp.exit()
+
+            return first + b"".join([block async for block in blocks])
+
+        finally:
+            await device.disconnect()
+
+    assert asyncio.run(main()) == content
@@ -0,0 +1,80 @@
+from routeros_ssh_connector import ConfigSnapshot, reconcile
+
+
+def snapshot(*lines):
+    return ConfigSnapshot.from_export("\n".join(("# jun/01/2021 19:04:03 by RouterOS 6.49.10",) + lines))
+
+
+def test_from_export_keys_items():
+    config = snapshot('/ip address add address=10.0.0.1/24 comment="core net" interface=ether3',
+                      "/interface ethernet set [ find default-name=ether1 ] mtu=1400",
+                      "/system identity set name=R1")
+
+    assert config.header == "jun/01/2021 19:04:03 by RouterOS 6.49.10"
+    assert list(config) == [
+        ("/ip address", "address=10.0.0.1/24 interface=ether3", {"action": "add", "selector": "", "properties": {"address": "10.0.0.1/24", "comment": '"core net"', "interface": "ether3"}}),
+        ("/interface ethernet", "[ find default-name=ether1 ]", {"action": "set", "selector": "[ find default-name=ether1 ]", "properties": {"mtu": "1400"}}),
+        ("/system identity", "", {"action": "set", "selector": "", "properties": {"name": "R1"}}),
+    ]
+
+
+def test_diff_and_reconcile():
+    old = snapshot("/ip address add address=10.0.0.1/24 interface=ether3",
+                   "/ip address add address=10.0.1.1/24 interface=ether4",
+                   "/system identity set name=R1")
+    new = snapshot('/ip address add address=10.0.0.1/24 comment="core net" interface=ether3',
+                   "/ip address add address=10.0.2.1/24 interface=ether5",
+                   "/system identity set name=R2")
+    changes = old.diff(new)
+
+    assert [change['key'] for change in changes['removed']] == ["address=10.0.1.1/24 interface=ether4"]
+    assert [change['key'] for change in changes['added']] == ["address=10.0.2.1/24 interface=ether5"]
+    assert changes['changed'][0]['properties'] == {"comment": (None, '"core net"')}
+    assert reconcile(changes) == [
+        "/ip address remove [ find where address=10.0.1.1/24 and interface=ether4 ]",
+        '/ip address set [ find where address=10.0.0.1/24 and interface=ether3 ] comment="core net"',
+        "/ip address add address=10.0.2.1/24 interface=ether5",
+        "/system identity set name=R2",
+    ]
+    assert old.diff(old) == {"added": [], "removed": [], "changed": [], "sections": []}
+
+
+def test_dropped_properties_are_unset_in_place():
+    old = snapshot("/ip firewall nat add action=masquerade chain=srcnat name=wan out-interface=ether1 comment=old")
+    new = snapshot("/ip firewall nat add action=masquerade chain=srcnat name=wan out-interface=ether1")
+
+    assert reconcile(old.diff(new)) == ["/ip firewall nat unset [ find where name=wan ] value-name=comment"]
+
+
+def test_items_without_a_unique_selector_are_left_to_the_user():
+    old = snapshot("/ip firewall filter add action=drop chain=input protocol=icmp",
+                   "/ip firewall filter add action=drop chain=input protocol=icmp",
+                   "/ip firewall filter add action=drop chain=input protocol=tcp",
+                   "/ip firewall filter add action=drop chain=input in-interface=ether1 protocol=tcp")
+    new = snapshot("/ip firewall filter add action=drop chain=input protocol=icmp",
+                   "/ip firewall filter add action=drop chain=input in-interface=ether1 protocol=tcp")
+    commands = reconcile(old.diff(new))
+
+    # The icmp duplicate and the tcp rule, whose properties are a subset of another rule's, can't be told apart
+    assert len(commands) == 2
+    assert all(command.startswith("# /ip firewall filter add ") and "remove it by hand" in command for command in commands)
+
+
+def test_items_without_properties_are_never_removed():
+    old = snapshot("/interface bridge add", "/interface bridge add name=br1")
+    new = snapshot("/interface bridge add name=br1")
+
+    assert reconcile(old.diff(new)) == ["# /interface bridge add: no selector finds only this item, remove it by hand"]
+
+
+def test_save_and_load(tmp_path):
+    config = snapshot("/ip address add address=10.0.0.1/24 interface=ether3", "/system identity set name=R1")
+
+    assert ConfigSnapshot.load(config.save(str(tmp_path / "config.json.gz"))) == config
+
+
+def test_snapshot_from_device(router):
+    config = router.get_config_snapshot()
+
+    assert len(config) == 202
+    assert config.sections['/system identity'][""]['properties'] == {"name": "MikroTik"}
@@ -0,0 +1,63 @@
+import asyncio
+
+import paramiko, pytest
+
+from routeros_ssh_connector import AsyncMikrotikDevice, MikrotikDevice
+from routeros_ssh_connector.transports import clean_output
+
+COMMANDS = ["/system identity print", ":put [/ip cloud get dns-name]", "/user print"]
+
+
+def test_clean_output():
+    assert clean_output("\r\n  name: R1\r\n  x\r\r\n\n\r") == "name: R1\n  x"
+
+
+def test_backends_return_the_same_strings(router):
+    assert router.run_command("/system identity print") == "name: MikroTik"
+    assert router.enable_cloud_dns() == "abcd1234.sn.mynetname.net"
+    assert all("\r" not in output for output in router.run_commands(COMMANDS))
+    assert router.run_batch(COMMANDS[:2]) == router.run_batch(COMMANDS[:2], stop_on_error=True) == ["name: MikroTik", "abcd1234.sn.mynetname.net"]
+
+
+def test_async_backend_returns_the_same_strings(server):
+    async def main():
+        device = AsyncMikrotikDevice(command_timeout=10)
+        await device.connect(server.host, server.username, server.password, port=server.port)
+
+        try:
+            return await device.run_commands(COMMANDS), await device.run_batch(COMMANDS[:2])
+
+        finally:
+            await device.disconnect()
+
+    outputs, batch = asyncio.run(main())
+
+    assert outputs[:2] == ["name: MikroTik", "abcd1234.sn.mynetname.net"]
+    assert all("\r" not in output for output in outputs)
+    assert batch == outputs[:2]
+
+
+def test_channels_are_closed_when_one_fails_to_open(server):
+    device = MikrotikDevice(command_timeout=10)
+    device.connect(server.host, server.username, server.password, port=server.port, exit_on_error=False, backend="exec")
+    open_channel = device.transport.open_channel
+    opened = []
+
+    def failing_open_channel(command, timeout):
+        if len(opened) == 2:
+            raise paramiko.ChannelException(1, "Administratively prohibited")
+
+        opened.append(open_channel(command, timeout))
+
+        return opened[-1]
+
+    device.transport.open_channel = failing_open_channel
+
+    try:
+        with pytest.raises(paramiko.ChannelException):
+            device.run_commands(COMMANDS)
+
+        assert len(opened) == 2 and all(channel.closed for channel in opened)
+
+    finally:
+        device.disconnect()